@@ -0,0 +1,56 @@
+# Run from the repository root with: PYTHONPATH=src:. python benchmarks/build_fields.py
+import textwrap
+import timeit
+
+from carim_discord_bot.discord_client import discord_service
+
+SIZES = (10000, 20000, 40000)
+
+
+def previous_build_fields(server_name, rolled_up_log, formatted=False):
+    # The previous packer, which re-summed the message length for every line
+    messages = []
+    fields = []
+    current_field = {
+        'name': f'**{server_name}**',
+        'value': '```\n' if formatted else ''
+    }
+    validated_log = []
+    for log_line in rolled_up_log:
+        validated_log += textwrap.wrap(log_line, 1000)
+    for log_line in validated_log:
+        if sum(discord_service.get_field_length(f) for f in fields) > 4096:
+            messages.append(fields)
+            fields = []
+
+        if not current_field['value'] == '' and discord_service.get_field_length(current_field) + len(log_line) > 1000:
+            current_field['value'] += '```'
+            fields.append(current_field)
+            current_field = {
+                'name': f'{server_name}' if formatted else f'**{server_name}**',
+                'value': '```\n' if formatted else ''
+            }
+        current_field['value'] += log_line + '\n'
+    current_field['value'] += '```'
+    fields.append(current_field)
+    messages.append(fields)
+    return messages
+
+
+def get_lines(count):
+    return [f'12:00:{i % 60:02} Player "Survivor{i % 60}" (id=ABCDEFGHIJKLMNOPQRSTUVWXYZ{i % 60}=) '
+            f'has been disconnected' for i in range(count)]
+
+
+def main():
+    for size in SIZES:
+        lines = get_lines(size)
+        for name, build in (('previous', previous_build_fields), ('linear', discord_service.build_fields)):
+            seconds = min(timeit.repeat(lambda: build('server', lines), number=1, repeat=3))
+            messages = build('server', lines)
+            print(f'{size:6} lines {name:9} {seconds * 1000:8.1f} ms  '
+                  f'{len(messages):4} messages {sum(len(m) for m in messages):5} fields')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# Run from the repository root with: PYTHONPATH=src:. python benchmarks/cftools_requests.py
+import asyncio
+import logging
+import threading
+import urllib.request
+
+from aiohttp import web
+
+from carim_discord_bot.cftools import http_client
+
+REQUESTS = 20
+LATENCY = 0.1
+TICK = 0.01
+
+
+async def leaderboard_handler(request):
+    await asyncio.sleep(LATENCY)
+    return web.json_response({'users': [{'rank': 1, 'latest_name': 'Survivor', 'kills': 3}]})
+
+
+def serve(started):
+    # The stub API runs on a loop of its own, so a client blocking the bot's loop doesn't stop it answering
+    loop = asyncio.new_event_loop()
+    app = web.Application()
+    app.add_routes([web.get('/leaderboard', leaderboard_handler)])
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', 0).start())
+    host, port = runner.addresses[0][:2]
+    started.append(f'http://{host}:{port}/leaderboard')
+    loop.run_forever()
+
+
+async def blocking_request(url):
+    # The previous services called a blocking HTTP client straight from the coroutine
+    with urllib.request.urlopen(url) as response:
+        return response.status
+
+
+async def pooled_request(client, url):
+    response = await client.request('GET', url)
+    return response.status_code
+
+
+async def run_requests(request):
+    # A ticker stands in for the rest of the bot, recording the longest it had to wait for the loop
+    loop = asyncio.get_running_loop()
+    longest_stall = 0
+
+    async def tick():
+        nonlocal longest_stall
+        while True:
+            before = loop.time()
+            await asyncio.sleep(TICK)
+            longest_stall = max(longest_stall, loop.time() - before - TICK)
+
+    ticker = asyncio.create_task(tick())
+    await asyncio.sleep(TICK)
+    start = loop.time()
+    await asyncio.gather(*(request() for _ in range(REQUESTS)))
+    elapsed = loop.time() - start
+    # lets the ticker wake up and notice how late it is
+    await asyncio.sleep(TICK * 2)
+    ticker.cancel()
+    return elapsed, longest_stall
+
+
+async def main():
+    logging.disable(logging.CRITICAL)
+    started = list()
+    threading.Thread(target=serve, args=(started,), daemon=True).start()
+    while not started:
+        await asyncio.sleep(0.01)
+    url = started[0]
+    print(f'{REQUESTS} leaderboard requests, {LATENCY * 1000:.0f}ms latency')
+    elapsed, stall = await run_requests(lambda: blocking_request(url))
+    print(f'blocking client: {elapsed:6.2f}s, loop stalled up to {stall * 1000:5.0f}ms')
+    client = http_client.HttpClient()
+    elapsed, stall = await run_requests(lambda: pooled_request(client, url))
+    await client.close()
+    print(f'pooled client:   {elapsed:6.2f}s, loop stalled up to {stall * 1000:5.0f}ms')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,112 @@
+# Run from the repository root with: PYTHONPATH=src:. python benchmarks/command_parsing.py
+import argparse
+import shlex
+import time
+
+from carim_discord_bot.discord_client import arguments
+
+ITERATIONS = 20000
+MESSAGES = [
+    '--status',
+    '--help',
+    '--command players',
+    '--command "say -1 restart in 5 minutes"',
+    '--shutdown 300',
+    '--skip 2',
+    '--create_priority 5f0c1e0e1a2b3c4d "donated again" 30',
+    '--stats 76561198000000000 1',
+    '--leaderboard kills',
+    '--stats 76561198000000000 0 1',
+    '--leaderboard kills nonnumber',
+    '--shutdown soon',
+    '--anyone on tonight',
+    '-- just chatting',
+]
+
+
+class BotArgumentParser(argparse.ArgumentParser):
+    def error(self, message):
+        raise ValueError()
+
+
+class OptionalIndexAction(argparse.Action):
+    def __init__(self, option_strings, dest, **kwargs):
+        super().__init__(option_strings, dest, nargs='+', **kwargs)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        if len(values) > 2:
+            raise argparse.ArgumentError(self, 'too many arguments')
+        if len(values) == 1:
+            values += [0]
+        values[1] = int(values[1])
+        setattr(namespace, self.dest, values)
+
+
+def build_previous_parsers():
+    # The argparse parsers that every message starting with -- used to go through
+    message_parser = BotArgumentParser(prog='', add_help=False)
+    for flag in ('--help', '--secret', '--about', '--version', '--list_priority', '--status', '--kill'):
+        message_parser.add_argument(flag, action='store_true')
+    message_parser.add_argument('--create_priority', nargs=3, type=str, default=argparse.SUPPRESS)
+    message_parser.add_argument('--revoke_priority', type=str, default=argparse.SUPPRESS)
+    message_parser.add_argument('--command', nargs='?', type=str, default=argparse.SUPPRESS)
+    message_parser.add_argument('--shutdown', nargs='?', type=int, default=argparse.SUPPRESS)
+    message_parser.add_argument('--skip', type=int, default=argparse.SUPPRESS)
+    user_message_parser = BotArgumentParser(prog='', add_help=False)
+    user_message_parser.add_argument('--leaderboard', action=OptionalIndexAction, default=argparse.SUPPRESS)
+    user_message_parser.add_argument('--stats', action=OptionalIndexAction, type=int, default=argparse.SUPPRESS)
+    return message_parser, user_message_parser
+
+
+def previous_parse(parser, content):
+    args = shlex.split(content, comments=True)
+    try:
+        parsed_args, remaining_args = parser.parse_known_args(args)
+    except (ValueError, argparse.ArgumentError):
+        return None
+    if remaining_args == args:
+        return None
+    return parsed_args
+
+
+def grammar_parse(grammar, content):
+    return grammar.parse(content)
+
+
+def main():
+    message_parser, user_message_parser = build_previous_parsers()
+    runs = (
+        ('previous', previous_parse, message_parser, user_message_parser),
+        ('grammar', grammar_parse, arguments.message_grammar, arguments.user_message_grammar),
+    )
+    print(f'{len(MESSAGES)} messages parsed by the admin and user grammars, {ITERATIONS} times')
+    for name, parse, admin, user in runs:
+        start = time.perf_counter()
+        for _ in range(ITERATIONS):
+            for content in MESSAGES:
+                parse(admin, content)
+                parse(user, content)
+        elapsed = time.perf_counter() - start
+        print(f'{name:9} {elapsed / (ITERATIONS * len(MESSAGES)) * 1e6:6.2f} us per message')
+
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        argparse_help(message_parser)
+    print(f'help      {(time.perf_counter() - start) / ITERATIONS * 1e6:6.2f} us formatted by argparse')
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        arguments.format_help()
+    print(f'help      {(time.perf_counter() - start) / ITERATIONS * 1e6:6.2f} us cached')
+
+
+def argparse_help(parser):
+    formatter = parser._get_formatter()
+    for action_group in parser._action_groups:
+        formatter.start_section(action_group.title)
+        formatter.add_arguments(action_group._group_actions)
+        formatter.end_section()
+    return formatter.format_help()
+
+
+if __name__ == '__main__':
+    main()
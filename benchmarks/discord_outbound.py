@@ -0,0 +1,113 @@
+# Run from the repository root with: PYTHONPATH=src:. python benchmarks/discord_outbound.py
+import asyncio
+import re
+import statistics
+
+from carim_discord_bot.discord_client import discord_service, outbound
+
+# One benchmark second is SCALE real seconds so the 10 second windows of the old flush loop stay quick
+SCALE = 0.02
+SERVERS = ['alpha', 'bravo', 'charlie']
+LINES_PER_SECOND = 200
+FLOOD_SECONDS = 20
+SEND_LATENCY = 0.2
+LINE_ID = re.compile(r'#(\d+)')
+
+
+class FakeChannel:
+    # Sends that exceed Discord's limit of 5 messages per 5 seconds wait like a 429 retry would
+    def __init__(self):
+        self.limit = outbound.TokenBucket(outbound.CHANNEL_RATE / SCALE, outbound.CHANNEL_BURST)
+        self.calls = 0
+        self.created = dict()
+        self.latencies = list()
+
+    async def send(self, embed):
+        await self.limit.acquire()
+        await asyncio.sleep(SEND_LATENCY * SCALE)
+        self.calls += 1
+        now = asyncio.get_event_loop().time()
+        for field in embed['fields']:
+            for line_id in LINE_ID.findall(field['value']):
+                self.latencies.append((now - self.created.pop(int(line_id))) / SCALE)
+
+
+async def flood(channel, add_log):
+    line_id = 0
+    for _ in range(FLOOD_SECONDS * 10):
+        for server_name in SERVERS:
+            lines = list()
+            for _ in range(LINES_PER_SECOND // 10 // len(SERVERS)):
+                channel.created[line_id] = asyncio.get_event_loop().time()
+                lines.append(f'Player "Survivor{line_id % 60}" (id=abcdef) has been disconnected #{line_id}')
+                line_id += 1
+            await add_log(server_name, lines)
+        await asyncio.sleep(0.1 * SCALE)
+    while channel.created:
+        await asyncio.sleep(0.1 * SCALE)
+
+
+async def run_polling():
+    # The previous flush loop: poll every second, send each server at most every 10 seconds,
+    # one message per build_fields chunk, awaited in turn
+    channel = FakeChannel()
+    log_rollup = {name: list() for name in SERVERS}
+    last_log_time = {name: 0 for name in SERVERS}
+
+    async def flush_log():
+        while True:
+            await asyncio.sleep(1 * SCALE)
+            for server_name in SERVERS:
+                now = asyncio.get_event_loop().time()
+                if log_rollup[server_name] and 10 * SCALE < now - last_log_time[server_name]:
+                    lines = log_rollup[server_name]
+                    log_rollup[server_name] = list()
+                    for fields in discord_service.build_fields(server_name, lines):
+                        await channel.send({'color': discord_service.get_server_color(server_name),
+                                            'fields': fields})
+                    last_log_time[server_name] = asyncio.get_event_loop().time()
+
+    async def add_log(server_name, lines):
+        log_rollup[server_name].extend(lines)
+
+    flusher = asyncio.create_task(flush_log())
+    await flood(channel, add_log)
+    flusher.cancel()
+    return channel
+
+
+async def run_scheduler():
+    channel = FakeChannel()
+
+    async def send(channel_id, embed):
+        await channel.send(embed)
+
+    def render_logs(pending_logs):
+        server_fields = [(server_name, field)
+                         for server_name, lines in pending_logs.items()
+                         for message in discord_service.build_fields(server_name, lines)
+                         for field in message]
+        return [{'embed': embed} for embed in discord_service.pack_embeds(server_fields)]
+
+    scheduler = outbound.OutboundScheduler(send, render_logs, 2 * SCALE, rate=outbound.CHANNEL_RATE / SCALE,
+                                           buffer_lines=LINES_PER_SECOND * FLOOD_SECONDS)
+    await flood(channel, lambda server_name, lines: scheduler.add_log(1, server_name, lines))
+    scheduler.close()
+    return channel
+
+
+def report(name, channel):
+    latencies = sorted(channel.latencies)
+    print(f'{name:10} api calls {channel.calls:5}  '
+          f'latency mean {statistics.mean(latencies):6.2f}s  '
+          f'p99 {latencies[int(len(latencies) * 0.99)]:6.2f}s  max {latencies[-1]:6.2f}s')
+
+
+async def main():
+    print(f'{LINES_PER_SECOND} lines/s from {len(SERVERS)} servers for {FLOOD_SECONDS}s into one admin channel')
+    report('polling', await run_polling())
+    report('scheduler', await run_scheduler())
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
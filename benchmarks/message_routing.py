@@ -0,0 +1,124 @@
+# Run from the repository root with: PYTHONPATH=src:. python benchmarks/message_routing.py
+import asyncio
+import random
+import re
+import time
+
+from carim_discord_bot import config, message_builder
+from carim_discord_bot.discord_client import arguments, client
+
+SERVERS = 10
+CUSTOM_COMMANDS = 30
+COMMUNITY_CHANNELS = 200
+MESSAGES = 100000
+RELEVANT = 0.05
+WORDS = 'the quick brown fox jumps over a lazy dog anyone on tonight raid base loot'.split()
+
+
+class Channel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+
+    async def send(self, *args, **kwargs):
+        pass
+
+
+class Message:
+    def __init__(self, channel, content):
+        self.channel = channel
+        self.content = content
+        self.author = 'someone'
+
+
+def configure():
+    config._global_config = config._build_from_dict({
+        'user_channel_ids': [9001, 9002],
+        'custom_commands': [
+            {'command': f'--custom{i}', 'response': {'description': f'custom {i}'},
+             'channels': [9001] if i % 3 else []}
+            for i in range(CUSTOM_COMMANDS)
+        ]
+    }, config.GlobalConfig)
+    config._server_configs = {
+        f'server{i}': config._build_from_dict({
+            'name': f'server{i}', 'rcon_password': 'x', 'chat_channel_id': 1000 + i, 'admin_channel_id': 2000 + i
+        }, config.ServerConfig)
+        for i in range(SERVERS)
+    }
+    config._validate_config()
+
+
+def get_messages():
+    rng = random.Random(0)
+    community = [Channel(i) for i in range(COMMUNITY_CHANNELS)]
+    chat = [Channel(1000 + i) for i in range(SERVERS)]
+    user = [Channel(9001), Channel(9002)]
+    messages = list()
+    for _ in range(MESSAGES):
+        text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 12)))
+        if rng.random() < RELEVANT:
+            if rng.random() < 0.5:
+                messages.append(Message(rng.choice(chat), text))
+            else:
+                messages.append(Message(rng.choice(user), f'--custom{rng.randrange(CUSTOM_COMMANDS)}'))
+        else:
+            messages.append(Message(rng.choice(community), text))
+    return messages
+
+
+async def previous_on_message(self, message):
+    # The previous routing: every server checked and every custom pattern matched for every message
+    if message.author == self.user:
+        return
+
+    for server_name in config.get_server_names():
+        if config.get_server(server_name).rcon_password is not None:
+            if message.channel.id == config.get_server(server_name).chat_channel_id:
+                await arguments.process_chat(server_name, message)
+            elif message.channel.id == config.get_server(server_name).admin_channel_id \
+                    and message.content.startswith('--'):
+                pass
+
+    if message.channel.id in config.get().user_channel_ids and message.content.startswith('--'):
+        pass
+
+    for custom_command in config.get().custom_commands:
+        custom_command: message_builder.Response = custom_command
+        if custom_command.enabled:
+            if message.channel.id in custom_command.channels or len(custom_command.channels) == 0:
+                if re.match(custom_command.command, message.content):
+                    embed = custom_command.generate()
+                    if len(embed) <= 6000:
+                        await message.channel.send(embed=embed)
+
+
+async def process_chat(server_name, message):
+    pass
+
+
+async def process_user_message_args(channel_id, parsed_args):
+    pass
+
+
+class FakeClient:
+    user = 'bot'
+
+
+async def main():
+    configure()
+    arguments.process_chat = process_chat
+    arguments.process_user_message_args = process_user_message_args
+    messages = get_messages()
+    fake_client = FakeClient()
+    print(f'{MESSAGES} messages, {RELEVANT * 100:.0f}% in channels the bot watches, '
+          f'{SERVERS} servers, {CUSTOM_COMMANDS} custom commands')
+    for name, on_message in (('previous', previous_on_message), ('routed', client.CarimClient.on_message)):
+        start = time.perf_counter()
+        for message in messages:
+            await on_message(fake_client, message)
+        elapsed = time.perf_counter() - start
+        print(f'{name:9} {elapsed / MESSAGES * 1e6:6.2f} us per message')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,81 @@
+# Run from the repository root with: PYTHONPATH=src:. python benchmarks/player_count_polling.py
+import random
+
+from carim_discord_bot.discord_client import discord_service
+from carim_discord_bot.services import player_count
+
+DAY = 24 * 60 * 60
+INTERVAL = 30
+RENAME_INTERVAL = discord_service.PLAYER_COUNT_RENAME_INTERVAL.total_seconds()
+# Seconds of the day the server is down for a restart
+OUTAGES = [(6 * 3600, 6 * 3600 + 600), (18 * 3600, 18 * 3600 + 600)]
+
+
+def get_players(seed):
+    # A count that changes every few minutes at night and every minute or so in the evening
+    rng = random.Random(seed)
+    players = [0] * DAY
+    count = 20
+    for second in range(DAY):
+        busy = 0.3 + 0.7 * abs(((second / DAY) * 2) % 2 - 1)
+        if rng.random() < busy / 90:
+            count = max(0, min(60, count + rng.choice((-1, 1))))
+        players[second] = count
+    return players
+
+
+def is_down(second):
+    return any(start <= second < end for start, end in OUTAGES)
+
+
+def simulate(players, adaptive):
+    schedule = player_count.PollSchedule(INTERVAL)
+    shown = None
+    pending = None
+    last_seen = None
+    last_rename = -RENAME_INTERVAL
+    next_poll = INTERVAL
+    queries = 0
+    renames = 0
+    stale_seconds = 0
+    for second in range(DAY):
+        rename_delay = last_rename + RENAME_INTERVAL - second
+        if pending is not None and pending != shown and rename_delay <= 0:
+            shown = pending
+            last_rename = second
+            renames += 1
+            rename_delay = RENAME_INTERVAL
+        if second >= next_poll:
+            queries += 1
+            reachable = not is_down(second)
+            changed = reachable and players[second] != last_seen
+            if adaptive:
+                schedule.record(reachable, changed)
+                if changed:
+                    last_seen = pending = players[second]
+                next_poll = second + schedule.next_delay(rename_delay)
+            else:
+                # The previous service sent every result, and only the ones arriving while the
+                # channel could be renamed got through
+                if reachable:
+                    last_seen = players[second]
+                    if rename_delay <= 0 and last_seen != shown:
+                        pending = last_seen
+                next_poll = second + INTERVAL
+        if shown != players[second] and not is_down(second):
+            stale_seconds += 1
+    return queries, renames, stale_seconds / DAY
+
+
+def main():
+    print(f'one day, {INTERVAL}s update interval, {RENAME_INTERVAL:.0f}s between renames, two 10 minute restarts')
+    for seed in range(3):
+        players = get_players(seed)
+        for name, adaptive in (('fixed', False), ('adaptive', True)):
+            queries, renames, stale = simulate(players, adaptive)
+            print(f'day {seed} {name:9} queries {queries:5}  renames {renames:4}  '
+                  f'count out of date {stale * 100:5.1f}% of the time')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+# Run from the repository root with: PYTHONPATH=src:. python benchmarks/rcon_events.py
+import re
+import timeit
+
+from carim_discord_bot.rcon import events
+from tests.rcon.corpus import MESSAGES
+
+ROUNDS = 2000
+
+
+def previous_classifier(message):
+    # The regex work RConProtocol.process_packet used to do for every message
+    results = list()
+    disconnect = re.compile(r'Player .* disconnected')
+    if disconnect.match(message):
+        parts = message.split()
+        results.append(' '.join(parts[2:]))
+    connect = re.compile(r'Verified GUID .* of player .*')
+    if connect.match(message):
+        parts = message.split()
+        results.append(f'{" ".join(parts[6:])} connected')
+    chat = re.compile(r'^\((Global|Side)\).*:.*')
+    if chat.match(message):
+        _, _, content = message.partition(' ')
+        results.append(content)
+    return results
+
+
+def run(classifier):
+    for message in MESSAGES:
+        classifier(message)
+
+
+def main():
+    count = ROUNDS * len(MESSAGES)
+    print(f'{count} messages from a corpus of {len(MESSAGES)}')
+    for name, classifier in (('previous', previous_classifier), ('classify', events.classify)):
+        elapsed = min(timeit.repeat(lambda: run(classifier), number=ROUNDS, repeat=5))
+        print(f'{name:10}: {elapsed:6.3f}s {elapsed / count * 1e6:6.2f}us/message')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+# Run from the repository root with: PYTHONPATH=src:. python benchmarks/rcon_protocol.py
+import timeit
+
+from carim_discord_bot.rcon import protocol
+
+BANS = 2000
+FRAGMENT_SIZE = 1400
+ROUNDS = 20
+
+
+def build_bans_response():
+    lines = ['GUID Bans:', '[#] [GUID] [Minutes left] [Reason]', '----------------------------------------']
+    for i in range(BANS):
+        lines.append(f'{i:<4} {i:032x} perm Cheating, appeal at https://discord.gg/example ({i})')
+    return '\n'.join(lines)
+
+
+def build_datagrams(response):
+    fragments = [response[i:i + FRAGMENT_SIZE] for i in range(0, len(response), FRAGMENT_SIZE)]
+    return [protocol.Packet(protocol.SplitCommand(42, fragment, len(fragments), index))
+            for index, fragment in enumerate(fragments)]
+
+
+def generate(packets):
+    return [packet.generate() for packet in packets]
+
+
+def parse(datagrams):
+    return [protocol.Packet.parse(datagram) for datagram in datagrams]
+
+
+def main():
+    response = build_bans_response()
+    packets = build_datagrams(response)
+    datagrams = generate(packets)
+    size = sum(len(d) for d in datagrams)
+    print(f'bans response of {len(response)} characters in {len(packets)} split packets')
+    for name, step in (('generate', lambda: generate(packets)), ('parse', lambda: parse(datagrams))):
+        elapsed = min(timeit.repeat(step, number=ROUNDS, repeat=5)) / ROUNDS
+        print(f'{name:9}: {elapsed * 1000:7.3f}ms per response {size / elapsed / 1e6:8.1f}MB/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+# Run from the repository root with: PYTHONPATH=src:. python benchmarks/rcon_throughput.py
+import asyncio
+import logging
+
+from carim_discord_bot import config
+from carim_discord_bot.rcon import rcon_service
+from tests.rcon.fake_battleye import start_fake_server
+
+COMMANDS = 500
+LATENCY = 0.02
+
+
+async def measure(max_in_flight):
+    transport, server = await start_fake_server(delay=LATENCY)
+    config._global_config = config._build_from_dict({}, config.GlobalConfig)
+    config._server_configs['bench'] = config._build_from_dict(dict(
+        name='bench', ip='127.0.0.1', rcon_port=server.port, rcon_password='password',
+        rcon_max_in_flight=max_in_flight), config.ServerConfig)
+    service = rcon_service.RconService('bench')
+    await service.start()
+    messages = [rcon_service.Command('bench', f'say -1 message {i}') for i in range(COMMANDS)]
+    start = asyncio.get_running_loop().time()
+    for m in messages:
+        await service.send_message(m)
+    await asyncio.gather(*(m.result for m in messages))
+    elapsed = asyncio.get_running_loop().time() - start
+    await service.stop()
+    transport.close()
+    return elapsed
+
+
+async def main():
+    logging.disable(logging.CRITICAL)
+    print(f'{COMMANDS} commands against a fake BattlEye server with {LATENCY * 1000:.0f}ms latency')
+    for max_in_flight in (1, 4, 16, 64):
+        elapsed = await measure(max_in_flight)
+        print(f'in flight {max_in_flight:3}: {elapsed:6.2f}s {COMMANDS / elapsed:8.0f} commands/s')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+# Run from the repository root with: PYTHONPATH=src:. python benchmarks/safe_shutdown_kicks.py
+import asyncio
+import logging
+
+from carim_discord_bot import config
+from carim_discord_bot.rcon import rcon_service, protocol
+from tests.rcon.fake_battleye import RawPayload, start_fake_server
+
+SLOTS = 100
+SWEEPS = 30
+LATENCY = 0.01
+# kicked players keep showing up in the list for a few sweeps while they disconnect
+LINGERING_SWEEPS = 3
+HEADER = 'Players on server:\n[#] [IP Address]:[Port] [Ping] [GUID] [Name]\n' + '-' * 50
+
+
+class FullServer:
+    def __init__(self, server):
+        self.server = server
+        self.sequence_number = 0
+        self.next_number = 0
+        self.online = dict()
+        self.leaving = dict()
+        for _ in range(SLOTS):
+            self.join()
+
+    def notify(self, message):
+        # Joins and leaves are announced like BattlEye does, which keeps the bot's player roster up to date
+        if self.server.client_addr is not None:
+            self.server.send(RawPayload(protocol.MESSAGE, bytes([self.sequence_number]) + protocol.encode(message)))
+            self.sequence_number = (self.sequence_number + 1) & 0xff
+
+    def join(self):
+        number = self.next_number
+        self.next_number += 1
+        self.online[number] = f'127.0.0.1:2304 20 {number:032x}(OK) Survivor{number}'
+        self.notify(f'Verified GUID ({number:032x}) of player #{number} Survivor{number}')
+
+    def players(self, command):
+        lines = [f'{number} {line}' for number, line in self.online.items()]
+        return '\n'.join([HEADER] + lines + [f'({len(lines)} players in total)'])
+
+    def kick(self, command):
+        self.leaving.setdefault(int(command.split()[1]), LINGERING_SWEEPS)
+        return ''
+
+    def sweep(self):
+        for number in list(self.leaving):
+            self.leaving[number] -= 1
+            if self.leaving[number] == 0:
+                self.online.pop(number, None)
+                self.leaving.pop(number)
+                self.notify(f'Player #{number} Survivor{number} disconnected')
+        self.join()
+
+
+async def serial_kick_everybody(service, message):
+    # The previous implementation: one players query and every kick awaited in turn
+    players_query = rcon_service.Command(service.server_name, 'players')
+    await service.handle_command(players_query)
+    raw_players = await players_query.result
+    for i in [line.split()[0] for line in raw_players.split('\n')[3:-1]]:
+        await service.handle_command(rcon_service.Command(service.server_name, f'kick {i} {message}'))
+
+
+async def run_shutdown(kick):
+    transport, server = await start_fake_server(delay=LATENCY)
+    full_server = FullServer(server)
+    server.responses['players'] = full_server.players
+    server.responses['kick'] = full_server.kick
+    config._global_config = config._build_from_dict({}, config.GlobalConfig)
+    config._server_configs['bench'] = config._build_from_dict(dict(
+        name='bench', ip='127.0.0.1', rcon_port=server.port, rcon_password='password'), config.ServerConfig)
+    service = rcon_service.RconService('bench')
+    await service.start()
+    while not service.roster.synced:
+        await asyncio.sleep(0.01)
+    start = asyncio.get_running_loop().time()
+    await kick(service, 'Server is restarting', False)
+    for _ in range(SWEEPS):
+        # somebody manages to join between every sweep
+        full_server.sweep()
+        # and the join is announced over the network like any other reply
+        await asyncio.sleep(LATENCY)
+        await kick(service, 'Server locked', True)
+    elapsed = asyncio.get_running_loop().time() - start
+    await service.stop()
+    transport.close()
+    return elapsed, len(server.commands)
+
+
+async def main():
+    logging.disable(logging.CRITICAL)
+    print(f'{SLOTS} players, {SWEEPS} sweeps, {LATENCY * 1000:.0f}ms latency')
+    elapsed, commands = await run_shutdown(lambda service, message, only_new: serial_kick_everybody(service, message))
+    print(f'serial kicks:   {elapsed:6.2f}s {commands:5} commands')
+    elapsed, commands = await run_shutdown(lambda service, message, only_new: service.kick_everybody(message, only_new))
+    print(f'bulk kicks:     {elapsed:6.2f}s {commands:5} commands')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
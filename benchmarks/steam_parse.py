@@ -0,0 +1,92 @@
+# Run from the repository root with: PYTHONPATH=src:. python benchmarks/steam_parse.py
+import re
+import struct
+import timeit
+
+from carim_discord_bot.steam import query
+from tests.steam.fake_a2s import build_info_response
+
+NUMBER = 20000
+RESPONSES = [
+    build_info_response(name='Carim | Vanilla+ | 1PP | Loot+', players=i % 60,
+                        keywords=f'battleye,no3rd,external,privHive,shard,lqs{i % 5},etm4.000000,entm12.000000,'
+                                 f'mod,{i % 24:02}:{i % 60:02}')
+    for i in range(100)
+]
+
+
+class PreviousSteamData:
+    def __init__(self):
+        self.keywords = list()
+
+    def get_queue(self):
+        for kw in self.keywords:
+            if kw.startswith('lqs'):
+                return kw[3:]
+        return None
+
+    def get_time(self):
+        time_pattern = re.compile(r'[0-9]{2}:[0-9]{2}')
+        for kw in self.keywords:
+            if time_pattern.match(kw):
+                return kw
+        return None
+
+
+def previous_unpack(data):
+    # The previous parser, which re-sliced the remaining datagram after every field
+    def get_next_string(data):
+        result, _, data = data.partition(b'\x00')
+        return result.decode(), data
+
+    def unpack_from_format(data_format, data):
+        return struct.unpack_from(data_format, data), data[struct.calcsize(data_format):]
+
+    response = PreviousSteamData()
+    data = data[struct.calcsize(query.RESPONSE_HEADER_FORMAT):]
+    response.name, data = get_next_string(data)
+    response.map_name, data = get_next_string(data)
+    response.folder, data = get_next_string(data)
+    response.game, data = get_next_string(data)
+    (
+        response.steam_id,
+        response.players,
+        response.max_players,
+        response.bots,
+        response.server_type,
+        response.env,
+        response.vis,
+        response.vac
+    ), data = unpack_from_format(query.RESPONSE_DATA_FORMAT, data)
+    response.version, data = get_next_string(data)
+    (edf,), data = unpack_from_format('=B', data)
+    if edf & 0x80:
+        (response.port,), data = unpack_from_format('=H', data)
+    if edf & 0x10:
+        (response.extra_steam_id,), data = unpack_from_format('=Q', data)
+    if edf & 0x40:
+        (response.source_tv_port,), data = unpack_from_format('=H', data)
+        response.source_tv_name, data = get_next_string(data)
+    if edf & 0x20:
+        temp_keywords, data = get_next_string(data)
+        response.keywords = temp_keywords.split(',')
+    if edf & 0x01:
+        (response.game_id,), data = unpack_from_format('=Q', data)
+    return response
+
+
+def run(unpack):
+    for data in RESPONSES:
+        result = unpack(data)
+        result.get_queue()
+        result.get_time()
+
+
+def main():
+    for name, unpack in (('previous', previous_unpack), ('offsets', query.unpack_steam_response)):
+        seconds = min(timeit.repeat(lambda: run(unpack), number=NUMBER // len(RESPONSES), repeat=3))
+        print(f'{name:9} {seconds / NUMBER * 1e6:6.2f} us per response including queue and time')
+
+
+if __name__ == '__main__':
+    main()
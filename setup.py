@@ -3,7 +3,7 @@ from setuptools import setup
 setup(
     install_requires=[
         'discord.py>=1.6.0',
-        'requests'
+        'aiohttp'
     ],
     extras_require={
         'tests': [
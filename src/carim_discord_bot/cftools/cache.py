@@ -0,0 +1,117 @@
+import asyncio
+import collections
+import logging
+import time
+
+DEFAULT_MAX_SIZE = 1000
+# Seconds an entry is fresh, and how much longer it may still be served while a refresh runs
+DEFAULT_TTL = {
+    'leaderboard': 300,
+    'lookup': 24 * 60 * 60,
+    'player': 60,
+}
+DEFAULT_STALE = {
+    'leaderboard': 60 * 60,
+    'lookup': 0,
+    'player': 0,
+}
+ENDPOINTS = tuple(DEFAULT_TTL)
+RESULTS = ('hits', 'stale_hits', 'misses', 'coalesced', 'expired', 'evictions')
+log = logging.getLogger(__name__)
+
+
+class CacheEntry:
+    __slots__ = ('value', 'stored')
+
+    def __init__(self, value, stored):
+        self.value = value
+        self.stored = stored
+
+
+class TTLCache:
+    def __init__(self, name, max_size=DEFAULT_MAX_SIZE, ttl=300, stale=0, clock=time.monotonic):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stale = stale
+        self.clock = clock
+        self.entries = collections.OrderedDict()
+        self.in_flight = dict()
+        self.stats = collections.Counter()
+
+    async def get(self, key, load, cacheable=None):
+        # load returns None when the lookup failed. Failures, and values cacheable rejects, are never stored
+        entry = self.entries.get(key)
+        if entry is not None:
+            age = self.clock() - entry.stored
+            if age < self.ttl:
+                self.stats['hits'] += 1
+                self.entries.move_to_end(key)
+                return entry.value
+            if age < self.ttl + self.stale:
+                self.stats['stale_hits'] += 1
+                self.entries.move_to_end(key)
+                if key not in self.in_flight:
+                    self.start_load(key, load, cacheable).add_done_callback(self.log_refresh_failure)
+                return entry.value
+            self.stats['expired'] += 1
+            del self.entries[key]
+        self.stats['misses'] += 1
+        task = self.in_flight.get(key)
+        if task is None:
+            task = self.start_load(key, load, cacheable)
+        else:
+            self.stats['coalesced'] += 1
+        # Shielded so one caller giving up doesn't cancel the lookup for everyone else waiting on it
+        return await asyncio.shield(task)
+
+    def start_load(self, key, load, cacheable):
+        task = asyncio.ensure_future(self.load(key, load, cacheable))
+        self.in_flight[key] = task
+        return task
+
+    async def load(self, key, load, cacheable):
+        try:
+            value = await load()
+        finally:
+            del self.in_flight[key]
+        if value is not None and (cacheable is None or cacheable(value)):
+            self.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.entries[key] = CacheEntry(value, self.clock())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def log_refresh_failure(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            log.warning(f'{self.name} cache refresh failed: {task.exception()!r}')
+
+    def get_stats(self):
+        return dict(self.stats, size=len(self.entries), in_flight=len(self.in_flight))
+
+
+class EndpointCaches:
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, ttl=None, stale=None, clock=time.monotonic):
+        ttl = dict(DEFAULT_TTL, **(ttl or dict()))
+        stale = dict(DEFAULT_STALE, **(stale or dict()))
+        self.caches = {endpoint: TTLCache(endpoint, max_size, ttl[endpoint], stale[endpoint], clock)
+                       for endpoint in ENDPOINTS}
+
+    def __getitem__(self, endpoint) -> TTLCache:
+        return self.caches[endpoint]
+
+    def get_stats(self):
+        return {endpoint: cache.get_stats() for endpoint, cache in self.caches.items()}
+
+    def get_metrics(self):
+        samples = list()
+        for endpoint, cache in self.caches.items():
+            for result in RESULTS:
+                samples.append(('carim_cftools_cache_total', (('endpoint', endpoint), ('result', result)),
+                                cache.stats[result]))
+            samples.append(('carim_cftools_cache_size', (('endpoint', endpoint),), len(cache.entries)))
+        return samples
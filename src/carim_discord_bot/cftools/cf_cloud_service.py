@@ -1,11 +1,11 @@
 import asyncio
 import datetime
+import functools
 import json
 import logging
 
-import requests
-
 from carim_discord_bot import managed_service, config
+from carim_discord_bot.cftools import cache, http_client, identity_index
 
 API = 'https://data.cftools.cloud'
 log = logging.getLogger(__name__)
@@ -31,29 +31,6 @@ class Stats(managed_service.Message):
         self.steam64 = steam64
 
 
-class CacheItem:
-    def __init__(self, value):
-        self.value = value
-        self.time = datetime.datetime.now()
-
-    def is_valid(self):
-        return datetime.datetime.now() - self.time < datetime.timedelta(minutes=5)
-
-
-class LeaderboardCache:
-    def __init__(self):
-        self.state = dict()
-
-    def get(self, server_name, stat):
-        item: CacheItem = self.state.get((server_name, stat), None)
-        if item and item.is_valid():
-            return item.value
-        return None
-
-    def set(self, server_name, stat, value):
-        self.state[(server_name, stat)] = CacheItem(value)
-
-
 class CloudService(managed_service.ManagedService):
     def __init__(self):
         super().__init__()
@@ -63,16 +40,44 @@ class CloudService(managed_service.ManagedService):
         self.logged_in_time = None
         self.token = None
         self.request_lock = asyncio.Lock()
-        self.leaderboard_cache = LeaderboardCache()
+        self.http = http_client.HttpClient()
+        self.caches = cache.EndpointCaches(config.get().cftools_cache_size,
+                                           config.get().cftools_cache_ttl,
+                                           config.get().cftools_cache_stale)
+        self.identities = identity_index.IdentityIndex(config.get().cftools_identity_index)
+
+    async def start(self):
+        await self.identities.open()
+        await super().start()
+
+    async def stop(self):
+        await super().stop()
+        await self.http.close()
+        await self.identities.close()
 
     async def handle_message(self, message: managed_service.Message):
+        # Lookups run concurrently so identical ones can share a single request through the cache
         if isinstance(message, Leaderboard):
-            result = await self.query_leaderboard(message.server_name, message.stat)
-            message.result.set_result(result)
+            asyncio.create_task(self.respond(message, self.query_leaderboard(message.server_name, message.stat)))
         elif isinstance(message, Stats):
-            result = await self.query_stats(message.server_name, message.steam64)
+            asyncio.create_task(self.respond(message, self.query_stats(message.server_name, message.steam64)))
+
+    async def respond(self, message: managed_service.Message, query):
+        try:
+            result = await query
+        except Exception:
+            log.error(f'{message.server_name} {type(message).__name__} failed', exc_info=True)
+            message.result.cancel()
+            return
+        if not message.result.done():
             message.result.set_result(result)
 
+    def get_cache_stats(self):
+        return self.caches.get_stats()
+
+    def get_metrics(self):
+        return super().get_metrics() + self.caches.get_metrics()
+
     async def service(self):
         while True:
             if self.logged_in:
@@ -87,16 +92,12 @@ class CloudService(managed_service.ManagedService):
 
         payload = dict(application_id=self.application_id, secret=self.secret)
         async with self.request_lock:
-            request = requests.post(f'{API}/v1/auth/register', headers=self.get_headers(), json=payload)
-
             log.debug(f'login request')
-            log.debug(f'request headers: {request.request.headers}')
-            log.debug(f'request body:    {request.request.body}')
-            log.debug(f'response status: {request.status_code}')
-            log.debug(f'response:        {request.content}')
+            request = await self.http.request('POST', f'{API}/v1/auth/register', headers=self.get_headers(),
+                                              payload=payload)
 
-            if request.status_code != 200:
-                log.warning(f'failed to log in {request.json()}')
+            if request is None or request.status_code != 200:
+                log.warning(f'failed to log in {request.json() if request is not None else "no response"}')
                 return
 
             log.info('logged in')
@@ -106,35 +107,35 @@ class CloudService(managed_service.ManagedService):
             self.token = request.json().get('token')
 
     async def query_leaderboard(self, server_name, stat):
-        cached = self.leaderboard_cache.get(server_name, stat)
-        if cached is not None:
-            log.debug('using cached value')
-            return cached
-        else:
-            server_api_id = config.get_server(server_name).cf_cloud_server_api_id
-            request = await self.locking_request('GET', f'{API}/v1/server/{server_api_id}/leaderboard',
-                                                 payload=dict(stat=stat, limit=20, order=-1))
-            if request.status_code != 200 or not request.json().get('status', False):
-                return 'Query failed'
-            result = request.json()
-            result['leaderboard'] = [{'rank': entry['rank'], 'latest_name': entry['latest_name'], stat: entry[stat]} for entry in result.get('leaderboard', list())]
-            self.leaderboard_cache.set(server_name, stat, result)
-            return result
+        result = await self.caches['leaderboard'].get((server_name, stat),
+                                                      functools.partial(self.fetch_leaderboard, server_name, stat))
+        if result is None:
+            return 'Query failed'
+        return result
 
-    async def query_stats(self, server_name, steam64):
+    async def fetch_leaderboard(self, server_name, stat):
         server_api_id = config.get_server(server_name).cf_cloud_server_api_id
-        request = await self.locking_request('GET', f'{API}/v1/server/{server_api_id}/lookup',
-                                             payload=dict(identifier=steam64))
-        if request.status_code != 200 or not request.json().get('status', False):
-            return 'Lookup failed'
+        request = await self.locking_request('GET', f'{API}/v1/server/{server_api_id}/leaderboard',
+                                             payload=dict(stat=stat, limit=20, order=-1))
+        if request is None or request.status_code != 200 or not request.json().get('status', False):
+            return None
         result = request.json()
-        cftools_id = result.get('cftools_id')
+        self.identities.warm(result)
+        result['leaderboard'] = [{'rank': entry['rank'], 'latest_name': entry['latest_name'], stat: entry[stat]} for entry in result.get('leaderboard', list())]
+        return result
 
-        request = await self.locking_request('GET', f'{API}/v1/server/{server_api_id}/player',
-                                             payload=dict(cftools_id=cftools_id))
-        if request.status_code != 200 or not request.json().get('status', False):
+    async def query_stats(self, server_name, steam64):
+        cftools_id = self.identities.get(steam64)
+        if cftools_id is None:
+            cftools_id = await self.caches['lookup'].get((server_name, steam64),
+                                                         functools.partial(self.fetch_lookup, server_name, steam64))
+            if cftools_id is None:
+                return 'Lookup failed'
+
+        result = await self.caches['player'].get((server_name, cftools_id),
+                                                 functools.partial(self.fetch_player, server_name, cftools_id))
+        if result is None:
             return 'Query failed'
-        result = request.json()
         log.info(f'result: {result}')
         user = result.get('user', dict())
         stats = user.get('stats', dict())
@@ -151,20 +152,41 @@ class CloudService(managed_service.ManagedService):
 
         return json.dumps(response, indent=1, ensure_ascii=False)
 
+    async def fetch_lookup(self, server_name, steam64):
+        server_api_id = config.get_server(server_name).cf_cloud_server_api_id
+        request = await self.locking_request('GET', f'{API}/v1/server/{server_api_id}/lookup',
+                                             payload=dict(identifier=steam64))
+        if request is None or request.status_code != 200 or not request.json().get('status', False):
+            return None
+        cftools_id = request.json().get('cftools_id')
+        if cftools_id:
+            self.identities.add([(str(steam64), str(cftools_id))])
+        return cftools_id
+
+    async def fetch_player(self, server_name, cftools_id):
+        server_api_id = config.get_server(server_name).cf_cloud_server_api_id
+        request = await self.locking_request('GET', f'{API}/v1/server/{server_api_id}/player',
+                                             payload=dict(cftools_id=cftools_id))
+        if request is None or request.status_code != 200 or not request.json().get('status', False):
+            return None
+        result = request.json()
+        self.identities.warm(result)
+        return result
+
     async def locking_request(self, method, url, payload=None):
         async with self.request_lock:
             if not self.logged_in:
                 log.warning(f'not logged in')
-                return
-            if method == 'GET':
-                request = requests.request(method, url, headers=self.get_headers(), params=payload)
-            elif method == 'POST':
-                request = requests.request(method, url, headers=self.get_headers(), json=payload)
+                return None
+            headers = self.get_headers()
         log.info(f'{method} {url}')
-        log.debug(f'request headers: {request.request.headers}')
-        log.debug(f'request body:    {request.request.body}')
-        log.info(f'response status: {request.status_code}')
-        log.info(f'response:        {request.content}')
+        if method == 'GET':
+            request = await self.http.request(method, url, headers=headers, params=payload)
+        else:
+            request = await self.http.request(method, url, headers=headers, payload=payload)
+        if request is not None:
+            log.info(f'response status: {request.status_code}')
+            log.info(f'response:        {request.content}')
         return request
 
     def get_headers(self):
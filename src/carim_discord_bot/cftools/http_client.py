@@ -0,0 +1,61 @@
+import asyncio
+import json
+import logging
+
+import aiohttp
+
+DEFAULT_TIMEOUT = 10
+CONNECTIONS_PER_HOST = 4
+KEEP_ALIVE_TIMEOUT = 60
+log = logging.getLogger(__name__)
+
+
+class Response:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    def json(self):
+        try:
+            return json.loads(self.content)
+        except ValueError:
+            return dict()
+
+
+class HttpClient:
+    def __init__(self, timeout=DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        self.session = None
+
+    def get_session(self) -> aiohttp.ClientSession:
+        # The session owns a connector that keeps connections alive per host, so repeated
+        # calls to the same API reuse the TLS connection instead of handshaking every time
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit_per_host=CONNECTIONS_PER_HOST,
+                                             keepalive_timeout=KEEP_ALIVE_TIMEOUT)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    async def request(self, method, url, headers=None, params=None, payload=None, timeout=None):
+        timeout = aiohttp.ClientTimeout(total=timeout if timeout is not None else self.timeout)
+        try:
+            async with self.get_session().request(method, url, headers=headers, params=params, json=payload,
+                                                  timeout=timeout) as response:
+                content = await response.read()
+        except asyncio.TimeoutError:
+            log.warning(f'{method} {url} timed out')
+            return None
+        except aiohttp.ClientError as e:
+            log.warning(f'{method} {url} failed: {e}')
+            return None
+        log.debug(f'{method} {url}')
+        log.debug(f'request headers: {headers}')
+        log.debug(f'request body:    {payload if payload is not None else params}')
+        log.debug(f'response status: {response.status}')
+        log.debug(f'response:        {content}')
+        return Response(response.status, content)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
@@ -0,0 +1,102 @@
+import asyncio
+import concurrent.futures
+import logging
+import os
+import sqlite3
+
+STEAM64_KEYS = ('steam64', 'steamid', 'steam_id')
+log = logging.getLogger(__name__)
+
+
+def find_identities(node, cftools_id=None, found=None):
+    # Responses nest steam64s at different depths, so they are paired with the closest cftools_id above them
+    if found is None:
+        found = list()
+    if isinstance(node, dict):
+        cftools_id = node.get('cftools_id', cftools_id)
+        for key in STEAM64_KEYS:
+            steam64 = node.get(key)
+            if cftools_id and steam64 and str(steam64).isdigit():
+                found.append((str(steam64), str(cftools_id)))
+        for value in node.values():
+            if isinstance(value, (dict, list)):
+                find_identities(value, cftools_id, found)
+    elif isinstance(node, list):
+        for value in node:
+            find_identities(value, cftools_id, found)
+    return found
+
+
+class IdentityIndex:
+    # Lookups are answered from memory. The database is loaded and written from a thread of its
+    # own, like the journal, so opening it and committing new identities don't block the loop
+    def __init__(self, path=None):
+        self.path = os.path.expanduser(path) if path else None
+        self.identities = dict()
+        self.connection = None
+        self.executor = None
+
+    async def open(self):
+        if self.path is None or self.executor is not None:
+            return
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        loaded = await self.run(self.load)
+        # Identities learned while the database was loading are newer than the stored ones
+        loaded.update(self.identities)
+        self.identities = loaded
+
+    def load(self):
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self.connection = sqlite3.connect(self.path)
+            with self.connection:
+                self.connection.execute(
+                    'CREATE TABLE IF NOT EXISTS identities (steam64 TEXT PRIMARY KEY, cftools_id TEXT NOT NULL)')
+            loaded = dict(self.connection.execute('SELECT steam64, cftools_id FROM identities'))
+        except (OSError, sqlite3.Error) as e:
+            log.warning(f'identity index {self.path} unavailable, keeping identities in memory: {e}')
+            self.disconnect()
+            return dict()
+        log.info(f'loaded {len(loaded)} identities from {self.path}')
+        return loaded
+
+    def get(self, steam64):
+        return self.identities.get(str(steam64))
+
+    def add(self, identities):
+        new = [(steam64, cftools_id) for steam64, cftools_id in identities
+               if self.identities.get(steam64) != cftools_id]
+        if not new:
+            return
+        self.identities.update(new)
+        if self.executor is not None:
+            # Not waited on, the thread writes each batch in the order it was added
+            self.executor.submit(self.save, new)
+        log.debug(f'indexed {len(new)} identities')
+
+    def save(self, new):
+        if self.connection is None:
+            return
+        try:
+            with self.connection:
+                self.connection.executemany('INSERT OR REPLACE INTO identities VALUES (?, ?)', new)
+        except sqlite3.Error as e:
+            log.warning(f'failed to save {len(new)} identities to {self.path}: {e}')
+
+    def warm(self, result):
+        self.add(find_identities(result))
+
+    async def close(self):
+        if self.executor is None:
+            return
+        await self.run(self.disconnect)
+        self.executor.shutdown()
+        self.executor = None
+
+    def disconnect(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    async def run(self, function, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, function, *args)
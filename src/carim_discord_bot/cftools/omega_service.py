@@ -1,12 +1,12 @@
 import asyncio
 import datetime
+import functools
 import hashlib
 import json
 import logging
 
-import requests
-
 from carim_discord_bot import managed_service, config
+from carim_discord_bot.cftools import cache, http_client, identity_index
 
 API = 'https://cfapi.de'
 log = logging.getLogger(__name__)
@@ -51,29 +51,6 @@ class QueuePriorityRevoke(managed_service.Message):
         self.cftools_id = cftools_id
 
 
-class CacheItem:
-    def __init__(self, value):
-        self.value = value
-        self.time = datetime.datetime.now()
-
-    def is_valid(self):
-        return datetime.datetime.now() - self.time < datetime.timedelta(minutes=5)
-
-
-class LeaderboardCache:
-    def __init__(self):
-        self.state = dict()
-
-    def get(self, server_name, stat):
-        item: CacheItem = self.state.get((server_name, stat), None)
-        if item and item.is_valid():
-            return item.value
-        return None
-
-    def set(self, server_name, stat, value):
-        self.state[(server_name, stat)] = CacheItem(value)
-
-
 class OmegaService(managed_service.ManagedService):
     def __init__(self):
         super().__init__()
@@ -87,15 +64,27 @@ class OmegaService(managed_service.ManagedService):
         self.refresh_token = None
         self.service_tokens = dict()
         self.request_lock = asyncio.Lock()
-        self.leaderboard_cache = LeaderboardCache()
+        self.http = http_client.HttpClient()
+        self.caches = cache.EndpointCaches(config.get().cftools_cache_size,
+                                           config.get().cftools_cache_ttl,
+                                           config.get().cftools_cache_stale)
+        self.identities = identity_index.IdentityIndex(config.get().cftools_identity_index)
+
+    async def start(self):
+        await self.identities.open()
+        await super().start()
+
+    async def stop(self):
+        await super().stop()
+        await self.http.close()
+        await self.identities.close()
 
     async def handle_message(self, message: managed_service.Message):
+        # Lookups run concurrently so identical ones can share a single request through the cache
         if isinstance(message, Leaderboard):
-            result = await self.query_leaderboard(message.server_name, message.stat)
-            message.result.set_result(result)
+            asyncio.create_task(self.respond(message, self.query_leaderboard(message.server_name, message.stat)))
         elif isinstance(message, Stats):
-            result = await self.query_stats(message.server_name, message.steam64)
-            message.result.set_result(result)
+            asyncio.create_task(self.respond(message, self.query_stats(message.server_name, message.steam64)))
         elif isinstance(message, QueuePriorityList):
             result = await self.query_queue_priority(message.server_name)
             message.result.set_result(result)
@@ -109,6 +98,22 @@ class OmegaService(managed_service.ManagedService):
             result = await self.revoke_queue_priority(message.server_name, message.cftools_id)
             message.result.set_result(result)
 
+    async def respond(self, message: managed_service.Message, query):
+        try:
+            result = await query
+        except Exception:
+            log.error(f'{message.server_name} {type(message).__name__} failed', exc_info=True)
+            message.result.cancel()
+            return
+        if not message.result.done():
+            message.result.set_result(result)
+
+    def get_cache_stats(self):
+        return self.caches.get_stats()
+
+    def get_metrics(self):
+        return super().get_metrics() + self.caches.get_metrics()
+
     async def service(self):
         while True:
             if self.logged_in:
@@ -125,10 +130,11 @@ class OmegaService(managed_service.ManagedService):
 
         payload = dict(secret=self.hashed_secret)
         async with self.request_lock:
-            request = requests.post(f'{API}/auth/login', headers=self.get_headers(), json=payload)
+            request = await self.http.request('POST', f'{API}/auth/login', headers=self.get_headers(),
+                                              payload=payload)
 
-            if request.status_code != 200:
-                log.warning(f'failed to log in {request.json()}')
+            if request is None or request.status_code != 200:
+                log.warning(f'failed to log in {request.json() if request is not None else "no response"}')
                 return
 
             log.info('logged in')
@@ -140,6 +146,8 @@ class OmegaService(managed_service.ManagedService):
 
     async def get_service_tokens(self):
         request = await self.locking_request('GET', f'{API}/v1/servicetokens')
+        if request is None:
+            return
         tokens = request.json().get('tokens', list())
         if len(tokens) < 1:
             log.warning('Not authorized for any services')
@@ -150,16 +158,17 @@ class OmegaService(managed_service.ManagedService):
     def get_service_token(self, server_name):
         try:
             return self.service_tokens[config.get_server(server_name).cftools_service_id]
-        except IndexError:
+        except KeyError:
+            log.warning(f'{server_name} no service token, the service tokens may not have loaded yet')
             return None
 
     async def renew_login(self):
         async with self.request_lock:
             headers = self.get_headers()
             headers['Authorization'] = f'Bearer {self.refresh_token}'
-            request = requests.post(f'{API}/auth/refresh', headers=headers)
-            if request.status_code != 200:
-                log.warning(f'failed to renew tokens {request.json()}')
+            request = await self.http.request('POST', f'{API}/auth/refresh', headers=headers)
+            if request is None or request.status_code != 200:
+                log.warning(f'failed to renew tokens {request.json() if request is not None else "no response"}')
                 self.logged_in = False
                 return
 
@@ -169,31 +178,42 @@ class OmegaService(managed_service.ManagedService):
             self.refresh_token = request.json().get('refresh_token')
 
     async def query_leaderboard(self, server_name, stat):
-        cached = self.leaderboard_cache.get(server_name, stat)
-        if cached is not None:
-            log.debug('using cached value')
-            return cached
-        else:
-            service_token = self.get_service_token(server_name)
-            request = await self.locking_request('GET', f'{API}/v2/omega/{service_token.token}/leaderboard',
-                                                 payload=dict(stat=stat, limit=20))
-            result = request.json()
-            self.leaderboard_cache.set(server_name, stat, result)
-            return result
+        result = await self.caches['leaderboard'].get((server_name, stat),
+                                                      functools.partial(self.fetch_leaderboard, server_name, stat))
+        if result is None:
+            return 'Query failed'
+        return result
 
-    async def query_stats(self, server_name, steam64):
-        request = await self.locking_request('GET', f'{API}/v1/user/lookup',
-                                             payload=dict(identity=steam64, identity_type='steam64'))
+    async def fetch_leaderboard(self, server_name, stat):
+        service_token = self.get_service_token(server_name)
+        if service_token is None:
+            return None
+        request = await self.locking_request('GET', f'{API}/v2/omega/{service_token.token}/leaderboard',
+                                             payload=dict(stat=stat, limit=20))
+        # Error responses come back as None so the cache doesn't hold on to them
+        if request is None or request.status_code != 200 or not request.json().get('status', False):
+            return None
         result = request.json()
-        if not result.get('status', False):
-            return 'Invalid steam64'
-        cftools_id = result.get('cftools_id')
+        self.identities.warm(result)
+        return result
 
-        service_token = self.get_service_token(server_name)
-        request = await self.locking_request('GET', f'{API}/v1/user/{service_token.token}/service',
-                                             payload=dict(platform='omega', cftools_id=cftools_id))
+    async def query_stats(self, server_name, steam64):
+        cftools_id = self.identities.get(steam64)
+        if cftools_id is None:
+            # Unknown steam64s aren't cached, since they become known once the player first joins
+            result = await self.caches['lookup'].get(steam64, functools.partial(self.fetch_lookup, steam64),
+                                                     cacheable=lambda r: r.get('status', False))
+            if result is None:
+                return 'Lookup failed'
+            if not result.get('status', False):
+                return 'Invalid steam64'
+            cftools_id = result.get('cftools_id')
+
+        result = await self.caches['player'].get((server_name, cftools_id),
+                                                 functools.partial(self.fetch_player, server_name, cftools_id))
+        if result is None:
+            return 'Query failed'
 
-        result = request.json()
         user = result.get('user', dict()).get(config.get_server(server_name).cftools_service_id, dict())
         stats = user.get('stats', dict())
 
@@ -209,39 +229,72 @@ class OmegaService(managed_service.ManagedService):
 
         return json.dumps(response, indent=1, ensure_ascii=False)
 
+    async def fetch_lookup(self, steam64):
+        request = await self.locking_request('GET', f'{API}/v1/user/lookup',
+                                             payload=dict(identity=steam64, identity_type='steam64'))
+        if request is None:
+            return None
+        result = request.json()
+        if result.get('status', False) and result.get('cftools_id'):
+            self.identities.add([(str(steam64), str(result['cftools_id']))])
+        return result
+
+    async def fetch_player(self, server_name, cftools_id):
+        service_token = self.get_service_token(server_name)
+        if service_token is None:
+            return None
+        request = await self.locking_request('GET', f'{API}/v1/user/{service_token.token}/service',
+                                             payload=dict(platform='omega', cftools_id=cftools_id))
+        # Error responses come back as None so the cache doesn't hold on to them
+        if request is None or request.status_code != 200 or not request.json().get('status', False):
+            return None
+        result = request.json()
+        self.identities.warm(result)
+        return result
+
     async def query_queue_priority(self, server_name):
         service_token = self.get_service_token(server_name)
+        if service_token is None:
+            return 'Query failed'
         request = await self.locking_request('GET', f'{API}/v1/queuepriority/{service_token.token}/list')
-        return request.json()
+        if request is None:
+            return 'Query failed'
+        result = request.json()
+        self.identities.warm(result)
+        return result
 
     async def create_queue_priority(self, server_name, cftools_id, comment, expires_at):
         service_token = self.get_service_token(server_name)
+        if service_token is None:
+            return 'Query failed'
         request = await self.locking_request('POST', f'{API}/v1/queuepriority/{service_token.token}/create',
                                              payload=dict(cftools_id=cftools_id,
                                                           comment=comment,
                                                           expires_at=expires_at))
+        if request is None:
+            return 'Query failed'
         return request.json()
 
     async def revoke_queue_priority(self, server_name, cftools_id):
         service_token = self.get_service_token(server_name)
+        if service_token is None:
+            return 'Query failed'
         request = await self.locking_request('POST', f'{API}/v1/queuepriority/{service_token.token}/revoke',
                                              payload=dict(cftools_id=cftools_id))
+        if request is None:
+            return 'Query failed'
         return request.json()
 
     async def locking_request(self, method, url, payload=None):
+        # Only the login state is read under the lock, so requests don't queue behind a slow one
         async with self.request_lock:
             if not self.logged_in:
                 log.warning(f'not logged in')
-                return
-            if method == 'GET':
-                request = requests.request(method, url, headers=self.get_headers(), params=payload)
-            elif method == 'POST':
-                request = requests.request(method, url, headers=self.get_headers(), json=payload)
-        log.debug(f'{method} {url}')
-        log.debug(f'request headers: {request.request.headers}')
-        log.debug(f'request body:    {request.request.body}')
-        log.debug(f'response:        {request.content}')
-        return request
+                return None
+            headers = self.get_headers()
+        if method == 'GET':
+            return await self.http.request(method, url, headers=headers, params=payload)
+        return await self.http.request(method, url, headers=headers, payload=payload)
 
     def get_headers(self):
         headers = {
@@ -1,11 +1,15 @@
+import datetime
 import json
 import logging
 
-from carim_discord_bot import message_builder
+from carim_discord_bot import message_builder, managed_service, routing
+from carim_discord_bot.cftools import cache
+from carim_discord_bot.services import cron
 
 log = logging.getLogger(__name__)
 _global_config = None
 _server_configs = dict()
+_routing_table = None
 
 
 class GlobalConfig:
@@ -18,10 +22,22 @@ class GlobalConfig:
         self.user_channel_ids = list()
         self.debug = False
         self.log_player_count_updates = True
+        self.log_flush_delay = 2
+        self.log_buffer_lines = 5000
+        self.log_overflow_policy = 'summarize'
+        self.discord_queue_size = 1000
+        self.metrics_host = '127.0.0.1'
+        self.metrics_port = None
+        self.journal_path = None
+        self.journal_retention_days = 30
 
         self.cftools_application_id = None
         self.cftools_client_id = None
         self.cftools_secret = None
+        self.cftools_cache_size = 1000
+        self.cftools_cache_ttl = dict()
+        self.cftools_cache_stale = dict()
+        self.cftools_identity_index = None
 
         self.cf_cloud_application_id = None
         self.cf_cloud_secret = None
@@ -52,6 +68,10 @@ class ServerConfig:
         self.log_rcon_messages = True
         self.log_rcon_keep_alive = False
 
+        self.rcon_max_in_flight = 16
+        self.rcon_command_timeout = 10
+        self.rcon_keep_alive_idle = 30
+
         self.cftools_service_id = None
 
         self.cf_cloud_server_api_id = None
@@ -84,17 +104,40 @@ def initialize(file_path):
 def _validate_config():
     if get().presence_type not in ('playing', 'listening', 'watching', None):
         raise ValueError(f'unknown presence type: {get().presence_type}')
+    if get().log_overflow_policy not in managed_service.OVERFLOW_POLICIES:
+        raise ValueError(f'unknown log overflow policy: {get().log_overflow_policy}')
+    if get().journal_retention_days is not None and get().journal_retention_days <= 0:
+        raise ValueError(f'journal_retention_days must be positive: {get().journal_retention_days}')
+    for setting in ('cftools_cache_ttl', 'cftools_cache_stale'):
+        for endpoint in getattr(get(), setting):
+            if endpoint not in cache.ENDPOINTS:
+                raise ValueError(f'unknown endpoint in {setting}: {endpoint}, expected one of {cache.ENDPOINTS}')
 
     for server_name in _server_configs:
         scheduled_commands = get_server(server_name).scheduled_commands
         if not isinstance(scheduled_commands, list):
             raise ValueError(f'scheduled_commands not a list in config for: {server_name}')
+        for scheduled_command in scheduled_commands:
+            if 'cron' in scheduled_command:
+                # An expression like 0 0 31 2 * parses but never comes round, so it is checked here
+                # rather than failing when the server's commands are scheduled
+                cron.CronExpression(scheduled_command['cron']).get_next(datetime.datetime.now())
+            elif 'interval' not in scheduled_command:
+                raise ValueError(f'scheduled command needs an interval or cron in config for: {server_name}')
+        # Sequence numbers are a single byte, so at least one has to stay free for the next command
+        if not 0 < get_server(server_name).rcon_max_in_flight < 256:
+            raise ValueError(f'rcon_max_in_flight must be between 1 and 255 in config for: {server_name}')
+        if get_server(server_name).rcon_keep_alive_idle <= 0:
+            raise ValueError(f'rcon_keep_alive_idle must be positive in config for: {server_name}')
 
     parsed_custom_commands = list()
     for raw_command in get().custom_commands:
         parsed_custom_commands.append(message_builder.Response(raw_command))
     get().custom_commands = parsed_custom_commands
 
+    global _routing_table
+    _routing_table = routing.RoutingTable(_server_configs.values(), get().user_channel_ids, get().custom_commands)
+
 
 def get() -> GlobalConfig:
     return _global_config
@@ -104,5 +147,9 @@ def get_server(name) -> ServerConfig:
     return _server_configs[name]
 
 
+def get_routing_table() -> routing.RoutingTable:
+    return _routing_table
+
+
 def get_server_names():
     return _server_configs.keys()
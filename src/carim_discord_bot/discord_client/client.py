@@ -1,8 +1,5 @@
-import argparse
 import asyncio
 import logging
-import re
-import shlex
 
 import discord
 
@@ -20,47 +17,43 @@ class CarimClient(discord.Client):
         if message.author == self.user:
             return
 
-        for server_name in config.get_server_names():
-            if config.get_server(server_name).rcon_password is not None:
-                if message.channel.id == config.get_server(server_name).chat_channel_id:
-                    await arguments.process_chat(server_name, message)
-                elif message.channel.id == config.get_server(server_name).admin_channel_id \
-                        and message.content.startswith('--'):
-                    args = shlex.split(message.content, comments=True)
-                    try:
-                        parsed_args, remaining_args = arguments.message_parser.parse_known_args(args)
-                    except (ValueError, argparse.ArgumentError):
-                        log.info(f'invalid command {message.content}')
-                        return
-                    if remaining_args == args:
-                        log.info(f'invalid command {message.content}')
+        # Most messages are in channels the bot has nothing to do with, and those stop here
+        route = config.get_routing_table().get(message.channel.id)
+        if route is None:
+            return
+
+        for server_name in route.chat_servers:
+            await arguments.process_chat(server_name, message)
+        if message.content.startswith('--'):
+            if route.admin_servers:
+                parsed_args = arguments.message_grammar.parse(message.content)
+                if not parsed_args:
+                    log.info(f'invalid command {message.content}')
+                    reason = f': {parsed_args.error}' if parsed_args.error is not None else ''
+                    for server_name in route.admin_servers:
                         asyncio.create_task(discord_service.get_service_manager().send_message(
-                            discord_service.Response(server_name, f'invalid command\n`{message.content}`')
+                            discord_service.Response(server_name, f'invalid command{reason}\n`{message.content}`')
                         ))
-                    else:
-                        await arguments.process_message_args(server_name, parsed_args, message)
-
-        if message.channel.id in config.get().user_channel_ids and message.content.startswith('--'):
-            args = shlex.split(message.content, comments=True)
-            try:
-                parsed_args, remaining_args = arguments.user_message_parser.parse_known_args(args)
-                if remaining_args == args:
-                    return
-            except (ValueError, argparse.ArgumentError):
-                log.info(f'invalid command {message.content}')
-                asyncio.create_task(discord_service.get_service_manager().send_message(
-                    discord_service.UserResponse(message.channel.id, 'invalid command', f'{message.content}')
-                ))
-                return
-            await arguments.process_user_message_args(message.channel.id, parsed_args)
-
-        for custom_command in config.get().custom_commands:
-            custom_command: message_builder.Response = custom_command
-            if custom_command.enabled:
-                if message.channel.id in custom_command.channels or len(custom_command.channels) == 0:
-                    if re.match(custom_command.command, message.content):
-                        embed = custom_command.generate()
-                        if len(embed) <= 6000:
-                            await message.channel.send(embed=embed)
-                        else:
-                            await message.channel.send(f'Message longer than 6000 character limit: {len(embed)}')
+                else:
+                    for server_name in route.admin_servers:
+                        await arguments.process_message_args(server_name, parsed_args)
+
+            if route.user:
+                parsed_args = arguments.user_message_grammar.parse(message.content)
+                if parsed_args.error is not None:
+                    log.info(f'invalid command {message.content}')
+                    asyncio.create_task(discord_service.get_service_manager().send_message(
+                        discord_service.UserResponse(message.channel.id, 'invalid command',
+                                                     f'{parsed_args.error}\n{message.content}')
+                    ))
+                elif parsed_args:
+                    await arguments.process_user_message_args(message.channel.id, parsed_args)
+
+        if route.custom_commands is not None:
+            for custom_command in route.custom_commands.match(message.content):
+                custom_command: message_builder.Response = custom_command
+                embed = custom_command.generate()
+                if len(embed) <= 6000:
+                    await message.channel.send(embed=embed)
+                else:
+                    await message.channel.send(f'Message longer than 6000 character limit: {len(embed)}')
@@ -0,0 +1,185 @@
+import re
+import shlex
+
+HELP_POSITION = 24
+# Without escapes or comments, shlex only splits on whitespace and strips quotes
+ESCAPES = re.compile(r'[\\#]')
+WORD = re.compile(r'[^ \t\r\n]+')
+QUOTED_WORD = re.compile(r"""(?:[^ \t\r\n'"]+|"[^"]*"|'[^']*')+""")
+QUOTED = re.compile(r""""([^"]*)"|'([^']*)'""")
+NEGATIVE_NUMBER = re.compile(r'-\d+$|-\d*\.\d+$')
+INTEGER = re.compile(r'[-+]?\d+$')
+# Arguments are checked against a pattern rather than converted and caught
+TYPES = (str, int)
+
+
+def split(content):
+    if ESCAPES.search(content) is None:
+        if '"' not in content and "'" not in content:
+            return WORD.findall(content)
+        # Anything the words leave behind other than whitespace is an unbalanced quote
+        if not QUOTED_WORD.sub('', content).strip(' \t\r\n'):
+            return [unquote(word) for word in QUOTED_WORD.findall(content)]
+    try:
+        return shlex.split(content, comments=True)
+    except ValueError:
+        return None
+
+
+def unquote(word):
+    if '"' in word or "'" in word:
+        return ''.join(piece for piece in QUOTED.split(word) if piece)
+    return word
+
+
+def is_option(token):
+    return token.startswith('-') and len(token) > 1 and ' ' not in token and NEGATIVE_NUMBER.match(token) is None
+
+
+class Command:
+    def __init__(self, verb, handler, metavar=(), types=None, required=None, help=None, group=None):
+        self.verb = verb
+        self.handler = handler
+        self.metavar = tuple(metavar)
+        self.types = tuple(types) if types is not None else (str,) * len(self.metavar)
+        self.required = required if required is not None else len(self.metavar)
+        if any(value_type not in TYPES for value_type in self.types):
+            raise TypeError(f'{verb}: arguments must be one of {TYPES}')
+        self.help = help
+        self.group = group
+
+    def convert(self, values):
+        if len(values) > len(self.metavar):
+            return None, f'{self.verb}: too many arguments'
+        if len(values) < self.required:
+            return None, f'{self.verb}: expected {" ".join(self.metavar[:self.required])}'
+        args = list()
+        for value, metavar, value_type in zip(values, self.metavar, self.types):
+            if value_type is int and INTEGER.match(value) is None:
+                return None, f'{self.verb}: invalid {metavar} {value}'
+            args.append(value_type(value))
+        return tuple(args), None
+
+    def get_invocation(self):
+        metavar = [m if i < self.required else f'[{m}]' for i, m in enumerate(self.metavar)]
+        return ' '.join([self.verb] + metavar)
+
+
+class VerbTrie:
+    def __init__(self):
+        self.root = dict()
+
+    def add(self, command):
+        node = self.root
+        for character in command.verb:
+            node = node.setdefault(character, dict())
+            node.setdefault(None, list()).append(command)
+
+    def find(self, verb):
+        # Like argparse, an unambiguous prefix of a verb selects it
+        node = self.root
+        for character in verb:
+            node = node.get(character)
+            if node is None:
+                return list()
+        return node[None]
+
+
+class ParseResult:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.commands = dict()
+        self.error = None
+
+    def __bool__(self):
+        return self.error is None and len(self.commands) > 0
+
+
+class Grammar:
+    def __init__(self, description=None):
+        self.description = description
+        self.commands = dict()
+        self.trie = VerbTrie()
+        self.help = None
+
+    def command(self, verb, **kwargs):
+        def register(handler):
+            command = Command(verb, handler, **kwargs)
+            self.commands[verb] = command
+            self.trie.add(command)
+            self.help = None
+            return handler
+
+        return register
+
+    def lookup(self, verb):
+        command = self.commands.get(verb)
+        if command is not None:
+            return command, None
+        matches = self.trie.find(verb)
+        if len(matches) > 1:
+            return None, f'ambiguous command {verb}, could be {", ".join(c.verb for c in matches)}'
+        return (matches[0] if matches else None), None
+
+    def parse(self, content) -> ParseResult:
+        tokens = split(content)
+        result = ParseResult(tokens)
+        if tokens is None:
+            result.error = 'unbalanced quotes'
+            return result
+        result.error = self.parse_tokens(tokens, result)
+        return result
+
+    def parse_tokens(self, tokens, result):
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            i += 1
+            if not token.startswith('--') or not is_option(token):
+                continue
+            verb, _, explicit = token.partition('=')
+            command, error = self.lookup(verb)
+            if error is not None:
+                return error
+            if command is None:
+                # Anything after an unknown verb belongs to it and is skipped as well
+                while i < len(tokens) and not is_option(tokens[i]):
+                    i += 1
+                continue
+            if explicit:
+                values = [explicit]
+            else:
+                values = list()
+                while i < len(tokens) and not is_option(tokens[i]):
+                    values.append(tokens[i])
+                    i += 1
+            args, error = command.convert(values)
+            if error is not None:
+                return error
+            result.commands[command.verb] = args
+        return None
+
+    async def dispatch(self, result: ParseResult, context):
+        for verb, command in self.commands.items():
+            if verb in result.commands:
+                await command.handler(context, *result.commands[verb])
+
+    def format_help(self):
+        if self.help is None:
+            sections = [self.description + '\n'] if self.description else list()
+            groups = dict()
+            for command in self.commands.values():
+                if command.help is not None:
+                    groups.setdefault(command.group, list()).append(command)
+            for group, commands in groups.items():
+                lines = [f'{group}:'] if group else list()
+                for command in commands:
+                    invocation = command.get_invocation()
+                    if len(invocation) <= HELP_POSITION - 4:
+                        lines.append(f'  {invocation:{HELP_POSITION - 4}}  {command.help}')
+                    else:
+                        lines.append(f'  {invocation}')
+                        lines.append(' ' * HELP_POSITION + command.help)
+                sections.append('\n'.join(lines) + '\n')
+            self.help = '\n'.join(sections)
+        return self.help
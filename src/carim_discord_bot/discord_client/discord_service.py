@@ -1,16 +1,22 @@
 import asyncio
+import collections
 import datetime
 import hashlib
 import logging
 import re
 import textwrap
+import time
 
 import discord
 
-from carim_discord_bot import managed_service, config
-from carim_discord_bot.discord_client import client
+from carim_discord_bot import managed_service, config, metrics
+from carim_discord_bot.discord_client import client, outbound
 from carim_discord_bot.managed_service import Message
 
+EMBED_FIELD_LIMIT = 25
+EMBED_TOTAL_LIMIT = 6000
+EMBED_VALUE_LIMIT = 1024
+PLAYER_COUNT_RENAME_INTERVAL = datetime.timedelta(minutes=6)
 log = logging.getLogger(__name__)
 
 
@@ -71,32 +77,55 @@ def get_server_color(server_name):
             color_options)]
 
 
+def wrap_line(line, width):
+    # Most log lines fit as they are, and for printable text that fits textwrap would only
+    # strip trailing spaces, so it is skipped for them
+    if len(line) <= width and line.isprintable():
+        line = line.rstrip(' ')
+        return [line] if line else []
+    return textwrap.wrap(line, width)
+
+
 def build_fields(server_name, rolled_up_log, formatted=False):
+    # Running lengths are kept for the current field and message so packing stays linear in
+    # the number of lines, with field values joined once they are full
+    prefix, suffix = ('```\n', '```') if formatted else ('', '')
+    width = EMBED_VALUE_LIMIT - len(prefix) - len(suffix) - 1
+    continued_name = f'{server_name}' if formatted else f'**{server_name}**'
     messages = []
     fields = []
-    current_field = {
-        'name': f'**{server_name}**',
-        'value': '```\n' if formatted else ''
-    }
-    validated_log = []
-    for log_line in rolled_up_log:
-        validated_log += textwrap.wrap(log_line, 1000)
-    for log_line in validated_log:
-        if sum(get_field_length(f) for f in fields) > 4096:
+    message_length = 0
+    name = f'**{server_name}**'
+    lines = []
+    value_length = len(prefix) + len(suffix)
+
+    def add_field():
+        nonlocal fields, message_length, name, lines, value_length
+        field = {
+            'name': name,
+            'value': prefix + ''.join(lines) + suffix
+        }
+        field_length = get_field_length(field)
+        if fields and (len(fields) >= EMBED_FIELD_LIMIT or message_length + field_length > EMBED_TOTAL_LIMIT):
             messages.append(fields)
             fields = []
+            message_length = 0
+        fields.append(field)
+        message_length += field_length
+        name = continued_name
+        lines = []
+        value_length = len(prefix) + len(suffix)
 
-        if not current_field['value'] == '' and get_field_length(current_field) + len(log_line) > 1000:
-            current_field['value'] += '```'
-            fields.append(current_field)
-            current_field = {
-                'name': f'{server_name}' if formatted else f'**{server_name}**',
-                'value': '```\n' if formatted else ''
-            }
-        current_field['value'] += log_line + '\n'
-    current_field['value'] += '```'
-    fields.append(current_field)
-    messages.append(fields)
+    for log_line in rolled_up_log:
+        for line in wrap_line(log_line, width):
+            if lines and value_length + len(line) + 1 > EMBED_VALUE_LIMIT:
+                add_field()
+            lines.append(line + '\n')
+            value_length += len(line) + 1
+    if lines:
+        add_field()
+    if fields:
+        messages.append(fields)
     return messages
 
 
@@ -108,17 +137,50 @@ def get_field_length(field):
     return len(field.get('name', '') + field.get('value', ''))
 
 
+def pack_embeds(server_fields):
+    # Fields from every server sharing a channel are packed into as few embeds as Discord
+    # allows, each embed taking the color of the first server in it
+    embeds = []
+    fields = []
+    length = 0
+    color = None
+    for server_name, field in server_fields:
+        field_length = get_field_length(field)
+        if fields and (len(fields) >= EMBED_FIELD_LIMIT or length + field_length > EMBED_TOTAL_LIMIT):
+            embeds.append({'color': color, 'fields': fields})
+            fields = []
+            length = 0
+        if not fields:
+            color = get_server_color(server_name)
+        fields.append(field)
+        length += field_length
+    if fields:
+        embeds.append({'color': color, 'fields': fields})
+    return embeds
+
+
 class DiscordService(managed_service.ManagedService):
     def __init__(self):
-        super().__init__()
+        super().__init__(config.get().discord_queue_size, config.get().log_overflow_policy)
         self.client = None
-        self.log_rollup = {name: list() for name in config.get_server_names()}
+        self.outbound = None
         start_date = datetime.datetime.now().replace(minute=max(0, datetime.datetime.now().minute - 3))
-        self.last_log_time = {name: start_date for name in config.get_server_names()}
         self.last_player_count_update = {name: start_date for name in config.get_server_names()}
         self.player_counts = {name: '' for name in config.get_server_names()}
+        self.pending_player_counts = dict()
+        self.player_count_updates = dict()
+        self.player_count_renames = collections.Counter()
+        self.presence_task = None
 
     async def stop(self):
+        if self.presence_task is not None:
+            self.presence_task.cancel()
+            self.presence_task = None
+        if self.outbound is not None:
+            self.outbound.close()
+        for task in self.player_count_updates.values():
+            task.cancel()
+        self.player_count_updates = dict()
         await self.client.close()
         sleep_length = 30
         log.info(f'sleeping for {sleep_length} seconds')
@@ -127,12 +189,18 @@ class DiscordService(managed_service.ManagedService):
 
     async def service(self):
         self.client = client.CarimClient()
+        self.outbound = outbound.OutboundScheduler(self.send_to_channel, self.render_logs,
+                                                   config.get().log_flush_delay,
+                                                   buffer_lines=config.get().log_buffer_lines,
+                                                   queue_size=config.get().discord_queue_size,
+                                                   overflow_policy=config.get().log_overflow_policy)
         await self.client.login(config.get().token)
-        asyncio.create_task(self.client.connect())
-        await self.set_presence()
-        while True:
-            await asyncio.sleep(1)
-            await self.flush_log()
+        # Not one of the service's tasks, since it is done as soon as the presence is set
+        self.presence_task = asyncio.create_task(self.set_presence())
+        await self.client.connect()
+        # connect only returns once stop has closed the client, and stop cancels this task
+        # when it is done, so don't let the supervisor mistake this for a crash
+        await asyncio.get_event_loop().create_future()
 
     async def set_presence(self):
         if config.get().presence is not None and len(config.get().presence) > 0:
@@ -146,7 +214,10 @@ class DiscordService(managed_service.ManagedService):
         else:
             activity = None
         await self.client.wait_until_ready()
-        await self.client.change_presence(activity=activity)
+        try:
+            await self.client.change_presence(activity=activity)
+        except discord.DiscordException as e:
+            log.warning(f'failed to set presence: {e}')
 
     async def handle_message(self, message: Message):
         await self.client.wait_until_ready()
@@ -154,10 +225,10 @@ class DiscordService(managed_service.ManagedService):
             await self.handle_player_count_message(message)
         elif isinstance(message, Log):
             log.info(f'log {message.server_name}: {message.text}')
-            self.log_rollup[message.server_name] += f'{message.text}'.split('\n')
+            await self.add_log(message.server_name, f'{message.text}'.split('\n'))
         elif isinstance(message, Response):
             log.info(f'response {message.server_name}: {message.text}')
-            self.log_rollup[message.server_name] += f'{message.text}'.split('\n')
+            await self.add_log(message.server_name, f'{message.text}'.split('\n'))
         elif isinstance(message, Chat):
             log.info(f'chat {message.server_name}: {message.content}')
             channel_id = config.get_server(message.server_name).chat_channel_id
@@ -167,17 +238,15 @@ class DiscordService(managed_service.ManagedService):
                     if r.match(message.content):
                         log.info(f'chat ignored {message.server_name}: {message.content}')
                         return
-                channel: discord.TextChannel = self.client.get_channel(channel_id)
-                await channel.send(embed=discord.Embed(description=message.content))
+                await self.outbound.send_message(channel_id, embed=discord.Embed(description=message.content))
         elif isinstance(message, UserResponse):
             log.info(f'user message {message.channel_id}: {message.text}')
-            channel: discord.TextChannel = self.client.get_channel(message.channel_id)
             for m in build_formatted_fields(message.title, message.text.split('\n')):
                 embed_dict = {
                     'color': get_server_color(message.title),
                     'fields': m
                 }
-                await channel.send(embed=discord.Embed.from_dict(embed_dict))
+                await self.outbound.send_message(message.channel_id, embed=discord.Embed.from_dict(embed_dict))
 
     async def handle_player_count_message(self, message: PlayerCount):
         if config.get_server(message.server_name).player_count_channel_id:
@@ -193,39 +262,72 @@ class DiscordService(managed_service.ManagedService):
                     queue=message.queue,
                     time=message.time
                 )
-            if self.player_counts[message.server_name] != player_count_string:
-                if datetime.timedelta(minutes=6) < \
-                        datetime.datetime.now() - self.last_player_count_update[message.server_name]:
-                    # Rate limit is triggered when updating a channel name too often, so that's why we
-                    # put a hard limit on how often the player count channel gets updated
-                    channel: discord.TextChannel = self.client.get_channel(
-                        config.get_server(message.server_name).player_count_channel_id)
-                    await channel.edit(name=player_count_string)
-                    self.last_player_count_update[message.server_name] = datetime.datetime.now()
-                    self.player_counts[message.server_name] = player_count_string
-                    log.info(f'log {message.server_name}: Update player count: {player_count_string}')
-                    if config.get().log_player_count_updates:
-                        self.log_rollup[message.server_name].append(f'Update player count: {player_count_string}')
-
-    async def flush_log(self):
-        await self.client.wait_until_ready()
-        for server_name in config.get_server_names():
-            if self.log_rollup[server_name] and datetime.timedelta(seconds=10) < \
-                    datetime.datetime.now() - self.last_log_time[server_name]:
-                for message in build_fields(server_name, self.log_rollup[server_name]):
-                    await self.send_rolled_log(server_name, message)
-
-                self.last_log_time[server_name] = datetime.datetime.now()
-                self.log_rollup[server_name] = list()
-
-    async def send_rolled_log(self, server_name, fields):
-        channel: discord.TextChannel = self.client.get_channel(
-            config.get_server(server_name).admin_channel_id)
-        embed_dict = {
-            'color': get_server_color(server_name),
-            'fields': fields
-        }
-        await channel.send(embed=discord.Embed.from_dict(embed_dict))
+            self.pending_player_counts[message.server_name] = player_count_string
+            await self.update_player_count_channel(message.server_name)
+
+    async def update_player_count_channel(self, server_name):
+        player_count_string = self.pending_player_counts.get(server_name)
+        if player_count_string is None or self.player_counts[server_name] == player_count_string:
+            return
+        wait = self.get_player_count_rename_delay(server_name)
+        if wait > 0:
+            # Rate limit is triggered when updating a channel name too often, so that's why we
+            # put a hard limit on how often the player count channel gets updated. The latest
+            # count is kept and applied once the channel can be renamed again, since the same
+            # count won't be sent a second time
+            if server_name not in self.player_count_updates:
+                self.player_count_updates[server_name] = asyncio.create_task(
+                    self.delayed_player_count_update(server_name, wait))
+            return
+        channel: discord.TextChannel = self.client.get_channel(config.get_server(server_name).player_count_channel_id)
+        await channel.edit(name=player_count_string)
+        self.last_player_count_update[server_name] = datetime.datetime.now()
+        self.player_counts[server_name] = player_count_string
+        self.player_count_renames[server_name] += 1
+        log.info(f'log {server_name}: Update player count: {player_count_string}')
+        if config.get().log_player_count_updates:
+            await self.add_log(server_name, [f'Update player count: {player_count_string}'])
+
+    def get_player_count_rename_delay(self, server_name):
+        elapsed = datetime.datetime.now() - self.last_player_count_update[server_name]
+        return (PLAYER_COUNT_RENAME_INTERVAL - elapsed).total_seconds()
+
+    async def delayed_player_count_update(self, server_name, delay):
+        await asyncio.sleep(delay)
+        del self.player_count_updates[server_name]
+        await self.update_player_count_channel(server_name)
+
+    async def add_log(self, server_name, lines):
+        if not config.get_server(server_name).admin_channel_id:
+            return
+        await self.outbound.add_log(config.get_server(server_name).admin_channel_id, server_name, lines)
+
+    def render_logs(self, pending_logs):
+        server_fields = [(server_name, field)
+                         for server_name, lines in pending_logs.items()
+                         for message in build_fields(server_name, lines)
+                         for field in message]
+        return [{'embed': discord.Embed.from_dict(embed)} for embed in pack_embeds(server_fields)]
+
+    async def send_to_channel(self, channel_id, **kwargs):
+        channel: discord.TextChannel = self.client.get_channel(channel_id)
+        if channel is None:
+            log.warning(f'unknown channel {channel_id}')
+            return
+        start = time.perf_counter()
+        await channel.send(**kwargs)
+        metrics.get_registry().observe('carim_discord_send_seconds', time.perf_counter() - start)
+
+    def get_metrics(self):
+        samples = super().get_metrics()
+        if self.outbound is not None:
+            for server_name, count in self.outbound.dropped_lines.items():
+                samples.append(('carim_discord_dropped_lines_total', (('server', server_name),), count))
+            for channel_id, count in self.outbound.dropped_messages.items():
+                samples.append(('carim_discord_dropped_messages_total', (('channel', channel_id),), count))
+        for server_name, count in self.player_count_renames.items():
+            samples.append(('carim_player_count_renames_total', (('server', server_name),), count))
+        return samples
 
 
 service = None
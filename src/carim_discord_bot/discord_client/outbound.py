@@ -0,0 +1,189 @@
+import asyncio
+import collections
+import logging
+
+from carim_discord_bot import managed_service
+
+# Discord allows 5 messages every 5 seconds in a channel
+CHANNEL_BURST = 5
+CHANNEL_RATE = 1
+# Pending log text that fills a whole embed, once field names and padding are counted,
+# is sent without waiting for the flush delay
+FLUSH_SIZE = 5400
+DEFAULT_BUFFER_LINES = 5000
+DEFAULT_QUEUE_SIZE = 1000
+log = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = None
+
+    def refill(self):
+        now = asyncio.get_event_loop().time()
+        if self.updated is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        self.refill()
+        while self.tokens < 1:
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+            self.refill()
+        self.tokens -= 1
+
+
+class ChannelOutbox:
+    def __init__(self, channel_id, scheduler):
+        self.channel_id = channel_id
+        self.scheduler = scheduler
+        self.bucket = TokenBucket(scheduler.rate, scheduler.burst)
+        self.pending_logs = dict()
+        self.pending_size = 0
+        self.suppressed = dict()
+        self.flush_due = False
+        self.flush_handle = None
+        self.jobs = collections.deque()
+        self.log_messages = collections.deque()
+        self.worker = None
+        self.room = asyncio.Event()
+
+    async def wait_for_room(self):
+        self.room.clear()
+        await self.room.wait()
+
+    async def send(self, kwargs):
+        if len(self.jobs) >= self.scheduler.queue_size:
+            if self.scheduler.overflow_policy == managed_service.OVERFLOW_BACKPRESSURE:
+                while len(self.jobs) >= self.scheduler.queue_size:
+                    await self.wait_for_room()
+            else:
+                self.jobs.popleft()
+                self.scheduler.dropped_messages[self.channel_id] += 1
+        self.jobs.append(kwargs)
+        self.start_worker()
+
+    async def add_log(self, server_name, lines):
+        limit = self.scheduler.buffer_lines
+        if self.scheduler.overflow_policy == managed_service.OVERFLOW_BACKPRESSURE:
+            while len(self.pending_logs.get(server_name, ())) >= limit:
+                self.flush()
+                await self.wait_for_room()
+        pending = self.pending_logs.setdefault(server_name, collections.deque())
+        pending.extend(lines)
+        self.pending_size += sum(len(line) + 1 for line in lines)
+        overflow = len(pending) - limit
+        if overflow > 0 and self.scheduler.overflow_policy != managed_service.OVERFLOW_BACKPRESSURE:
+            for _ in range(overflow):
+                self.pending_size -= len(pending.popleft()) + 1
+            self.suppressed[server_name] = self.suppressed.get(server_name, 0) + overflow
+            self.scheduler.dropped_lines[server_name] += overflow
+        if self.flush_handle is None and not self.flush_due:
+            self.flush_handle = asyncio.get_event_loop().call_later(self.scheduler.flush_delay, self.flush)
+        if self.logs_ready():
+            self.start_worker()
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.pending_logs:
+            self.flush_due = True
+            self.start_worker()
+
+    def logs_ready(self):
+        return bool(self.pending_logs) and (self.flush_due or self.pending_size >= FLUSH_SIZE)
+
+    def take_logs(self):
+        # Before the flush deadline only whole embeds worth of lines are taken, and the rest
+        # waits for more lines or the deadline instead of going out in a mostly empty message
+        budget = None if self.flush_due else self.pending_size - self.pending_size % FLUSH_SIZE
+        taken = dict()
+        size = 0
+        for server_name in list(self.pending_logs):
+            if budget is not None and size >= budget:
+                break
+            pending = self.pending_logs[server_name]
+            lines = taken[server_name] = list()
+            suppressed = self.suppressed.pop(server_name, 0)
+            if suppressed and self.scheduler.overflow_policy == managed_service.OVERFLOW_SUMMARIZE:
+                lines.append(f'{suppressed} lines suppressed')
+            while pending and (budget is None or size == 0 or size + len(pending[0]) + 1 <= budget):
+                line = pending.popleft()
+                size += len(line) + 1
+                lines.append(line)
+            if not pending:
+                del self.pending_logs[server_name]
+        self.pending_size -= size
+        if not self.pending_logs:
+            self.flush_due = False
+            if self.flush_handle is not None:
+                self.flush_handle.cancel()
+                self.flush_handle = None
+        self.room.set()
+        return taken
+
+    def start_worker(self):
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self.process_jobs())
+
+    async def process_jobs(self):
+        while self.jobs or self.log_messages or self.logs_ready():
+            await self.bucket.acquire()
+            if self.jobs:
+                job = self.jobs.popleft()
+            else:
+                if not self.log_messages:
+                    # Logs are only rendered once the previous batch is out, so everything
+                    # that arrived while the channel was rate limited is packed together
+                    self.log_messages.extend(self.scheduler.render_logs(self.take_logs()))
+                    if not self.log_messages:
+                        continue
+                job = self.log_messages.popleft()
+            self.room.set()
+            try:
+                await self.scheduler.send(self.channel_id, **job)
+            except Exception:
+                log.warning(f'failed to send message to channel {self.channel_id}', exc_info=True)
+
+    def close(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+        if self.worker is not None:
+            self.worker.cancel()
+
+
+class OutboundScheduler:
+    def __init__(self, send, render_logs, flush_delay, rate=CHANNEL_RATE, burst=CHANNEL_BURST,
+                 buffer_lines=DEFAULT_BUFFER_LINES, queue_size=DEFAULT_QUEUE_SIZE,
+                 overflow_policy=managed_service.OVERFLOW_SUMMARIZE):
+        self.send = send
+        self.render_logs = render_logs
+        self.flush_delay = flush_delay
+        self.rate = rate
+        self.burst = burst
+        self.buffer_lines = buffer_lines
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.dropped_lines = collections.Counter()
+        self.dropped_messages = collections.Counter()
+        self.outboxes = dict()
+
+    def get_outbox(self, channel_id) -> ChannelOutbox:
+        if channel_id not in self.outboxes:
+            self.outboxes[channel_id] = ChannelOutbox(channel_id, self)
+        return self.outboxes[channel_id]
+
+    async def send_message(self, channel_id, **kwargs):
+        await self.get_outbox(channel_id).send(kwargs)
+
+    async def add_log(self, channel_id, server_name, lines):
+        await self.get_outbox(channel_id).add_log(server_name, lines)
+
+    def close(self):
+        for outbox in self.outboxes.values():
+            outbox.close()
+        self.outboxes = dict()
@@ -12,7 +12,7 @@ from carim_discord_bot import setup_instructions, config
 from carim_discord_bot.cftools import omega_service, cf_cloud_service
 from carim_discord_bot.discord_client import discord_service, member_count
 from carim_discord_bot.rcon import rcon_service
-from carim_discord_bot.services import player_count, scheduled_command
+from carim_discord_bot.services import journal, metrics_server, player_count, scheduled_command
 from carim_discord_bot.steam import steam_service
 
 LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s - %(message)s'
@@ -23,7 +23,6 @@ def main():
     parse_parameters()
     start_event_loop()
     asyncio.get_event_loop().run_until_complete(start_service_managers())
-    asyncio.get_event_loop().create_task(debug_tasks())
     run_bot()
 
 
@@ -82,6 +81,10 @@ def loop_exception_handler(loop, context):
 
 
 async def start_service_managers():
+    if config.get().metrics_port is not None:
+        await metrics_server.get_service_manager().start()
+    if config.get().journal_path is not None:
+        await journal.get_service_manager().start()
     await discord_service.get_service_manager().start()
     await member_count.get_service_manager().start()
 
@@ -90,25 +93,19 @@ async def start_service_managers():
     elif config.get().cftools_application_id is not None:
         await omega_service.get_service_manager().start()
 
+    await steam_service.get_service_manager().start()
+    await scheduled_command.get_service_manager().start()
+    if player_count.get_server_names():
+        await player_count.get_service_manager().start()
+
     for server_name in config.get_server_names():
         asyncio.create_task(start_server(server_name))
 
 
 async def start_server(server_name):
-    await steam_service.get_service_manager(server_name).start()
     if config.get_server(server_name).rcon_password is not None:
         await rcon_service.get_service_manager(server_name).start()
-        for i in range(len(config.get_server(server_name).scheduled_commands)):
-            sm = scheduled_command.get_service_manager(server_name, i)
-            await sm.start()
-    if config.get_server(server_name).player_count_channel_id is not None:
-        await player_count.get_service_manager(server_name).start()
-
-
-async def debug_tasks():
-    while False:
-        print('\n'.join(str(task) for task in list(asyncio.all_tasks())))
-        await asyncio.sleep(28)
+        scheduled_command.get_service_manager().add_server(server_name)
 
 
 def run_bot():
@@ -1,6 +1,18 @@
 import asyncio
+import functools
 import logging
-
+import time
+
+from carim_discord_bot import metrics
+
+RESTART_BACKOFF_BASE = 1
+RESTART_BACKOFF_MAX = 60
+# A service that stays up this long gets its restart backoff reset
+RESTART_BACKOFF_RESET = 300
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_SUMMARIZE = 'summarize'
+OVERFLOW_BACKPRESSURE = 'backpressure'
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_SUMMARIZE, OVERFLOW_BACKPRESSURE)
 log = logging.getLogger(__name__)
 
 
@@ -18,50 +30,134 @@ class Restart(Message):
     pass
 
 
-class ManagedService:
+class Supervisor:
     def __init__(self):
+        self.failures = dict()
+        self.pending_restarts = dict()
+
+    def watch(self, service, task: asyncio.Task, essential=False):
+        task.add_done_callback(functools.partial(self._task_done, service, essential))
+
+    def _task_done(self, service, essential, task: asyncio.Task):
+        if task.cancelled() or task not in service.tasks:
+            return
+        if task.exception() is not None:
+            log.error(f'{service._get_server_name_if_present()}something crashed {type(service).__name__}',
+                      exc_info=task.exception())
+            metrics.get_registry().inc('carim_service_crashes_total', service.get_metric_labels())
+        elif essential:
+            # The message processor and service loop only end by being cancelled
+            log.warning(f'{service._get_server_name_if_present()}{type(service).__name__} stopped unexpectedly')
+        else:
+            # A helper task that finished its work
+            service.tasks.remove(task)
+            return
+        self.schedule_restart(service)
+
+    def schedule_restart(self, service, delay=None):
+        if service in self.pending_restarts:
+            return
+        if delay is None:
+            delay = self._get_backoff(service)
+            log.info(f'{service._get_server_name_if_present()}restarting {type(service).__name__} in {delay} seconds')
+        self.pending_restarts[service] = asyncio.get_event_loop().create_task(self._restart(service, delay))
+
+    def cancel_restart(self, service):
+        pending = self.pending_restarts.pop(service, None)
+        if pending is not None:
+            pending.cancel()
+
+    def _get_backoff(self, service):
+        now = asyncio.get_event_loop().time()
+        count, last_failure = self.failures.get(service, (0, now))
+        if now - last_failure > RESTART_BACKOFF_RESET:
+            count = 0
+        self.failures[service] = (count + 1, now)
+        return min(RESTART_BACKOFF_MAX, RESTART_BACKOFF_BASE * 2 ** count)
+
+    async def _restart(self, service, delay):
+        await asyncio.sleep(delay)
+        self.pending_restarts.pop(service, None)
+        try:
+            await service.restart()
+        except Exception:
+            log.error(f'{service._get_server_name_if_present()}restart failed {type(service).__name__}', exc_info=True)
+            self.schedule_restart(service)
+
+
+_supervisor = None
+
+
+def get_supervisor():
+    global _supervisor
+    if _supervisor is None:
+        _supervisor = Supervisor()
+    return _supervisor
+
+
+class ManagedService:
+    def __init__(self, max_queue_size=0, overflow_policy=OVERFLOW_BACKPRESSURE):
         log.debug(f'{self._get_server_name_if_present()}initializing service {type(self).__name__}')
-        self.message_queue = asyncio.Queue()
+        self.message_queue = asyncio.Queue(max_queue_size)
+        self.overflow_policy = overflow_policy
+        self.dropped_messages = 0
         self.tasks = []
+        metrics.get_registry().services.add(self)
 
     def _get_server_name_if_present(self):
         if hasattr(self, 'server_name'):
             return self.server_name + ' '
         return ''
 
+    def get_metric_labels(self):
+        return ('service', type(self).__name__), ('server', getattr(self, 'server_name', None) or '')
+
+    def get_metrics(self):
+        # Gauges read when metrics are collected, as (name, labels, value)
+        labels = self.get_metric_labels()
+        return [
+            ('carim_service_queue_depth', labels, self.message_queue.qsize()),
+            ('carim_service_tasks', labels, sum(1 for task in self.tasks if not task.done())),
+            ('carim_service_dropped_messages_total', labels, self.dropped_messages),
+        ]
+
     async def start(self):
         log.info(f'{self._get_server_name_if_present()}starting service {type(self).__name__}')
-        self.tasks.append(asyncio.create_task(self._message_processor()))
-        self.tasks.append(asyncio.create_task(self.service()))
-        self.tasks.append(asyncio.create_task(self._status_checker()))
+        self.create_task(self._message_processor(), essential=True)
+        if type(self).service is not ManagedService.service:
+            self.create_task(self.service(), essential=True)
+
+    def create_task(self, coro, essential=False):
+        task = asyncio.create_task(coro)
+        self.tasks.append(task)
+        get_supervisor().watch(self, task, essential)
+        return task
 
     async def stop(self):
         log.debug(f'{self._get_server_name_if_present()}stopping service {type(self).__name__}')
+        get_supervisor().cancel_restart(self)
         for task in self.tasks:
             task.cancel()
         self.tasks = []
 
     async def restart(self):
         log.debug(f'{self._get_server_name_if_present()}restarting service {type(self).__name__}')
+        metrics.get_registry().inc('carim_service_restarts_total', self.get_metric_labels())
         await self.stop()
         await self.start()
 
     async def send_message(self, message: Message):
         log.debug(
             f'{self._get_server_name_if_present()}sending message to {type(self).__name__} of type {type(message).__name__}')
+        # A bounded queue either makes the sender wait for room or drops the oldest message,
+        # cancelling its result for anybody still waiting on it
+        if self.message_queue.full() and self.overflow_policy != OVERFLOW_BACKPRESSURE:
+            dropped = self.message_queue.get_nowait()
+            dropped.result.cancel()
+            self.dropped_messages += 1
+            log.debug(f'{self._get_server_name_if_present()}dropped message of type {type(dropped).__name__}')
         await self.message_queue.put(message)
 
-    async def _status_checker(self):
-        await asyncio.sleep(1)
-        while True:
-            for task in self.tasks:
-                task: asyncio.Task = task
-                if task.done():
-                    log.error(f'{self._get_server_name_if_present()}something crashed {type(self).__name__}',
-                              exc_info=task.exception())
-                    await self.send_message(Restart(None))
-            await asyncio.sleep(1)
-
     async def _message_processor(self):
         while True:
             message = await self.message_queue.get()
@@ -72,12 +168,16 @@ class ManagedService:
         if isinstance(message, Stop):
             await self.stop()
         elif isinstance(message, Restart):
-            await self.restart()
+            get_supervisor().schedule_restart(self, delay=0)
         else:
+            start = time.perf_counter()
             await self.handle_message(message)
+            metrics.get_registry().observe('carim_message_handling_seconds', time.perf_counter() - start,
+                                           self.get_metric_labels() + (('message', type(message).__name__),))
 
     async def service(self):
-        raise NotImplementedError
+        # Services without background work leave this alone and no task is started for it
+        pass
 
     async def handle_message(self, message: Message):
         raise NotImplementedError
@@ -0,0 +1,155 @@
+import asyncio
+import bisect
+import collections
+import math
+import weakref
+
+# Upper bounds in seconds, from a quick dispatch up to an RCon command timing out
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Outages run from a dropped packet or two up to a server being down for a restart
+RECOVERY_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+METRICS = {
+    'carim_message_handling_seconds': (HISTOGRAM, 'Time a service spent handling a message, by message type'),
+    'carim_service_queue_depth': (GAUGE, 'Messages waiting in a service queue'),
+    'carim_service_tasks': (GAUGE, 'Running tasks owned by a service'),
+    'carim_service_dropped_messages_total': (COUNTER, 'Messages dropped from a full service queue'),
+    'carim_service_crashes_total': (COUNTER, 'Service tasks that ended unexpectedly'),
+    'carim_service_restarts_total': (COUNTER, 'Service restarts'),
+    'carim_asyncio_tasks': (GAUGE, 'Tasks on the event loop'),
+    'carim_rcon_round_trip_seconds': (HISTOGRAM, 'Time from sending an RCon packet to its reply, by kind'),
+    'carim_rcon_timeouts_total': (COUNTER, 'RCon packets that got no reply, by kind'),
+    'carim_rcon_logged_in': (GAUGE, 'Whether the RCon session for a server is logged in'),
+    'carim_rcon_idle_seconds': (GAUGE, 'Time since anything was heard from the server on an RCon session'),
+    'carim_rcon_keep_alive_seconds': (GAUGE, 'Round trip time of the latest RCon keep alive'),
+    'carim_rcon_recovery_seconds': (HISTOGRAM, 'Time from losing an RCon session to logging in again'),
+    'carim_discord_send_seconds': (HISTOGRAM, 'Time taken by a Discord message send'),
+    'carim_discord_dropped_lines_total': (COUNTER, 'Log lines dropped from a full buffer, by server'),
+    'carim_discord_dropped_messages_total': (COUNTER, 'Messages dropped from a full outbox, by channel'),
+    'carim_player_count_queries_total': (COUNTER, 'Steam queries made for player counts'),
+    'carim_player_count_local_total': (COUNTER, 'Player counts taken from the RCon player roster instead of steam'),
+    'carim_player_count_failures_total': (COUNTER, 'Steam queries for player counts that failed'),
+    'carim_player_count_renames_total': (COUNTER, 'Player count channel renames'),
+    'carim_player_count_interval_seconds': (GAUGE, 'Current delay between player count queries'),
+    'carim_journal_records_total': (COUNTER, 'RCon events written to the journal'),
+    'carim_journal_failures_total': (COUNTER, 'RCon events that could not be written to the journal'),
+    'carim_journal_pending_records': (GAUGE, 'RCon events waiting to be written to the journal'),
+    'carim_cftools_cache_total': (COUNTER, 'CFTools cache lookups, by endpoint and result'),
+    'carim_cftools_cache_size': (GAUGE, 'Entries held in a CFTools cache'),
+}
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # Only as precise as the buckets, so this is the upper bound of the bucket holding the quantile
+        if self.count == 0:
+            return 0
+        rank = math.ceil(q * self.count)
+        seen = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return math.inf
+
+
+class Registry:
+    def __init__(self):
+        self.counters = collections.defaultdict(collections.Counter)
+        self.histograms = collections.defaultdict(dict)
+        self.services = weakref.WeakSet()
+
+    def inc(self, name, labels=(), amount=1):
+        self.counters[name][labels] += amount
+
+    def observe(self, name, value, labels=(), buckets=DEFAULT_BUCKETS):
+        histogram = self.histograms[name].get(labels)
+        if histogram is None:
+            histogram = self.histograms[name][labels] = Histogram(buckets)
+        histogram.observe(value)
+
+    def collect_samples(self):
+        samples = collections.defaultdict(dict)
+        for name, values in self.counters.items():
+            samples[name].update(values)
+        for service in list(self.services):
+            for name, labels, value in service.get_metrics():
+                samples[name][labels] = value
+        try:
+            samples['carim_asyncio_tasks'][()] = len(asyncio.all_tasks())
+        except RuntimeError:
+            pass
+        return samples
+
+    def format_prometheus(self):
+        lines = list()
+        samples = self.collect_samples()
+        for name in sorted(set(samples) | set(self.histograms)):
+            metric_type, description = METRICS.get(name, (GAUGE, ''))
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for labels, value in sorted(samples.get(name, dict()).items()):
+                lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+            for labels, histogram in sorted(self.histograms.get(name, dict()).items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (math.inf,), histogram.counts):
+                    cumulative += count
+                    bucket_labels = labels + (('le', format_value(bound)),)
+                    lines.append(f'{name}_bucket{format_labels(bucket_labels)} {cumulative}')
+                lines.append(f'{name}_sum{format_labels(labels)} {format_value(histogram.sum)}')
+                lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def format_summary(self):
+        # A compact view for Discord, with latencies as p50/p99 in milliseconds
+        lines = list()
+        samples = self.collect_samples()
+        for name in sorted(samples):
+            for labels, value in sorted(samples[name].items()):
+                if value:
+                    lines.append(f'{name[len("carim_"):]}{format_labels(labels)} {format_value(value)}')
+        for name in sorted(self.histograms):
+            for labels, histogram in sorted(self.histograms[name].items()):
+                lines.append(f'{name[len("carim_"):]}{format_labels(labels)} n={histogram.count} '
+                             f'p50={histogram.quantile(0.5) * 1000:g}ms p99={histogram.quantile(0.99) * 1000:g}ms')
+        return '\n'.join(lines)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+_registry = None
+
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        _registry = Registry()
+    return _registry
@@ -1,57 +1,101 @@
 import asyncio
 import logging
-import re
-from typing import Optional
 
 from carim_discord_bot import config
 from carim_discord_bot.discord_client import discord_service
-from carim_discord_bot.rcon import protocol
+from carim_discord_bot.rcon import protocol, events, player_sessions
+from carim_discord_bot.services import journal
 
 log = logging.getLogger(__name__)
 
 
-class ProtocolFactory:
-    def __init__(self, server_name, rcon_registrar):
+class EventDispatcher:
+    def __init__(self, server_name):
         self.server_name = server_name
-        self.rcon_registrar = rcon_registrar
+        self.server_config = config.get_server(server_name)
+        self.roster = player_sessions.get_roster(server_name)
+        self.pending = list()
+
+    def dispatch(self, event: events.Event):
+        self.roster.handle(event)
+        # Events from a burst of datagrams are collected and sent together on the
+        # next loop iteration instead of creating tasks for every single message
+        self.pending.append(event)
+        if len(self.pending) == 1:
+            asyncio.get_event_loop().call_soon(self.flush)
+
+    def flush(self):
+        pending = self.pending
+        self.pending = list()
+        journal.get_service_manager().record(self.server_name, pending)
+        asyncio.create_task(self.send(pending))
+
+    async def send(self, pending):
+        service = discord_service.get_service_manager()
+        for event in pending:
+            for message in self.get_discord_messages(event):
+                await service.send_message(message)
 
-    def get(self):
-        return RConProtocol(self.server_name, self.rcon_registrar)
+    def get_discord_messages(self, event: events.Event):
+        messages = list()
+        show_notices = self.server_config.chat_show_connect_disconnect_notices
+        if isinstance(event, events.Disconnect):
+            log.info(f'{self.server_name} login event {event.name} disconnected')
+            if show_notices:
+                messages.append(discord_service.Chat(self.server_name, f'{event.name} disconnected'))
+        elif isinstance(event, events.Connect):
+            log.info(f'{self.server_name} login event {event.name} connected')
+            if show_notices:
+                messages.append(discord_service.Chat(self.server_name, f'{event.name} connected'))
+        elif isinstance(event, events.Chat) and event.channel in events.CHAT_RELAY_CHANNELS:
+            messages.append(discord_service.Chat(self.server_name, event.content))
+        if len(event.message) > 0:
+            messages.append(discord_service.Log(self.server_name, event.message))
+        return messages
 
 
-class RConProtocol(asyncio.DatagramProtocol):
-    def __init__(self, server_name, rcon_registrar):
-        self.transport = None
+class RConSession:
+    # One server's side of the shared RCon socket, fed the datagrams that came from its address
+    def __init__(self, server_name, rcon_registrar, address, send):
         self.server_name = server_name
         self.rcon_registrar = rcon_registrar
+        self.address = address
+        self.send = send
+        self.dispatcher = EventDispatcher(server_name)
         self.logged_in = False
         self.logged_in_event = asyncio.Event()
-        super().__init__()
+        self.on_login = None
+        self.on_ready = None
+        self.state = None
+        self.failures = 0
+        self.lost_at = None
+        self.last_received = None
+        self.last_command = None
+        self.keep_alive_round_trip = None
+        self.deadline = None
+        self.action = None
 
-    def connection_made(self, transport: asyncio.DatagramTransport):
-        self.transport = transport
+    def login(self):
         data = protocol.Packet(protocol.Login(password=config.get_server(self.server_name).rcon_password)).generate()
         log.info(f'{self.server_name} sending login')
         self.send_rcon_datagram(data)
 
-    def connection_lost(self, exc: Optional[Exception]) -> None:
-        self.logged_in = False
-        self.transport.close()
-        log.warning(f'{self.server_name} connection lost {exc}')
-
-    def error_received(self, exc: Exception) -> None:
-        self.logged_in = False
-        self.transport.close()
-        log.warning(f'{self.server_name} error received {exc}')
-
     def datagram_received(self, data, addr):
         log.debug(f'{self.server_name} received {data}')
         packet = protocol.Packet.parse(data)
         if packet is not None:
+            # Anything heard from the server shows the session is alive, while logins and command
+            # replies also show the server has heard from us, so the keep alive can wait
+            self.last_received = asyncio.get_event_loop().time()
+            if not isinstance(packet.payload, protocol.Message):
+                self.last_command = self.last_received
             if isinstance(packet.payload, protocol.Login):
                 log.info(f'{self.server_name} login was {"" if packet.payload.success else "not "}successful')
                 self.logged_in = packet.payload.success
-                self.logged_in_event.set()
+                if self.logged_in:
+                    self.logged_in_event.set()
+                if self.on_login is not None:
+                    self.on_login(self)
             else:
                 response = self.process_packet(packet)
                 if response is not None:
@@ -60,7 +104,7 @@ class RConProtocol(asyncio.DatagramProtocol):
 
     def send_rcon_datagram(self, data):
         log.debug(f'{self.server_name} sending {data}')
-        self.transport.sendto(data)
+        self.send(data, self.address)
 
     def process_packet(self, packet):
         if isinstance(packet.payload, protocol.Command) or isinstance(packet.payload, protocol.SplitCommand):
@@ -68,34 +112,6 @@ class RConProtocol(asyncio.DatagramProtocol):
         elif isinstance(packet.payload, protocol.Message):
             message = packet.payload.message
             log.debug(f'{self.server_name} message: {message}')
-            disconnect = re.compile(r'Player .* disconnected')
-            if disconnect.match(message):
-                parts = message.split()
-                disconnect_message = ' '.join(parts[2:])
-                log.info(f'{self.server_name} login event {disconnect_message}')
-                if config.get_server(self.server_name).chat_show_connect_disconnect_notices:
-                    asyncio.create_task(discord_service.get_service_manager().send_message(
-                        discord_service.Chat(self.server_name, disconnect_message)
-                    ))
-            connect = re.compile(r'Verified GUID .* of player .*')
-            if connect.match(message):
-                parts = message.split()
-                name = ' '.join(parts[6:])
-                login_message = f'{name} connected'
-                log.info(f'{self.server_name} login event {login_message}')
-                if config.get_server(self.server_name).chat_show_connect_disconnect_notices:
-                    asyncio.create_task(discord_service.get_service_manager().send_message(
-                        discord_service.Chat(self.server_name, login_message)
-                    ))
-            chat = re.compile(r'^\((Global|Side)\).*:.*')
-            if chat.match(message):
-                _, _, content = message.partition(' ')
-                asyncio.create_task(discord_service.get_service_manager().send_message(
-                    discord_service.Chat(self.server_name, content)
-                ))
-            if len(message) > 0:
-                asyncio.create_task(discord_service.get_service_manager().send_message(
-                    discord_service.Log(self.server_name, message)
-                ))
+            self.dispatcher.dispatch(events.classify(message))
             return protocol.Packet(protocol.Message(packet.payload.sequence_number)).generate()
         return None
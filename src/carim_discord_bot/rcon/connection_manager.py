@@ -0,0 +1,260 @@
+import asyncio
+import heapq
+import logging
+import random
+import socket
+import time
+
+from carim_discord_bot import config, metrics
+from carim_discord_bot.discord_client import discord_service
+from carim_discord_bot.rcon import connection, protocol, registrar
+
+# BattlEye drops a client that hasn't sent a command for 45 seconds, however busy the session is
+KEEP_ALIVE_COMMAND_INTERVAL = 40
+KEEP_ALIVE_TIMEOUT = 10
+LOGIN_TIMEOUT = 5
+RECONNECT_BACKOFF_BASE = 1
+RECONNECT_BACKOFF_MAX = 60
+LOGGING_IN = 'logging_in'
+LOGGED_IN = 'logged_in'
+BACKING_OFF = 'backing_off'
+log = logging.getLogger(__name__)
+
+
+class Reactor(asyncio.DatagramProtocol):
+    def __init__(self, sessions):
+        self.sessions = sessions
+
+    def datagram_received(self, data, addr):
+        session = self.sessions.get(addr)
+        if session is None:
+            log.debug(f'dropping datagram from unknown address {addr}')
+            return
+        session.datagram_received(data, addr)
+
+    def error_received(self, exc):
+        # An unconnected socket can't tell which server an error belongs to, so the
+        # session it was for notices through its login or keep alive timing out
+        log.warning(f'rcon socket error received {exc}')
+
+
+class ConnectionManager:
+    # The sessions for every server share one socket, with datagrams handed out by the address
+    # they came from, and one timer for their logins, keep alives and reconnects. Adding a server
+    # adds no tasks of its own, only a short lived one while each keep alive is out.
+    # A session goes from logging in to logged in, or to backing off before the next attempt
+    # when its login times out or is rejected. Keep alives are only sent once the session has
+    # gone quiet, and one timing out starts a new login at once
+    def __init__(self):
+        self.transport = None
+        self.sessions = dict()
+        self.addresses = dict()
+        self.deadlines = list()
+        self.timer = None
+        self.lock = asyncio.Lock()
+        metrics.get_registry().services.add(self)
+
+    async def open(self):
+        async with self.lock:
+            if self.transport is None or self.transport.is_closing():
+                self.transport, _ = await asyncio.get_event_loop().create_datagram_endpoint(
+                    lambda: Reactor(self.addresses), local_addr=('0.0.0.0', 0))
+
+    def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.deadlines.clear()
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+    async def add(self, server_name, rcon_registrar, on_ready=None) -> connection.RConSession:
+        self.remove(server_name)
+        server_config = config.get_server(server_name)
+        infos = await asyncio.get_event_loop().getaddrinfo(
+            server_config.ip, server_config.rcon_port, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        address = infos[0][4]
+        if address in self.addresses:
+            log.warning(f'{server_name} shares its rcon address {address} with '
+                        f'{self.addresses[address].server_name}, which will stop receiving replies')
+        await self.open()
+        session = connection.RConSession(server_name, rcon_registrar, address, self.send)
+        session.on_login = self.logged_in
+        session.on_ready = on_ready
+        rcon_registrar.send_datagram = session.send_rcon_datagram
+        self.sessions[server_name] = session
+        self.addresses[address] = session
+        self.login(session)
+        return session
+
+    def remove(self, server_name):
+        session = self.sessions.pop(server_name, None)
+        if session is None:
+            return
+        if self.addresses.get(session.address) is session:
+            del self.addresses[session.address]
+        session.deadline = None
+        session.state = None
+        session.logged_in = False
+        session.logged_in_event.clear()
+        if not self.sessions:
+            self.close()
+
+    def send(self, data, address):
+        if self.transport is not None:
+            self.transport.sendto(data, address)
+
+    def schedule(self, session, delay, action):
+        session.deadline = asyncio.get_event_loop().time() + delay
+        session.action = action
+        heapq.heappush(self.deadlines, (session.deadline, session.server_name))
+        self.schedule_timer()
+
+    def schedule_timer(self):
+        if not self.deadlines:
+            return
+        earliest = self.deadlines[0][0]
+        if self.timer is not None:
+            if self.timer.when() <= earliest:
+                return
+            self.timer.cancel()
+        self.timer = asyncio.get_event_loop().call_at(earliest, self.check_deadlines)
+
+    def check_deadlines(self):
+        self.timer = None
+        now = asyncio.get_event_loop().time()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, server_name = heapq.heappop(self.deadlines)
+            session = self.sessions.get(server_name)
+            if session is None or session.deadline != deadline:
+                # The session was removed or rescheduled since this entry was added
+                continue
+            session.deadline = None
+            session.action(session)
+        self.schedule_timer()
+
+    def login(self, session):
+        session.state = LOGGING_IN
+        session.login()
+        self.schedule(session, LOGIN_TIMEOUT, self.login_failed)
+
+    def login_failed(self, session):
+        session.state = BACKING_OFF
+        delay = self.get_backoff(session)
+        log.info(f'{session.server_name} login failed, retrying in {delay:.1f} seconds')
+        self.schedule(session, delay, self.login)
+
+    def get_backoff(self, session):
+        # Jittered so servers that went down together don't all retry at the same moment
+        delay = min(RECONNECT_BACKOFF_MAX, RECONNECT_BACKOFF_BASE * 2 ** session.failures)
+        session.failures += 1
+        return random.uniform(delay / 2, delay)
+
+    def logged_in(self, session):
+        if not session.logged_in:
+            self.login_failed(session)
+            return
+        session.state = LOGGED_IN
+        session.failures = 0
+        if session.lost_at is not None:
+            recovery = asyncio.get_event_loop().time() - session.lost_at
+            session.lost_at = None
+            log.info(f'{session.server_name} session recovered after {recovery:.1f} seconds')
+            metrics.get_registry().observe('carim_rcon_recovery_seconds', recovery,
+                                           (('server', session.server_name),), metrics.RECOVERY_BUCKETS)
+            asyncio.create_task(self.discord_log(session, f'reconnected after {recovery:.1f} seconds'))
+        self.schedule_keep_alive(session)
+        if session.on_ready is not None:
+            session.on_ready()
+
+    def connection_lost(self, session):
+        # The server stopped answering, so log in again right away. Commands sent from now
+        # on wait for the session to come back instead of failing
+        if session.lost_at is None:
+            session.lost_at = asyncio.get_event_loop().time()
+        session.logged_in = False
+        session.logged_in_event.clear()
+        session.dispatcher.roster.lose_sync()
+        self.login(session)
+
+    def get_keep_alive_due(self, session):
+        idle = config.get_server(session.server_name).rcon_keep_alive_idle
+        return min(session.last_received + idle, session.last_command + KEEP_ALIVE_COMMAND_INTERVAL)
+
+    def schedule_keep_alive(self, session):
+        self.schedule(session, self.get_keep_alive_due(session) - asyncio.get_event_loop().time(),
+                      self.check_keep_alive)
+
+    def check_keep_alive(self, session):
+        # Traffic since the check was scheduled pushes it back rather than every datagram moving the timer
+        if self.get_keep_alive_due(session) > asyncio.get_event_loop().time():
+            self.schedule_keep_alive(session)
+        else:
+            self.start_keep_alive(session)
+
+    def probe(self, session):
+        # A command that got no reply is a sign the session may be dead, so it is checked now
+        # instead of after the idle period. Nothing is done while a keep alive is already out
+        if self.sessions.get(session.server_name) is session and session.action == self.check_keep_alive \
+                and session.deadline is not None:
+            self.start_keep_alive(session)
+
+    def start_keep_alive(self, session):
+        session.deadline = None
+        asyncio.create_task(self.keep_alive(session))
+
+    async def keep_alive(self, session):
+        log.debug(f'{session.server_name} sending keep alive')
+        labels = ('server', session.server_name), ('kind', 'keep_alive')
+        seq_number = await session.rcon_registrar.get_next_sequence_number()
+        packet = protocol.Packet(protocol.Command(seq_number))
+        future = asyncio.get_event_loop().create_future()
+        data = packet.generate()
+        await session.rcon_registrar.register(seq_number, future, timeout=KEEP_ALIVE_TIMEOUT, data=data,
+                                              retries=registrar.DEFAULT_RETRIES)
+        session.send_rcon_datagram(data)
+        start = time.perf_counter()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if self.sessions.get(session.server_name) is not session or session.state != LOGGED_IN:
+                return
+            log.warning(f'{session.server_name} keep alive timed out, logging in again')
+            metrics.get_registry().inc('carim_rcon_timeouts_total', labels)
+            self.connection_lost(session)
+            await self.discord_log(session, 'keep alive timed out')
+            return
+        session.keep_alive_round_trip = time.perf_counter() - start
+        metrics.get_registry().observe('carim_rcon_round_trip_seconds', session.keep_alive_round_trip, labels)
+        if self.sessions.get(session.server_name) is session and session.state == LOGGED_IN:
+            self.schedule_keep_alive(session)
+        if config.get_server(session.server_name).log_rcon_keep_alive:
+            await self.discord_log(session, f'keep alive {session.keep_alive_round_trip * 1000:.0f}ms')
+
+    async def discord_log(self, session, message):
+        await discord_service.get_service_manager().send_message(
+            discord_service.Log(session.server_name, message)
+        )
+
+    def get_metrics(self):
+        samples = list()
+        now = asyncio.get_event_loop().time()
+        for server_name, session in self.sessions.items():
+            labels = (('server', server_name),)
+            samples.append(('carim_rcon_logged_in', labels, int(session.logged_in)))
+            if session.last_received is not None:
+                samples.append(('carim_rcon_idle_seconds', labels, round(now - session.last_received, 3)))
+            if session.keep_alive_round_trip is not None:
+                samples.append(('carim_rcon_keep_alive_seconds', labels, session.keep_alive_round_trip))
+        return samples
+
+
+_connection_manager = None
+
+
+def get_connection_manager():
+    global _connection_manager
+    if _connection_manager is None:
+        _connection_manager = ConnectionManager()
+    return _connection_manager
@@ -0,0 +1,102 @@
+import re
+
+CHAT_RELAY_CHANNELS = ('Global', 'Side')
+
+
+class Event:
+    def __init__(self, message):
+        self.message = message
+
+
+class Connect(Event):
+    def __init__(self, message, number, name, guid):
+        super().__init__(message)
+        self.number = number
+        self.name = name
+        self.guid = guid
+
+
+class Disconnect(Event):
+    def __init__(self, message, number, name):
+        super().__init__(message)
+        self.number = number
+        self.name = name
+
+
+class Chat(Event):
+    def __init__(self, message, channel, author, text):
+        super().__init__(message)
+        self.channel = channel
+        self.author = author
+        self.text = text
+
+    @property
+    def content(self):
+        _, _, content = self.message.partition(' ')
+        return content
+
+
+class Kick(Event):
+    def __init__(self, message, number, name, guid, reason):
+        super().__init__(message)
+        self.number = number
+        self.name = name
+        self.guid = guid
+        self.reason = reason
+
+
+class Ban(Kick):
+    pass
+
+
+class Other(Event):
+    pass
+
+
+def _build_connect(message, match):
+    return Connect(message, int(match.group('number')), match.group('name'), match.group('guid'))
+
+
+def _build_disconnect(message, match):
+    return Disconnect(message, int(match.group('number')), match.group('name'))
+
+
+def _build_kick(message, match):
+    # Bans show up as a kick with the ban as the reason
+    event_type = Ban if match.group('reason').startswith('Admin Ban') else Kick
+    return event_type(message, int(match.group('number')), match.group('name'), match.group('guid'),
+                      match.group('reason'))
+
+
+def _build_chat(message, match):
+    return Chat(message, match.group('channel'), match.group('author'), match.group('text'))
+
+
+# Each prefix selects the only patterns that can possibly match, so a message is looked at
+# with at most a couple of regexes instead of all of them. Prefixes must start with
+# different characters since they are looked up by the first one
+CLASSIFIERS = (
+    ('Player #', (
+        (re.compile(r'Player #(?P<number>\d+) (?P<name>.*) \((?P<guid>[0-9a-fA-F]+|-)\) '
+                    r'has been kicked by BattlEye: (?P<reason>.*)', re.DOTALL), _build_kick),
+        (re.compile(r'Player #(?P<number>\d+) (?P<name>.*) disconnected$', re.DOTALL), _build_disconnect),
+    )),
+    ('Verified GUID', (
+        (re.compile(r'Verified GUID \((?P<guid>[^)]*)\) of player #(?P<number>\d+) (?P<name>.*)', re.DOTALL),
+         _build_connect),
+    )),
+    ('(', (
+        (re.compile(r'\((?P<channel>\w+)\) (?P<author>.*?): ?(?P<text>.*)', re.DOTALL), _build_chat),
+    )),
+)
+_CLASSIFIERS_BY_FIRST_CHARACTER = {prefix[0]: (prefix, patterns) for prefix, patterns in CLASSIFIERS}
+
+
+def classify(message) -> Event:
+    prefix, patterns = _CLASSIFIERS_BY_FIRST_CHARACTER.get(message[:1], ('', ()))
+    if message.startswith(prefix):
+        for pattern, build in patterns:
+            match = pattern.match(message)
+            if match is not None:
+                return build(message, match)
+    return Other(message)
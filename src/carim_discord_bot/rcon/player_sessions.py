@@ -0,0 +1,140 @@
+import collections
+import datetime
+import time
+
+from carim_discord_bot.rcon import events, players
+
+HISTORY_SIZE = 1000
+
+
+def build_player(event: events.Connect):
+    # The connect event has no address or ping, which only the players command knows
+    return players.Player(event.number, None, None, None, event.guid, True, event.name, False)
+
+
+class PlayerSession:
+    __slots__ = ('player', 'joined', 'left')
+
+    def __init__(self, player: players.Player, joined):
+        self.player = player
+        self.joined = joined
+        self.left = None
+
+    def get_duration(self, now):
+        return (self.left if self.left is not None else now) - self.joined
+
+
+class PlayerRoster:
+    # The players online on one server, seeded from the players command and then kept up to
+    # date from connect and disconnect events, so the player list is known without asking
+    def __init__(self, server_name, clock=time.time):
+        self.server_name = server_name
+        self.clock = clock
+        self.online = dict()
+        self.by_guid = dict()
+        self.by_name = dict()
+        self.history = collections.deque(maxlen=HISTORY_SIZE)
+        self.synced = False
+        self.replay = None
+
+    def handle(self, event: events.Event):
+        if self.replay is not None:
+            self.replay.append(event)
+        self.apply(event)
+
+    def apply(self, event: events.Event):
+        if isinstance(event, events.Connect):
+            self.join(build_player(event))
+        elif isinstance(event, events.Disconnect):
+            self.leave(event.number)
+
+    def join(self, player: players.Player):
+        session = self.online.get(player.number)
+        if session is not None and session.player.key == player.key:
+            if player.ip is not None:
+                session.player = player
+            return
+        if session is not None:
+            # A disconnect was missed and the number has been handed to somebody else
+            self.leave(player.number)
+        session = PlayerSession(player, self.clock())
+        self.online[player.number] = session
+        self.by_guid[player.guid] = session
+        self.by_name[player.name.lower()] = session
+
+    def leave(self, number):
+        session = self.online.pop(number, None)
+        if session is None:
+            return
+        session.left = self.clock()
+        if self.by_guid.get(session.player.guid) is session:
+            del self.by_guid[session.player.guid]
+        if self.by_name.get(session.player.name.lower()) is session:
+            del self.by_name[session.player.name.lower()]
+        self.history.append(session)
+
+    def begin_seed(self):
+        self.synced = False
+        self.replay = list()
+
+    def cancel_seed(self):
+        self.replay = None
+
+    def lose_sync(self):
+        # Connects and disconnects sent while the session was down are lost, so the roster can't
+        # be trusted again until it is seeded after the next login
+        self.synced = False
+        self.replay = None
+
+    def seed(self, current_players):
+        # Events that arrived while the players command was out are applied again on top of
+        # its answer, so a connect or disconnect in between isn't lost. Only the difference
+        # from the roster is then applied, keeping the join times of players already known
+        replay = self.replay or list()
+        self.replay = None
+        target = {p.number: p for p in current_players}
+        for event in replay:
+            if isinstance(event, events.Connect):
+                if event.number not in target or target[event.number].guid != event.guid:
+                    target[event.number] = build_player(event)
+            elif isinstance(event, events.Disconnect):
+                target.pop(event.number, None)
+        for number in [n for n, s in self.online.items() if n not in target or s.player.key != target[n].key]:
+            self.leave(number)
+        for player in target.values():
+            self.join(player)
+        self.synced = True
+
+    def get(self, guid_or_name):
+        return self.by_guid.get(guid_or_name) or self.by_name.get(guid_or_name.lower())
+
+    def get_players(self):
+        return [self.online[number].player for number in sorted(self.online)]
+
+    def get_count(self):
+        return len(self.online)
+
+    def format_players(self):
+        # Laid out like the players command, with how long each player has been online
+        now = self.clock()
+        lines = ['Players on server:', '[#] [IP Address]:[Port] [Ping] [GUID] [Name] [Online]', '-' * 50]
+        for number in sorted(self.online):
+            session = self.online[number]
+            p = session.player
+            address = f'{p.ip}:{p.port}' if p.ip is not None else '-'
+            ping = p.ping if p.ping is not None else '-'
+            status = '(OK)' if p.verified else '(?)'
+            lobby = ' (Lobby)' if p.lobby else ''
+            online = datetime.timedelta(seconds=int(session.get_duration(now)))
+            lines.append(f'{p.number:<4}{address:<18}{ping:<5}{p.guid}{status} {p.name}{lobby} {online}')
+        lines.append(f'({len(self.online)} players in total)')
+        return '\n'.join(lines)
+
+
+rosters = dict()
+
+
+def get_roster(server_name) -> PlayerRoster:
+    if server_name not in rosters:
+        rosters[server_name] = PlayerRoster(server_name)
+    return rosters[server_name]
@@ -0,0 +1,50 @@
+import re
+
+# 0   127.0.0.1:2304    47   0123456789abcdef0123456789abcdef(OK) Survivor (Lobby)
+PLAYER_LINE = re.compile(r'^(?P<number>\d+)\s+(?P<ip>[^\s:]+):(?P<port>\d+)\s+(?P<ping>-?\d+)\s+'
+                         r'(?P<guid>[0-9a-fA-F]+|-)(?:\((?P<status>[^)]*)\))?\s+(?P<name>.*?)'
+                         r'(?P<lobby>\s+\(Lobby\))?\s*$')
+
+
+class Player:
+    def __init__(self, number, ip, port, ping, guid, verified, name, lobby):
+        self.number = number
+        self.ip = ip
+        self.port = port
+        self.ping = ping
+        self.guid = guid
+        self.verified = verified
+        self.name = name
+        self.lobby = lobby
+
+    @property
+    def key(self):
+        # Player numbers are handed out per connection, so together with the GUID they
+        # identify a single session even if the same person reconnects
+        return self.number, self.guid
+
+    def __repr__(self):
+        return f'Player({self.number}, {self.name!r}, {self.guid})'
+
+
+def parse_player_line(line):
+    match = PLAYER_LINE.match(line)
+    if match is None:
+        return None
+    return Player(number=int(match.group('number')),
+                  ip=match.group('ip'),
+                  port=int(match.group('port')),
+                  ping=int(match.group('ping')),
+                  guid=match.group('guid'),
+                  verified=match.group('status') == 'OK',
+                  name=match.group('name'),
+                  lobby=match.group('lobby') is not None)
+
+
+def parse_players(raw_players):
+    players = list()
+    for line in raw_players.splitlines():
+        player = parse_player_line(line)
+        if player is not None:
+            players.append(player)
+    return players
@@ -19,18 +19,30 @@ E = 0x45
 H_END = 0xff
 SUCCESS = 0x01
 
+# Formats are compiled once and payloads are parsed through memoryviews of the datagram,
+# so parsing a packet doesn't copy the data until it is decoded into a string
+HEADER = struct.Struct(FORMAT_PREFIX + HEADER_FORMAT)
+PACKET_TYPE = struct.Struct(FORMAT_PREFIX + PACKET_TYPE_FORMAT)
+SEQUENCE_NUMBER = struct.Struct(FORMAT_PREFIX + SEQUENCE_NUMBER_FORMAT)
+COMMAND_HEADER = struct.Struct(FORMAT_PREFIX + PACKET_TYPE_FORMAT + SEQUENCE_NUMBER_FORMAT)
+SPLIT_HEADER = struct.Struct(FORMAT_PREFIX + SPLIT_HEADER_FORMAT)
+# The checksum covers the 0xff that ends the header, so CRC32 is seeded with it
+CHECKSUM_SEED = zlib.crc32(bytes([H_END]))
+
 log = logging.getLogger(__name__)
 
 
 class Packet:
+    __slots__ = ('payload',)
+
     def __init__(self, payload):
         self.payload = payload
 
     @staticmethod
     def parse(data):
         try:
-            b, e, checksum, f = struct.unpack_from(FORMAT_PREFIX + HEADER_FORMAT, data)
-            payload_data = data[HEADER_SIZE:]
+            b, e, checksum, f = HEADER.unpack_from(data)
+            payload_data = memoryview(data)[HEADER_SIZE:]
             if b == B and e == E and f == H_END and checksum == Packet.checksum(payload_data):
                 payload = Payload.parse(payload_data)
                 return Packet(payload)
@@ -40,21 +52,32 @@ class Packet:
 
     def generate(self):
         payload = self.payload.generate()
-        return struct.pack(FORMAT_PREFIX + HEADER_FORMAT, B, E, Packet.checksum(payload), H_END) + payload
+        return HEADER.pack(B, E, Packet.checksum(payload), H_END) + payload
 
     @staticmethod
     def checksum(data):
-        checksum = zlib.crc32(bytes([H_END]) + data)
-        return checksum
+        return zlib.crc32(data, CHECKSUM_SEED)
 
     def __str__(self):
         return str(self.payload)
 
 
+def decode(data, errors='strict'):
+    # ASCII is a subset of UTF-8, so a single decode covers both
+    return str(data, encoding='utf-8', errors=errors)
+
+
+def encode(text):
+    return bytes(text, encoding='utf-8')
+
+
 class Payload:
+    __slots__ = ()
+
     @staticmethod
     def parse(data):
-        packet_type = struct.unpack_from(FORMAT_PREFIX + PACKET_TYPE_FORMAT, data)[0]
+        data = memoryview(data)
+        packet_type = PACKET_TYPE.unpack_from(data)[0]
         if packet_type == LOGIN:
             return Login.parse(data[1:])
         if packet_type == COMMAND:
@@ -74,23 +97,27 @@ class Payload:
 
 
 class Login(Payload):
+    __slots__ = ('password', 'success')
+
     def __init__(self, password=None, success=False):
         self.password = password
         self.success = success
 
     @staticmethod
     def parse(data):
-        success_flag = struct.unpack_from(FORMAT_PREFIX + SEQUENCE_NUMBER_FORMAT, data)[0]
+        success_flag = SEQUENCE_NUMBER.unpack_from(data)[0]
         return Login(success=success_flag == SUCCESS)
 
     def generate(self):
-        return struct.pack(FORMAT_PREFIX + PACKET_TYPE_FORMAT, LOGIN) + bytes(self.password, encoding='ascii')
+        return PACKET_TYPE.pack(LOGIN) + bytes(self.password, encoding='ascii')
 
     def __str__(self):
         return f'Login {self.success}'
 
 
 class Command(Payload):
+    __slots__ = ('sequence_number', 'data', 'command')
+
     def __init__(self, sequence_number, data=None, command=''):
         self.sequence_number = sequence_number
         self.data = data
@@ -98,22 +125,13 @@ class Command(Payload):
 
     @staticmethod
     def parse(data):
-        sequence_number = struct.unpack_from(FORMAT_PREFIX + SEQUENCE_NUMBER_FORMAT, data)[0]
+        sequence_number = SEQUENCE_NUMBER.unpack_from(data)[0]
         if len(data) > 1 and data[1] == 0x00:
             return SplitCommand.parse(data)
-        try:
-            return Command(sequence_number, data=str(data[1:], encoding='ascii'))
-        except UnicodeDecodeError:
-            return Command(sequence_number, data=str(data[1:], encoding='utf-8'))
+        return Command(sequence_number, data=decode(data[1:]))
 
     def generate(self):
-        packet = struct.pack(FORMAT_PREFIX + PACKET_TYPE_FORMAT + SEQUENCE_NUMBER_FORMAT, COMMAND, self.sequence_number)
-        try:
-            command = bytes(self.command, encoding='ascii')
-        except UnicodeEncodeError:
-            command = bytes(self.command, encoding='utf-8')
-        packet += command
-        return packet
+        return COMMAND_HEADER.pack(COMMAND, self.sequence_number) + encode(self.command)
 
     def __str__(self):
         single_line = self.data.replace('\n', '|')
@@ -121,21 +139,23 @@ class Command(Payload):
 
 
 class SplitCommand(Payload):
+    __slots__ = ('sequence_number', 'raw', 'count', 'index')
+
     def __init__(self, sequence_number, data, count, index):
         self.sequence_number = sequence_number
-        self.data = data
+        # Fragments are kept as bytes since a multi-byte character can be split between two of them
+        self.raw = encode(data) if isinstance(data, str) else data
         self.count = count
         self.index = index
 
+    @property
+    def data(self):
+        return decode(self.raw, errors='replace')
+
     def generate(self):
-        packet = struct.pack(FORMAT_PREFIX + PACKET_TYPE_FORMAT + SEQUENCE_NUMBER_FORMAT, COMMAND, self.sequence_number)
-        packet += struct.pack(FORMAT_PREFIX + SPLIT_HEADER_FORMAT, 0x00, self.count, self.index)
-        try:
-            data = bytes(self.data, encoding='ascii')
-        except UnicodeEncodeError:
-            data = bytes(self.data, encoding='utf-8')
-        packet += data
-        return packet
+        return b''.join((COMMAND_HEADER.pack(COMMAND, self.sequence_number),
+                         SPLIT_HEADER.pack(0x00, self.count, self.index),
+                         self.raw))
 
     def __str__(self):
         single_line = self.data.replace('\n', '|')
@@ -143,34 +163,28 @@ class SplitCommand(Payload):
 
     @staticmethod
     def parse(data):
-        sequence_number = struct.unpack_from(FORMAT_PREFIX + SEQUENCE_NUMBER_FORMAT, data)[0]
-        _, count, index = struct.unpack_from(FORMAT_PREFIX + SPLIT_HEADER_FORMAT, data[1:])
-        try:
-            data = str(data[1 + SPLIT_HEADER_SIZE:], encoding='ascii')
-        except UnicodeDecodeError:
-            data = str(data[1 + SPLIT_HEADER_SIZE:], encoding='utf-8')
-        return SplitCommand(sequence_number, data, count, index)
+        sequence_number = SEQUENCE_NUMBER.unpack_from(data)[0]
+        _, count, index = SPLIT_HEADER.unpack_from(data, 1)
+        return SplitCommand(sequence_number, data[1 + SPLIT_HEADER_SIZE:], count, index)
 
     def is_split(self):
         return True
 
 
 class Message(Payload):
+    __slots__ = ('sequence_number', 'message')
+
     def __init__(self, sequence_number, message=None):
         self.sequence_number = sequence_number
         self.message = message
 
     @staticmethod
     def parse(data):
-        sequence_number = struct.unpack_from(FORMAT_PREFIX + SEQUENCE_NUMBER_FORMAT, data)[0]
-        try:
-            message = str(data[1:], encoding='ascii')
-        except UnicodeDecodeError:
-            message = str(data[1:], encoding='utf-8')
-        return Message(sequence_number, message=message)
+        sequence_number = SEQUENCE_NUMBER.unpack_from(data)[0]
+        return Message(sequence_number, message=decode(data[1:]))
 
     def generate(self):
-        return struct.pack(FORMAT_PREFIX + PACKET_TYPE_FORMAT + SEQUENCE_NUMBER_FORMAT, MESSAGE, self.sequence_number)
+        return COMMAND_HEADER.pack(MESSAGE, self.sequence_number)
 
     def __str__(self):
         single_line = self.message.replace('\n', '|')
@@ -1,18 +1,26 @@
 import asyncio
+import functools
 import logging
+import time
 
-from carim_discord_bot import managed_service, config
+from carim_discord_bot import managed_service, config, metrics
 from carim_discord_bot.discord_client import discord_service
-from carim_discord_bot.rcon import registrar, protocol, connection
+from carim_discord_bot.rcon import registrar, protocol, connection_manager, players, player_sessions
 
 VALID_COMMANDS = ('players', 'admins', 'kick', 'bans', 'ban', 'removeBan', 'say', 'addBan', '#shutdown')
+# Responses to these can be very long, so they are streamed as the fragments arrive
+STREAMED_COMMANDS = ('bans',)
+# Only queries are sent again when the reply is slow, since a repeated say or kick would run twice
+RETRIED_COMMANDS = ('players', 'admins', 'bans')
+START_LOGIN_WAIT = 10
 log = logging.getLogger(__name__)
 
 
 class Command(managed_service.Message):
-    def __init__(self, server_name, command):
+    def __init__(self, server_name, command, stream=False):
         super().__init__(server_name)
         self.command = command
+        self.stream = stream
 
 
 class SafeShutdown(managed_service.Message):
@@ -26,68 +34,58 @@ class RconService(managed_service.ManagedService):
         super().__init__()
         self.server_name = server_name
         self.rcon_registrar = registrar.Registrar(self.server_name)
-        self.transport = None
         self.rcon_protocol = None
         self.restart_lock = asyncio.Lock()
+        self.in_flight = asyncio.Semaphore(config.get_server(self.server_name).rcon_max_in_flight)
+        self.swept_players = set()
+        self.dispatched = set()
+        self.roster = player_sessions.get_roster(self.server_name)
 
     async def start(self):
+        # No tasks are started here, the connection manager logs in and keeps the session alive
+        log.info(f'{self.server_name} starting service {type(self).__name__}')
         await self.rcon_registrar.reset()
+        self.rcon_protocol = await connection_manager.get_connection_manager().add(
+            self.server_name, self.rcon_registrar, on_ready=self.session_ready)
+        # A server that is down doesn't hold up starting the rest of the bot, its session keeps
+        # trying to log in and commands wait for it in the meantime
         try:
-            await asyncio.wait_for(self.create_datagram_endpoint(), timeout=5)
-            await asyncio.wait_for(self.rcon_protocol.logged_in_event.wait(), timeout=5)
-        except (asyncio.TimeoutError, asyncio.CancelledError):
-            log.info(f'{self.server_name} login timed out')
-            await asyncio.sleep(5)
-            await self.restart()
-            return
-        self.tasks.append(asyncio.create_task(self.keep_alive_manager()))
-        await super().start()
+            await asyncio.wait_for(self.rcon_protocol.logged_in_event.wait(), START_LOGIN_WAIT)
+        except asyncio.TimeoutError:
+            log.warning(f'{self.server_name} not logged in yet, starting anyway')
 
     async def stop(self):
         await super().stop()
-        if self.rcon_protocol is not None:
-            self.rcon_protocol.logged_in = False
-            self.rcon_protocol.logged_in_event.clear()
-        if self.transport is not None:
-            self.transport.close()
-
-    async def service(self):
-        while True:
-            await asyncio.sleep(1)
-
-    async def create_datagram_endpoint(self):
-        self.transport, self.rcon_protocol = await asyncio.get_running_loop().create_datagram_endpoint(
-            connection.ProtocolFactory(self.server_name, self.rcon_registrar).get,
-            remote_addr=(config.get_server(self.server_name).ip,
-                         config.get_server(self.server_name).rcon_port))
-
-    async def keep_alive_manager(self):
-        RCON_KEEP_ALIVE_INTERVAL = 30
-        while True:
-            await asyncio.sleep(RCON_KEEP_ALIVE_INTERVAL)
-            try:
-                log.debug(f'{self.server_name} sending keep alive')
-                await self.keep_alive()
-            except asyncio.CancelledError:
-                log.warning(f'{self.server_name} keep alive timed out')
-                await self.discord_log('keep alive timed out')
-                return
-
-    async def keep_alive(self):
-        seq_number = await self.rcon_registrar.get_next_sequence_number()
-        packet = protocol.Packet(protocol.Command(seq_number))
-        future = asyncio.get_running_loop().create_future()
-        await self.rcon_registrar.register(packet.payload.sequence_number, future)
-        self.rcon_protocol.send_rcon_datagram(packet.generate())
-        await future
-        if config.get_server(self.server_name).log_rcon_keep_alive:
-            await self.discord_log('keep alive')
+        connection_manager.get_connection_manager().remove(self.server_name)
+        await self.rcon_registrar.reset()
+        self.roster.lose_sync()
+
+    async def send_message(self, message: managed_service.Message):
+        # Commands don't wait on each other, so they are handled as they arrive rather than through a queue
+        await self._handle_message(message)
 
     async def handle_message(self, message: managed_service.Message):
         if isinstance(message, Command):
-            await self.handle_command(message)
+            # Commands are dispatched without waiting for the reply so a slow query
+            # doesn't hold up the chat relay and scheduled commands queued behind it
+            self.dispatch(self.handle_command(message), message)
         elif isinstance(message, SafeShutdown):
-            asyncio.create_task(self.safe_shutdown(message.delay))
+            self.dispatch(self.safe_shutdown(message.delay), message)
+
+    def dispatch(self, coro, message: managed_service.Message):
+        task = asyncio.create_task(coro)
+        self.dispatched.add(task)
+        task.add_done_callback(functools.partial(self.dispatch_done, message))
+
+    def dispatch_done(self, message: managed_service.Message, task: asyncio.Task):
+        # A failure is logged and the sender gets a cancelled result instead of the exception
+        # going unretrieved, which would stop the event loop
+        self.dispatched.discard(task)
+        if task.cancelled():
+            message.result.cancel()
+        elif task.exception() is not None:
+            log.error(f'{self.server_name} failed handling {type(message).__name__}', exc_info=task.exception())
+            message.result.cancel()
 
     async def handle_command(self, command_message: Command):
         command = command_message.command
@@ -95,23 +93,56 @@ class RconService(managed_service.ManagedService):
         log.info(f'{self.server_name} command received: {command}')
         if command == 'commands':
             future.set_result(VALID_COMMANDS)
-        elif not self.rcon_protocol.logged_in:
+        elif command == 'players' and self.roster.synced:
+            future.set_result(self.roster.format_players())
+        elif not command.strip() or command.split()[0] not in VALID_COMMANDS:
+            future.set_result('invalid command')
+        elif not await self.wait_for_login():
             log.warning(f'{self.server_name} not logged in, cancelling command: {command}')
             future.cancel()
-        elif command.split()[0] in VALID_COMMANDS:
-            seq_number = await self.rcon_registrar.get_next_sequence_number()
-            packet = protocol.Packet(protocol.Command(seq_number, command=command))
-            command_future = asyncio.get_running_loop().create_future()
-            await self.rcon_registrar.register(packet.payload.sequence_number, command_future)
-            self.rcon_protocol.send_rcon_datagram(packet.generate())
-            try:
-                await command_future
-                future.set_result(command_future.result().payload.data)
-            except asyncio.CancelledError:
-                log.warning(f'{self.server_name} command cancelled: {command}')
-                future.cancel()
         else:
-            future.set_result('invalid command')
+            async with self.in_flight:
+                seq_number = await self.rcon_registrar.get_next_sequence_number()
+                packet = protocol.Packet(protocol.Command(seq_number, command=command))
+                command_future = asyncio.get_running_loop().create_future()
+                stream = registrar.FragmentStream() if command_message.stream else None
+                data = packet.generate()
+                await self.rcon_registrar.register(packet.payload.sequence_number, command_future,
+                                                   timeout=config.get_server(self.server_name).rcon_command_timeout,
+                                                   stream=stream, data=data,
+                                                   retries=registrar.DEFAULT_RETRIES
+                                                   if command.split()[0] in RETRIED_COMMANDS else 0)
+                self.rcon_protocol.send_rcon_datagram(data)
+                start = time.perf_counter()
+                if stream is not None and not future.done():
+                    future.set_result(stream)
+                try:
+                    await command_future
+                    metrics.get_registry().observe('carim_rcon_round_trip_seconds', time.perf_counter() - start,
+                                                   self.get_rcon_labels('command'))
+                    if not future.done():
+                        future.set_result(command_future.result().payload.data)
+                except asyncio.CancelledError:
+                    log.warning(f'{self.server_name} command cancelled: {command}')
+                    metrics.get_registry().inc('carim_rcon_timeouts_total', self.get_rcon_labels('command'))
+                    connection_manager.get_connection_manager().probe(self.rcon_protocol)
+                    future.cancel()
+
+    async def wait_for_login(self):
+        # Commands sent while the session is reconnecting are held until it logs in again,
+        # for as long as they would have waited on a reply
+        if self.rcon_protocol is None:
+            return False
+        if not self.rcon_protocol.logged_in:
+            try:
+                await asyncio.wait_for(self.rcon_protocol.logged_in_event.wait(),
+                                       config.get_server(self.server_name).rcon_command_timeout)
+            except asyncio.TimeoutError:
+                return False
+        return self.rcon_protocol.logged_in
+
+    def get_rcon_labels(self, kind):
+        return ('server', self.server_name), ('kind', kind)
 
     async def safe_shutdown(self, delay):
         log.info(f'{self.server_name} safe_shutdown called with delay {delay}')
@@ -146,39 +177,74 @@ class RconService(managed_service.ManagedService):
                     delay -= 1
 
             await self.discord_log('shutdown -> kicking')
+            self.swept_players = set()
             await self.kick_everybody('Server is restarting')
 
             await self.discord_log('shutdown -> locking')
             await self.discord_log('shutdown -> wait for a minute')
             # Lock RCon command doesn't seem to work, so instead we loop
-            # kicking players. It could be more complex and only kick if people
-            # join, but this seems like the simpler solution
+            # kicking players, only kicking the ones that joined since the last sweep
             time_left = 60
             while time_left > 0:
-                await self.kick_everybody(f'Server locked, restarting in {time_left} seconds')
+                await self.kick_everybody(f'Server locked, restarting in {time_left} seconds', only_new=True)
                 await asyncio.sleep(2)
                 time_left -= 2
 
             await self.discord_log('shutdown -> shutting down')
             await self.handle_command(Command(self.server_name, '#shutdown'))
 
-    async def kick_everybody(self, message):
+    def session_ready(self):
+        # Events may have been missed while logged out, so the roster is seeded again on every login
+        asyncio.create_task(self.seed_roster())
+
+    async def seed_roster(self):
+        self.roster.begin_seed()
+        current_players = await self.fetch_players()
+        if current_players is None:
+            log.warning(f'{self.server_name} could not seed the player roster, players will be queried')
+            self.roster.cancel_seed()
+            return
+        self.roster.seed(current_players)
+        log.info(f'{self.server_name} tracking {len(current_players)} players')
+
+    async def query_players(self):
+        if self.roster.synced:
+            return self.roster.get_players()
+        return await self.fetch_players()
+
+    async def fetch_players(self):
         players_query = Command(self.server_name, 'players')
         await self.handle_command(players_query)
         try:
             raw_players = await asyncio.wait_for(players_query.result, 10)
         except (asyncio.TimeoutError, asyncio.CancelledError):
             log.warning('player query timed out')
-            return
+            return None
         if raw_players is None:
             log.warning('player query response empty')
+            return None
+        return players.parse_players(raw_players)
+
+    async def kick_everybody(self, message, only_new=False):
+        current_players = await self.query_players()
+        if current_players is None:
             return
-        player_lines = raw_players.split('\n')[3:-1]
-        player_ids = [line.split()[0] for line in player_lines]
-        for i in player_ids:
-            command = f'kick {i} {message}'
-            await self.handle_command(Command(self.server_name, command))
-            log.info(command)
+        if only_new:
+            targets = [p for p in current_players if p.key not in self.swept_players]
+        else:
+            targets = current_players
+        # Kicks go out together and are bounded by the in flight limit of handle_command
+        kicks = [Command(self.server_name, f'kick {p.number} {message}') for p in targets]
+        await asyncio.gather(*(self.handle_command(kick) for kick in kicks))
+        failed = set()
+        for player, kick in zip(targets, kicks):
+            if kick.result.cancelled():
+                log.warning(f'{self.server_name} kick failed: {kick.command}')
+                failed.add(player.key)
+            else:
+                log.info(kick.command)
+        # Players whose kick failed are left out so the next sweep tries them again
+        self.swept_players = set(p.key for p in current_players) - failed
 
     async def discord_log(self, message):
         await discord_service.get_service_manager().send_message(
@@ -1,66 +1,265 @@
 import asyncio
+import codecs
+import heapq
 import logging
 
 from carim_discord_bot.rcon import protocol
 
 log = logging.getLogger(__name__)
 DEFAULT_TIMEOUT = 10
+# Requests that are safe to send twice, like queries and keep alives, can be sent again this many
+# times within their timeout before giving up on them. Anything else is only ever sent once
+DEFAULT_RETRIES = 2
+# Incomplete split responses older than this are dropped
+REASSEMBLY_TIMEOUT = DEFAULT_TIMEOUT
+# A sequence number isn't handed out again for this long after its command timed out or was
+# sent more than once, so a late reply can't be mistaken for the reply to a newer command
+STALE_SEQUENCE_TIMEOUT = DEFAULT_TIMEOUT
+
+
+class Reassembly:
+    def __init__(self, count):
+        self.count = count
+        self.fragments = [None] * count
+        self.received = 0
+        self.received_count = 0
+        self.next_index = 0
+        self.created = asyncio.get_event_loop().time()
+
+    def add(self, index, raw):
+        bit = 1 << index
+        if index >= self.count or self.received & bit:
+            return False
+        self.received |= bit
+        self.received_count += 1
+        self.fragments[index] = bytes(raw)
+        return True
+
+    def pop_contiguous(self):
+        # Hands out fragments in order as soon as the gap before them is filled,
+        # releasing them so a streamed response doesn't stay in memory
+        while self.next_index < self.count and self.received & (1 << self.next_index):
+            raw = self.fragments[self.next_index]
+            self.fragments[self.next_index] = None
+            self.next_index += 1
+            yield raw
+
+    def is_complete(self):
+        return self.received_count == self.count
+
+    def join(self):
+        return b''.join(self.fragments)
+
+
+class Request:
+    def __init__(self, future, timeout, retries, data, stream):
+        self.future = future
+        self.data = data
+        self.stream = stream
+        self.retries = retries if data is not None else 0
+        self.attempt_timeout = timeout / (self.retries + 1)
+        self.retransmitted = False
+        self.deadline = None
+
+
+class FragmentStream:
+    def __init__(self):
+        self.queue = asyncio.Queue()
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    def put(self, raw):
+        self.queue.put_nowait(raw)
+
+    def close(self, exception=None):
+        self.queue.put_nowait(exception)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        item = await self.queue.get()
+        if item is None:
+            remaining = self.decoder.decode(b'', final=True)
+            if remaining:
+                return remaining
+            raise StopAsyncIteration
+        if isinstance(item, BaseException):
+            raise item
+        return self.decoder.decode(item)
+
+    async def lines(self):
+        partial = ''
+        async for chunk in self:
+            lines = (partial + chunk).split('\n')
+            partial = lines.pop()
+            if lines:
+                yield lines
+        if partial:
+            yield [partial]
 
 
 class Registrar:
     def __init__(self, server_name):
         self.server_name = server_name
-        self.tasks = dict()
+        self.requests = dict()
         self.splits = dict()
+        self.stale = dict()
+        self.deadlines = list()
+        self.timer = None
         self.sequence_number = 0
         self.lock = asyncio.Lock()
+        self.freed = asyncio.Event()
+        self.send_datagram = None
 
     async def get_next_sequence_number(self):
-        async with self.lock:
+        while True:
+            async with self.lock:
+                seq_number = self.find_free_sequence_number()
+                if seq_number is not None:
+                    return seq_number
+                # Every number is waiting on a reply, handing one out would orphan its request
+                self.freed.clear()
+            log.warning(f'{self.server_name} all sequence numbers in use, waiting for one to free up')
+            await self.freed.wait()
+
+    def find_free_sequence_number(self):
+        now = asyncio.get_event_loop().time()
+        for _ in range(0x100):
             seq_number = self.sequence_number
             self.sequence_number += 1
             self.sequence_number &= 0xff
+            if seq_number in self.requests:
+                continue
+            if self.stale.get(seq_number, now) <= now:
+                self.stale.pop(seq_number, None)
+                return seq_number
+        # Every free number is still stale, so take the one that has been stale the longest
+        candidates = [k for k in self.stale if k not in self.requests]
+        if not candidates:
+            return None
+        seq_number = min(candidates, key=self.stale.get)
+        self.stale.pop(seq_number)
         return seq_number
 
     async def reset(self):
         async with self.lock:
             log.debug(f'{self.server_name} reset')
-            keys = list(self.tasks.keys())
+            keys = list(self.requests.keys())
             for key in keys:
                 log.debug(f'{self.server_name} cancelling {key}')
-                future = self.tasks.pop(key, None)
-                if future is not None:
-                    future.cancel()
+                request = self.requests.pop(key)
+                if request.stream is not None:
+                    request.stream.close(asyncio.TimeoutError())
+                request.future.cancel()
+            self.splits.clear()
+            self.stale.clear()
+            self.deadlines.clear()
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
             self.sequence_number = 0
+            self.freed.set()
 
-    async def register(self, key, future: asyncio.Future, timeout=DEFAULT_TIMEOUT):
+    async def register(self, key, future: asyncio.Future, timeout=DEFAULT_TIMEOUT, stream: FragmentStream = None,
+                       data=None, retries=0):
         log.debug(f'{self.server_name} register key {key}')
-        self.tasks[key] = future
-        asyncio.get_running_loop().create_task(self.wait_for_timeout(key, future, timeout))
+        request = Request(future, timeout, retries, data, stream)
+        self.requests[key] = request
+        self.splits.pop(key, None)
+        self.push_deadline(key, request)
+        self.schedule_timer()
+
+    def push_deadline(self, key, request):
+        request.deadline = asyncio.get_event_loop().time() + request.attempt_timeout
+        heapq.heappush(self.deadlines, (request.deadline, key))
+
+    def schedule_timer(self):
+        # A single timer covers every pending command and is always set for the earliest deadline
+        if not self.deadlines:
+            return
+        earliest = self.deadlines[0][0]
+        if self.timer is not None:
+            if self.timer.when() <= earliest:
+                return
+            self.timer.cancel()
+        self.timer = asyncio.get_event_loop().call_at(earliest, self.check_deadlines)
+
+    def check_deadlines(self):
+        self.timer = None
+        now = asyncio.get_event_loop().time()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, key = heapq.heappop(self.deadlines)
+            request = self.requests.get(key)
+            if request is None or request.deadline != deadline:
+                # The command was answered or its deadline moved since this entry was added
+                continue
+            if request.future.done():
+                # Nobody is waiting on the reply any more
+                self.expire(key)
+            elif request.retries > 0 and self.send_datagram is not None:
+                request.retries -= 1
+                request.retransmitted = True
+                log.debug(f'{self.server_name} retransmitting key {key}')
+                self.send_datagram(request.data)
+                self.push_deadline(key, request)
+            else:
+                self.expire(key)
+        self.schedule_timer()
+
+    def expire(self, key):
+        log.debug(f'{self.server_name} timeout waiting for key {key}')
+        request = self.requests.pop(key)
+        self.splits.pop(key, None)
+        self.stale[key] = asyncio.get_event_loop().time() + STALE_SEQUENCE_TIMEOUT
+        self.freed.set()
+        if request.stream is not None:
+            request.stream.close(asyncio.TimeoutError())
+        request.future.cancel()
 
     async def incoming(self, key, packet):
         log.debug(f'{self.server_name} incoming key {key} and type {type(packet.payload)}')
+        request = self.requests.get(key)
+        if request is None or request.future.done():
+            log.debug(f'{self.server_name} no command waiting for key {key}')
+            return
+        stream = request.stream
 
         if not packet.payload.is_split():
-            future = self.tasks.pop(key)
-            future.set_result(packet)
-        else:
-            split = self.splits.get(key, [''] * packet.payload.count)
-            split[packet.payload.index] = packet.payload.data
-
-            if all(split):
-                data = ''.join(split)
-                new_packet = protocol.Packet(protocol.Command(key, data=data))
-                future = self.tasks.pop(key)
-                future.set_result(new_packet)
-                self.splits.pop(key)
-            else:
-                self.splits[key] = split
-
-    async def wait_for_timeout(self, key, future, timeout):
-        log.debug(f'{self.server_name} waiting for key {key}')
-        try:
-            await asyncio.wait_for(future, timeout)
-        except asyncio.TimeoutError:
-            log.debug(f'{self.server_name} timeout waiting for key {key}')
-            await self.reset()
+            if stream is not None:
+                stream.put(protocol.encode(packet.payload.data))
+            self.complete(key, packet)
+            return
+
+        self.expire_splits()
+        payload: protocol.SplitCommand = packet.payload
+        reassembly = self.splits.get(key)
+        if reassembly is None or reassembly.count != payload.count:
+            reassembly = Reassembly(payload.count)
+            self.splits[key] = reassembly
+        if not reassembly.add(payload.index, payload.raw):
+            log.debug(f'{self.server_name} duplicate fragment {payload.index} for key {key}')
+            return
+        if stream is not None:
+            for raw in reassembly.pop_contiguous():
+                stream.put(raw)
+        if reassembly.is_complete():
+            self.splits.pop(key)
+            # Streamed responses were already handed out fragment by fragment
+            data = None if stream is not None else protocol.decode(reassembly.join(), errors='replace')
+            self.complete(key, protocol.Packet(protocol.Command(key, data=data)))
+
+    def complete(self, key, packet):
+        request = self.requests.pop(key)
+        if request.retransmitted:
+            # The server may still answer one of the earlier copies
+            self.stale[key] = asyncio.get_event_loop().time() + STALE_SEQUENCE_TIMEOUT
+        self.freed.set()
+        if request.stream is not None:
+            request.stream.close()
+        request.future.set_result(packet)
+
+    def expire_splits(self):
+        expired_before = asyncio.get_event_loop().time() - REASSEMBLY_TIMEOUT
+        for key in [k for k, r in self.splits.items() if r.created < expired_before]:
+            log.debug(f'{self.server_name} dropping incomplete split response for key {key}')
+            self.splits.pop(key)
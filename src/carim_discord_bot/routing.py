@@ -0,0 +1,75 @@
+import re
+
+# Custom commands are merged into a single pattern once there are at least this many of them
+MERGE_THRESHOLD = 4
+
+
+class CustomCommandMatcher:
+    def __init__(self, custom_commands):
+        self.custom_commands = custom_commands
+        self.patterns = [re.compile(custom_command.command) for custom_command in custom_commands]
+        self.merged = None
+        if len(self.patterns) >= MERGE_THRESHOLD and all(pattern.groups == 0 for pattern in self.patterns):
+            try:
+                self.merged = re.compile('|'.join(f'(?P<c{i}>{pattern.pattern})'
+                                                  for i, pattern in enumerate(self.patterns)))
+            except re.error:
+                self.merged = None
+
+    def match(self, content):
+        start = 0
+        if self.merged is not None:
+            # The alternatives are tried in order, so the group that matched is the first custom
+            # command that matches and only the ones after it still need checking
+            match = self.merged.match(content)
+            if match is None:
+                return []
+            start = int(match.lastgroup[1:])
+        return [custom_command for custom_command, pattern in zip(self.custom_commands[start:], self.patterns[start:])
+                if pattern.match(content)]
+
+
+class Route:
+    def __init__(self):
+        self.chat_servers = list()
+        self.admin_servers = list()
+        self.user = False
+        self.custom_commands = None
+
+
+class RoutingTable:
+    def __init__(self, server_configs, user_channel_ids, custom_commands):
+        self.routes = dict()
+        for server_config in server_configs:
+            if server_config.rcon_password is None:
+                continue
+            if server_config.chat_channel_id:
+                self.get_or_add(server_config.chat_channel_id).chat_servers.append(server_config.name)
+            if server_config.admin_channel_id:
+                self.get_or_add(server_config.admin_channel_id).admin_servers.append(server_config.name)
+        if isinstance(user_channel_ids, int):
+            user_channel_ids = [user_channel_ids]
+        for channel_id in user_channel_ids:
+            self.get_or_add(channel_id).user = True
+
+        enabled = [custom_command for custom_command in custom_commands if custom_command.enabled]
+        for channel_id in {channel_id for custom_command in enabled for channel_id in custom_command.channels}:
+            self.get_or_add(channel_id)
+        everywhere = [custom_command for custom_command in enabled if not custom_command.channels]
+        self.default = None
+        if everywhere:
+            self.default = Route()
+            self.default.custom_commands = CustomCommandMatcher(everywhere)
+        for channel_id, route in self.routes.items():
+            channel_commands = [custom_command for custom_command in enabled
+                                if channel_id in custom_command.channels or not custom_command.channels]
+            if channel_commands:
+                route.custom_commands = CustomCommandMatcher(channel_commands)
+
+    def get_or_add(self, channel_id) -> Route:
+        if channel_id not in self.routes:
+            self.routes[channel_id] = Route()
+        return self.routes[channel_id]
+
+    def get(self, channel_id) -> Route:
+        return self.routes.get(channel_id, self.default)
@@ -0,0 +1,74 @@
+import datetime
+
+# (name, lowest, highest) of the fields in a cron expression, in order
+FIELDS = (
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day', 1, 31),
+    ('month', 1, 12),
+    # Sunday can be written as 0 or 7
+    ('weekday', 0, 7),
+)
+
+
+def parse_field(field, lowest, highest):
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, raw_step = part.split('/', 1)
+            step = int(raw_step)
+            if step < 1:
+                raise ValueError(f'invalid step: {raw_step}')
+        if part == '*':
+            start, end = lowest, highest
+        elif '-' in part:
+            raw_start, raw_end = part.split('-', 1)
+            start, end = int(raw_start), int(raw_end)
+        else:
+            start = int(part)
+            end = highest if step > 1 else start
+        if not lowest <= start <= end <= highest:
+            raise ValueError(f'{part} out of range {lowest}-{highest}')
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class CronExpression:
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != len(FIELDS):
+            raise ValueError(f'cron expression needs {len(FIELDS)} fields: {expression}')
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            parse_field(field, lowest, highest) for field, (_, lowest, highest) in zip(fields, FIELDS))
+        self.weekdays = frozenset(weekday % 7 for weekday in weekdays)
+        # Like cron, when both the day of the month and the weekday are restricted either one matching is enough
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def matches_day(self, moment: datetime.datetime):
+        day = moment.day in self.days
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day:
+            return weekday
+        if self.any_weekday:
+            return day
+        return day or weekday
+
+    def get_next(self, after: datetime.datetime) -> datetime.datetime:
+        # Skips whole months, days and hours that can't match instead of checking every minute
+        moment = after.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = moment + datetime.timedelta(days=366 * 5)
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self.matches_day(moment):
+                moment = moment.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + datetime.timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += datetime.timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError(f'cron expression never matches: {self.expression}')
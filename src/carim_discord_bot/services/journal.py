@@ -0,0 +1,308 @@
+import asyncio
+import concurrent.futures
+import gzip
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import time
+
+from carim_discord_bot import managed_service, config, metrics
+from carim_discord_bot.rcon import events
+
+FLUSH_INTERVAL = 1
+SEGMENT_SIZE = 8 * 1024 * 1024
+SEGMENT_AGE = 24 * 60 * 60
+DEFAULT_LIMIT = 50
+SEGMENT_SUFFIX = '.jsonl'
+COMPRESSED_SUFFIX = '.jsonl.gz'
+WINDOW = re.compile(r'^(\d+)([smhd])$')
+WINDOW_UNITS = dict(s=1, m=60, h=60 * 60, d=24 * 60 * 60)
+log = logging.getLogger(__name__)
+
+
+class Query(managed_service.Message):
+    def __init__(self, server_name, name=None, start=None, end=None, limit=DEFAULT_LIMIT):
+        super().__init__(server_name)
+        self.name = name
+        self.start = start
+        self.end = end
+        self.limit = limit
+
+
+def parse_window(text):
+    match = WINDOW.match(text)
+    if match is None:
+        return None
+    return int(match.group(1)) * WINDOW_UNITS[match.group(2)]
+
+
+def build_record(timestamp, server_name, event: events.Event):
+    record = dict(t=round(timestamp, 3), s=server_name, e=type(event).__name__.lower(), m=event.message)
+    name = event.author if isinstance(event, events.Chat) else getattr(event, 'name', None)
+    if name:
+        record['n'] = name
+    return record
+
+
+class JournalStore:
+    # Records are appended to a segment as JSON lines, and segments are compressed once they are
+    # closed. An sqlite index of the servers, times and player names in each segment lets a
+    # query open only the segments that can match. Only used from the journal's own thread
+    def __init__(self, path, segment_size=SEGMENT_SIZE, segment_age=SEGMENT_AGE, retention=None, clock=time.time):
+        self.path = os.path.expanduser(path)
+        self.segment_size = segment_size
+        self.segment_age = segment_age
+        self.retention = retention
+        self.clock = clock
+        self.connection = None
+        self.segment = None
+        self.segment_started = None
+        self.file = None
+
+    def open(self):
+        os.makedirs(self.path, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(self.path, 'index.sqlite3'))
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS spans (segment TEXT, server TEXT, first REAL, '
+                                    'last REAL, count INTEGER, PRIMARY KEY (segment, server))')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS names (name TEXT, segment TEXT, '
+                                    'PRIMARY KEY (name, segment))')
+        # A segment left open by an earlier run is closed off, and records go to a new one
+        for file_name in sorted(os.listdir(self.path)):
+            if file_name.endswith(SEGMENT_SUFFIX):
+                self.compress(file_name[:-len(SEGMENT_SUFFIX)])
+        self.prune()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def get_file_name(self, segment, suffix=SEGMENT_SUFFIX):
+        return os.path.join(self.path, segment + suffix)
+
+    def rotate(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.compress(self.segment)
+        self.segment_started = self.clock()
+        stamp = int(self.segment_started * 1000)
+        while os.path.exists(self.get_file_name(f'{stamp:015d}', COMPRESSED_SUFFIX)):
+            stamp += 1
+        self.segment = f'{stamp:015d}'
+        self.file = open(self.get_file_name(self.segment), 'a', encoding='utf-8')
+        log.debug(f'journal writing to segment {self.segment}')
+        self.prune()
+
+    def compress(self, segment):
+        source = self.get_file_name(segment)
+        destination = self.get_file_name(segment, COMPRESSED_SUFFIX)
+        with open(source, 'rb') as raw, gzip.open(destination + '.tmp', 'wb') as compressed:
+            shutil.copyfileobj(raw, compressed)
+        os.replace(destination + '.tmp', destination)
+        os.remove(source)
+
+    def prune(self):
+        # Closed segments whose newest record is older than the retention are deleted with their index entries
+        if self.retention is None:
+            return
+        expired = [segment for (segment,) in self.connection.execute(
+            'SELECT segment FROM spans GROUP BY segment HAVING max(last) < ?', (self.clock() - self.retention,))
+            if segment != self.segment]
+        for segment in expired:
+            file_name = self.get_file_name(segment, COMPRESSED_SUFFIX)
+            if os.path.exists(file_name):
+                os.remove(file_name)
+            with self.connection:
+                self.connection.execute('DELETE FROM spans WHERE segment = ?', (segment,))
+                self.connection.execute('DELETE FROM names WHERE segment = ?', (segment,))
+        if expired:
+            log.info(f'journal deleted {len(expired)} segments past the retention')
+
+    def write(self, records):
+        if not records:
+            return
+        if (self.file is None or self.file.tell() >= self.segment_size
+                or self.clock() - self.segment_started >= self.segment_age):
+            self.rotate()
+        self.file.write(''.join(json.dumps(r, ensure_ascii=False, separators=(',', ':')) + '\n' for r in records))
+        self.file.flush()
+        spans = dict()
+        names = set()
+        for record in records:
+            span = spans.get(record['s'])
+            if span is None:
+                spans[record['s']] = [record['t'], record['t'], 1]
+            else:
+                span[0] = min(span[0], record['t'])
+                span[1] = max(span[1], record['t'])
+                span[2] += 1
+            if 'n' in record:
+                names.add(record['n'].lower())
+        with self.connection:
+            self.connection.executemany('INSERT OR IGNORE INTO spans VALUES (?, ?, ?, ?, 0)',
+                                        [(self.segment, server, first, last)
+                                         for server, (first, last, _) in spans.items()])
+            self.connection.executemany('UPDATE spans SET first = min(first, ?), last = max(last, ?), '
+                                        'count = count + ? WHERE segment = ? AND server = ?',
+                                        [(first, last, count, self.segment, server)
+                                         for server, (first, last, count) in spans.items()])
+            self.connection.executemany('INSERT OR IGNORE INTO names VALUES (?, ?)',
+                                        [(name, self.segment) for name in names])
+
+    def read(self, segment):
+        if segment == self.segment:
+            lines = open(self.get_file_name(segment), encoding='utf-8')
+        elif os.path.exists(self.get_file_name(segment, COMPRESSED_SUFFIX)):
+            lines = gzip.open(self.get_file_name(segment, COMPRESSED_SUFFIX), 'rt', encoding='utf-8')
+        else:
+            log.warning(f'journal segment {segment} is missing')
+            return
+        with lines:
+            for line in lines:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # The last line of a segment can be cut short if the bot stopped while writing it
+                    continue
+
+    def query(self, server_name=None, name=None, start=None, end=None, limit=DEFAULT_LIMIT):
+        sql = 'SELECT DISTINCT spans.segment FROM spans'
+        conditions = list()
+        parameters = list()
+        if name is not None:
+            sql += ' JOIN names ON names.segment = spans.segment'
+            conditions.append('names.name = ?')
+            parameters.append(name.lower())
+        if server_name is not None:
+            conditions.append('spans.server = ?')
+            parameters.append(server_name)
+        if start is not None:
+            conditions.append('spans.last >= ?')
+            parameters.append(start)
+        if end is not None:
+            conditions.append('spans.first <= ?')
+            parameters.append(end)
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY spans.segment DESC'
+        found = list()
+        # Newest segments first, stopping once there are enough matches
+        for (segment,) in self.connection.execute(sql, parameters).fetchall():
+            found = [r for r in self.read(segment) if self.matches(r, server_name, name, start, end)] + found
+            if len(found) >= limit:
+                break
+        return found[-limit:]
+
+    @staticmethod
+    def matches(record, server_name, name, start, end):
+        return ((server_name is None or record['s'] == server_name)
+                and (name is None or record.get('n', '').lower() == name.lower())
+                and (start is None or record['t'] >= start)
+                and (end is None or record['t'] <= end))
+
+
+class Journal(managed_service.ManagedService):
+    def __init__(self):
+        super().__init__()
+        self.store = None
+        self.executor = None
+        self.pending = list()
+        self.flush_handle = None
+
+    async def start(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        retention_days = config.get().journal_retention_days
+        store = JournalStore(config.get().journal_path,
+                             retention=retention_days * 24 * 60 * 60 if retention_days is not None else None)
+        try:
+            await self.run(store.open)
+        except (OSError, sqlite3.Error) as e:
+            # The bot carries on without a journal rather than failing to start
+            log.warning(f'journal unavailable at {store.path}, events will not be journaled: {e}')
+            await self.run(store.close)
+            self.executor.shutdown()
+        else:
+            self.store = store
+            log.info(f'journaling events to {self.store.path}')
+        await super().start()
+
+    async def stop(self):
+        await super().stop()
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.store is not None:
+            await self.flush()
+            await self.run(self.store.close)
+            self.executor.shutdown()
+            self.store = None
+
+    def record(self, server_name, recorded_events):
+        # Called for every batch of RCon events, so they are only buffered here and written
+        # from the journal's thread a second after the first of them arrived
+        if self.store is not None and recorded_events:
+            now = time.time()
+            self.pending.extend((now, server_name, event) for event in recorded_events)
+            if self.flush_handle is None:
+                self.flush_handle = asyncio.get_event_loop().call_later(FLUSH_INTERVAL, self.flush_later)
+
+    def flush_later(self):
+        self.flush_handle = None
+        asyncio.create_task(self.flush())
+
+    async def flush(self):
+        if not self.pending or self.store is None:
+            return
+        batch = self.pending
+        self.pending = list()
+        try:
+            await self.run(self.write, batch)
+        except (OSError, sqlite3.Error) as e:
+            log.warning(f'failed to journal {len(batch)} events: {e}')
+            metrics.get_registry().inc('carim_journal_failures_total', amount=len(batch))
+            return
+        metrics.get_registry().inc('carim_journal_records_total', amount=len(batch))
+
+    def write(self, batch):
+        self.store.write([build_record(*entry) for entry in batch])
+
+    async def run(self, function, *args):
+        # Every file and index operation goes through the one thread, which keeps them in order
+        # and the sqlite connection on the thread that made it
+        return await asyncio.get_event_loop().run_in_executor(self.executor, function, *args)
+
+    async def handle_message(self, message: managed_service.Message):
+        if isinstance(message, Query):
+            if self.store is None:
+                message.result.cancel()
+                return
+            await self.flush()
+            try:
+                records = await self.run(self.store.query, message.server_name, message.name, message.start,
+                                         message.end, message.limit)
+            except (OSError, sqlite3.Error) as e:
+                log.warning(f'journal query failed: {e}')
+                message.result.cancel()
+                return
+            message.result.set_result(records)
+
+    def get_metrics(self):
+        return super().get_metrics() + [('carim_journal_pending_records', (), len(self.pending))]
+
+
+service = None
+
+
+def get_service_manager():
+    global service
+    if service is None:
+        service = Journal()
+    return service
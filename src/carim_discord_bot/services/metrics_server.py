@@ -0,0 +1,46 @@
+import asyncio
+import logging
+
+from aiohttp import web
+
+from carim_discord_bot import managed_service, config, metrics
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+log = logging.getLogger(__name__)
+
+
+class MetricsServer(managed_service.ManagedService):
+    def __init__(self):
+        super().__init__()
+        self.runner = None
+
+    async def service(self):
+        app = web.Application()
+        app.add_routes([web.get('/metrics', self.handle_metrics)])
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, config.get().metrics_host, config.get().metrics_port)
+        await site.start()
+        log.info(f'serving metrics on {config.get().metrics_host}:{config.get().metrics_port}')
+        # The site serves requests on its own, and stop cleans it up after cancelling this task
+        await asyncio.get_event_loop().create_future()
+
+    async def stop(self):
+        await super().stop()
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def handle_metrics(self, request):
+        return web.Response(body=metrics.get_registry().format_prometheus().encode('utf-8'),
+                            headers={'Content-Type': CONTENT_TYPE})
+
+
+service = None
+
+
+def get_service_manager():
+    global service
+    if service is None:
+        service = MetricsServer()
+    return service
@@ -1,51 +1,211 @@
 import asyncio
+import copy
 import logging
+import string
 
 from carim_discord_bot import managed_service, config
 from carim_discord_bot.discord_client import discord_service
+from carim_discord_bot.rcon import player_sessions
 from carim_discord_bot.steam import query
 from carim_discord_bot.steam import steam_service
 
+# Placeholders available in the player count formats and the steam fields they come from
+FORMAT_FIELDS = {
+    'players': 'players',
+    'slots': 'max_players',
+    'queue': 'queue',
+    'time': 'time'
+}
+# A fresh count is fetched this many seconds before the channel can be renamed again
+RENAME_LEAD = 5
+# Limits, as multiples of the update interval, for backing off a stable or unreachable server
+STABLE_BACKOFF_MAX = 4
+UNREACHABLE_BACKOFF_MAX = 16
+# Fields the player roster can fill in, with the slots carried over from the last steam answer
+LOCAL_FIELDS = {'players', 'max_players'}
+# Servers counted from the roster are still asked through steam this often, for the slots
+STEAM_REFRESH_INTERVAL = 60 * 60
+STEAM_QUERY_TIMEOUT = 10
 log = logging.getLogger(__name__)
 
 
+def get_server_names():
+    return [name for name in config.get_server_names() if config.get_server(name).player_count_channel_id is not None]
+
+
+def get_watched_fields(server_name):
+    server_config = config.get_server(server_name)
+    watched = {FORMAT_FIELDS[field]
+               for format_string in (server_config.player_count_format, server_config.player_count_queue_format)
+               for _, field, _, _ in string.Formatter().parse(format_string)
+               if field in FORMAT_FIELDS}
+    if server_config.player_count_queue_format:
+        # The queue decides whether the queue format is shown at all
+        watched.add('queue')
+    return watched
+
+
+class PollSchedule:
+    def __init__(self, interval):
+        self.interval = interval
+        self.queries = 0
+        self.local_counts = 0
+        self.failures = 0
+        self.changes = 0
+        self.consecutive_failures = 0
+        self.stable_polls = 0
+        self.delay = interval
+
+    def record(self, reachable, changed=False, local=False):
+        if local:
+            self.local_counts += 1
+        else:
+            self.queries += 1
+        if not reachable:
+            self.failures += 1
+            self.consecutive_failures += 1
+            return
+        self.consecutive_failures = 0
+        if changed:
+            self.changes += 1
+            self.stable_polls = 0
+        else:
+            self.stable_polls += 1
+
+    def next_delay(self, rename_delay):
+        if self.consecutive_failures:
+            multiple = min(UNREACHABLE_BACKOFF_MAX, 2 ** self.consecutive_failures)
+            self.delay = self.interval * multiple
+        elif rename_delay > 0:
+            # A new count can't be shown until the channel can be renamed again, so there is
+            # only a need to look just before then
+            self.delay = max(self.interval, rename_delay - RENAME_LEAD)
+        else:
+            # Doubles after every few unchanged counts
+            self.delay = self.interval * min(STABLE_BACKOFF_MAX, 2 ** (self.stable_polls // 4))
+        return self.delay
+
+
 class PlayerCountService(managed_service.ManagedService):
-    def __init__(self, server_name):
+    def __init__(self):
         super().__init__()
-        self.server_name = server_name
+        self.next_update = dict()
+        self.last_results = dict()
+        self.schedules = dict()
+        self.steam_queried = dict()
 
     async def handle_message(self, message: managed_service.Message):
         pass
 
     async def service(self):
-        while True:
-            await asyncio.sleep(config.get_server(self.server_name).player_count_update_interval)
-            await self.update_player_count()
-
-    async def update_player_count(self):
-        message = steam_service.Query(self.server_name)
-        await steam_service.get_service_manager(self.server_name).send_message(message)
-        try:
-            result = await asyncio.wait_for(message.result, 10)
-        except (asyncio.TimeoutError, asyncio.CancelledError):
-            log.warning('update player count query timed out')
-            return
+        # Servers are polled on their own intervals, but whichever are due at the same time
+        # are queried together
+        loop = asyncio.get_event_loop()
+        self.next_update = {name: loop.time() + config.get_server(name).player_count_update_interval
+                            for name in get_server_names()}
+        while self.next_update:
+            now = loop.time()
+            due = [name for name, next_update in self.next_update.items() if next_update <= now]
+            if not due:
+                await asyncio.sleep(min(self.next_update.values()) - now)
+                continue
+            await self.update_player_counts(due)
+
+    def get_schedule(self, server_name) -> PollSchedule:
+        if server_name not in self.schedules:
+            self.schedules[server_name] = PollSchedule(config.get_server(server_name).player_count_update_interval)
+        return self.schedules[server_name]
+
+    def get_stats(self):
+        return {name: {
+            'queries': schedule.queries,
+            'local': schedule.local_counts,
+            'failures': schedule.failures,
+            'changes': schedule.changes,
+            'interval': schedule.delay,
+            'renames': discord_service.get_service_manager().player_count_renames[name]
+        } for name, schedule in self.schedules.items()}
+
+    def get_metrics(self):
+        samples = super().get_metrics()
+        for name, schedule in self.schedules.items():
+            labels = (('server', name),)
+            samples.append(('carim_player_count_queries_total', labels, schedule.queries))
+            samples.append(('carim_player_count_local_total', labels, schedule.local_counts))
+            samples.append(('carim_player_count_failures_total', labels, schedule.failures))
+            samples.append(('carim_player_count_interval_seconds', labels, schedule.delay))
+        return samples
 
+    def can_count_locally(self, server_name):
+        watched = get_watched_fields(server_name)
+        if not player_sessions.get_roster(server_name).synced or not watched <= LOCAL_FIELDS:
+            return False
+        if 'max_players' not in watched:
+            return True
+        last_query = self.steam_queried.get(server_name)
+        return (server_name in self.last_results and last_query is not None
+                and asyncio.get_event_loop().time() - last_query < STEAM_REFRESH_INTERVAL)
+
+    def get_local_result(self, server_name):
+        result = copy.copy(self.last_results.get(server_name)) or query.SteamData()
+        result.players = player_sessions.get_roster(server_name).get_count()
+        return result
+
+    async def update_player_counts(self, server_names):
+        # Servers whose roster is in sync are counted from it, the rest are asked through steam
+        local = [name for name in server_names if self.can_count_locally(name)]
+        remote = [name for name in server_names if name not in local]
+        results = dict()
+        if remote:
+            message = steam_service.QueryAll(remote)
+            await steam_service.get_service_manager().send_message(message)
+            try:
+                # Shielded so the query being dropped can be told apart from this service being stopped
+                results.update(await asyncio.wait_for(asyncio.shield(message.result), STEAM_QUERY_TIMEOUT))
+            except asyncio.TimeoutError:
+                log.warning(f'player count query for {remote} timed out')
+            except asyncio.CancelledError:
+                if not message.result.cancelled():
+                    raise
+                log.warning(f'player count query for {remote} was cancelled')
+            else:
+                for server_name in remote:
+                    self.steam_queried[server_name] = asyncio.get_event_loop().time()
+        for server_name in server_names:
+            if server_name in local:
+                await self.handle_result(server_name, self.get_local_result(server_name), local=True)
+            else:
+                await self.handle_result(server_name, results.get(server_name))
+            schedule = self.get_schedule(server_name)
+            rename_delay = discord_service.get_service_manager().get_player_count_rename_delay(server_name)
+            self.next_update[server_name] = asyncio.get_event_loop().time() + schedule.next_delay(rename_delay)
+
+    async def handle_result(self, server_name, result, local=False):
+        schedule = self.get_schedule(server_name)
+        if result is None:
+            log.warning(f'{server_name} update player count query failed')
+            schedule.record(reachable=False)
+            return
         result: query.SteamData = result
-        message = discord_service.PlayerCount(
-            self.server_name,
-            result.players,
-            result.max_players,
-            result.get_queue(),
-            result.get_time()
-        )
-        await discord_service.get_service_manager().send_message(message)
+        changed = result.diff(self.last_results.get(server_name)) & get_watched_fields(server_name)
+        self.last_results[server_name] = result
+        schedule.record(reachable=True, changed=bool(changed), local=local)
+        if changed:
+            message = discord_service.PlayerCount(
+                server_name,
+                result.players,
+                result.max_players,
+                result.get_queue(),
+                result.get_time()
+            )
+            await discord_service.get_service_manager().send_message(message)
 
 
-services = dict()
+service = None
 
 
-def get_service_manager(server_name):
-    if server_name not in services:
-        services[server_name] = PlayerCountService(server_name)
-    return services[server_name]
+def get_service_manager():
+    global service
+    if service is None:
+        service = PlayerCountService()
+    return service
@@ -1,95 +1,135 @@
 import asyncio
 import datetime
+import heapq
+import itertools
 import logging
+import time
 
 from carim_discord_bot import managed_service, config
 from carim_discord_bot.discord_client import discord_service
 from carim_discord_bot.rcon import rcon_service
+from carim_discord_bot.services import cron
 
+ALIGNMENT_TOLERANCE = 0.001
 log = logging.getLogger(__name__)
 
 
 class Skip(managed_service.Message):
-    pass
+    def __init__(self, server_name, index):
+        super().__init__(server_name)
+        self.index = index
 
 
-class ScheduledCommand(managed_service.ManagedService):
+class ScheduledCommand:
     def __init__(self, server_name, index):
-        super().__init__()
         self.server_name = server_name
         self.index = index
         self.command = config.get_server(self.server_name).scheduled_commands[self.index]
-        self.command['next'] = 'unknown'
-
-    async def handle_message(self, message: managed_service.Message):
-        if isinstance(message, Skip):
-            self.command['skip'] = True
-
-    async def service(self):
-        if not self.command.get('with_clock', False):
-            await asyncio.sleep(self.command.get('offset', 0))
-        while True:
-            await self.schedule_command()
-            await asyncio.sleep(5)
-
-    async def schedule_command(self):
+        self.cron = cron.CronExpression(self.command['cron']) if 'cron' in self.command else None
+        self.skip = False
+        self.running = False
+        self.deadline = None
+
+    def get_first_deadline(self, now):
+        if self.cron is None and not self.command.get('with_clock', False):
+            return now + self.command.get('offset', 0) + self.command['interval']
+        return self.get_next_deadline(now)
+
+    def get_next_deadline(self, after):
+        if self.cron is not None:
+            return self.cron.get_next(datetime.datetime.fromtimestamp(after)).timestamp()
         interval = self.command['interval']
         if self.command.get('with_clock', False):
-            await self.wait_for_aligned_time()
-        else:
-            time_left = interval
-            while time_left > 0:
-                self.command['next'] = time_left
-                await asyncio.sleep(2)
-                time_left -= 2
-        self.command['next'] = 'now'
-        if self.command.get('skip', False):
+            moment = datetime.datetime.fromtimestamp(after)
+            midnight = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+            day_elapsed = (moment - midnight).total_seconds() - self.command.get('offset', 0)
+            remaining = interval - day_elapsed % interval
+            # Rounding can leave an aligned time a hair short of the interval it just finished
+            return after + (remaining if remaining > ALIGNMENT_TOLERANCE else interval)
+        return after + interval
+
+    def get_next(self):
+        if self.running or self.deadline is None:
+            return 'now' if self.running else 'unknown'
+        return max(0, self.deadline - time.time())
+
+    async def run(self):
+        if self.skip:
+            self.skip = False
             await discord_service.get_service_manager().send_message(
                 discord_service.Log(self.server_name, f'Skipping scheduled command: {self.command.get("command")}')
             )
-            del self.command['skip']
-        else:
-            if self.command.get('command') == 'safe_shutdown':
-                await rcon_service.get_service_manager(self.server_name).send_message(
-                    rcon_service.SafeShutdown(self.server_name, self.command.get('delay', 0))
-                )
-            else:
-                await rcon_service.get_service_manager(self.server_name).send_message(
-                    rcon_service.Command(self.server_name, self.command['command'])
-                )
-
-    async def wait_for_aligned_time(self):
-        while True:
-            if self.is_time_aligned():
-                if self.command['next'] == 'now':
-                    await asyncio.sleep(2)
-                else:
-                    break
-            else:
-                self.command['next'] = self.get_time_to_next_command()
-                await asyncio.sleep(2)
-
-    def is_time_aligned(self):
-        if self.get_time_to_next_command() < 5:
-            return True
+        elif self.command.get('command') == 'safe_shutdown':
+            await rcon_service.get_service_manager(self.server_name).send_message(
+                rcon_service.SafeShutdown(self.server_name, self.command.get('delay', 0))
+            )
         else:
-            return False
-
-    def get_time_to_next_command(self):
-        interval = self.command['interval']
-        offset = self.command.get('offset', 0)
-        now = datetime.datetime.now()
-        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        day_elapsed = (now - midnight).total_seconds() - offset
-        return interval - day_elapsed % interval
+            await rcon_service.get_service_manager(self.server_name).send_message(
+                rcon_service.Command(self.server_name, self.command['command'])
+            )
 
 
-services = dict()
+class Scheduler(managed_service.ManagedService):
+    # Every scheduled command of every server shares one heap of deadlines, and the scheduler
+    # only wakes up when the earliest of them is due or a command is added
+    def __init__(self):
+        super().__init__()
+        self.jobs = dict()
+        self.heap = list()
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+
+    def add_server(self, server_name):
+        now = time.time()
+        self.jobs[server_name] = list()
+        for i in range(len(config.get_server(server_name).scheduled_commands)):
+            job = ScheduledCommand(server_name, i)
+            self.jobs[server_name].append(job)
+            self.push(job, job.get_first_deadline(now))
+        self.wakeup.set()
+
+    def get_job(self, server_name, index) -> ScheduledCommand:
+        return self.jobs[server_name][index]
+
+    def push(self, job: ScheduledCommand, deadline):
+        job.deadline = deadline
+        heapq.heappush(self.heap, (deadline, next(self.counter), job))
 
+    async def handle_message(self, message: managed_service.Message):
+        if isinstance(message, Skip):
+            self.get_job(message.server_name, message.index).skip = True
 
-def get_service_manager(server_name, index):
-    if server_name not in services:
-        services[server_name] = dict()
-    if index not in services[server_name]:
-        services[server_name][index] = ScheduledCommand(server_name, index)
-    return services[server_name][index]
+    async def service(self):
+        while True:
+            self.wakeup.clear()
+            if not self.heap:
+                await self.wakeup.wait()
+                continue
+            delay = self.heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            deadline, _, job = heapq.heappop(self.heap)
+            job.running = True
+            try:
+                await job.run()
+            finally:
+                job.running = False
+                next_deadline = job.get_next_deadline(deadline)
+                if next_deadline <= time.time():
+                    # Runs that were missed while the process was suspended or busy are not caught up
+                    next_deadline = job.get_next_deadline(time.time())
+                self.push(job, next_deadline)
+
+
+service = None
+
+
+def get_service_manager():
+    global service
+    if service is None:
+        service = Scheduler()
+    return service
@@ -1,38 +1,119 @@
 import asyncio
+import logging
 import re
+import socket
 import struct
 
+SIMPLE_RESPONSE_HEADER = 0xffffffff
+A2S_INFO = 0x54
+S2A_INFO = 0x49
+S2C_CHALLENGE = 0x41
 QUERY_HEADER_FORMAT = '=IB'
-QUERY = struct.pack(QUERY_HEADER_FORMAT, 0xffffffff, 0x54) + b'Source Engine Query' + struct.pack('=B', 0x00)
+QUERY = struct.pack(QUERY_HEADER_FORMAT, SIMPLE_RESPONSE_HEADER, A2S_INFO) + b'Source Engine Query' + \
+        struct.pack('=B', 0x00)
 RESPONSE_HEADER_FORMAT = '=IBB'
 RESPONSE_DATA_FORMAT = '=HBBBBBBB'
-
-
-class SteamProtocol(asyncio.DatagramProtocol):
-    def __init__(self, future: asyncio.Future):
-        self.future = future
+RESPONSE_HEADER = struct.Struct(RESPONSE_HEADER_FORMAT)
+RESPONSE_DATA = struct.Struct(RESPONSE_DATA_FORMAT)
+UNSIGNED_BYTE = struct.Struct('=B')
+UNSIGNED_SHORT = struct.Struct('=H')
+UNSIGNED_LONG_LONG = struct.Struct('=Q')
+TIME_PATTERN = re.compile(r'[0-9]{2}:[0-9]{2}')
+LEADING_STRINGS = re.compile(rb'([^\x00]*)\x00([^\x00]*)\x00([^\x00]*)\x00([^\x00]*)\x00')
+CHALLENGE_FORMAT = '=4s'
+DEFAULT_TIMEOUT = 5
+log = logging.getLogger(__name__)
+
+
+class SteamQueryProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
         self.transport = None
+        self.pending = dict()
 
     def connection_made(self, transport):
         self.transport = transport
-        transport.sendto(QUERY)
 
     def datagram_received(self, data, addr):
+        future = self.pending.get(addr)
+        if future is None or future.done() or len(data) < struct.calcsize(QUERY_HEADER_FORMAT):
+            return
+        header, response_type = struct.unpack_from(QUERY_HEADER_FORMAT, data)
+        if header != SIMPLE_RESPONSE_HEADER:
+            log.debug(f'ignoring unsupported steam response from {addr}')
+        elif response_type == S2C_CHALLENGE:
+            # Servers that require a challenge answer the first query with one, and expect
+            # the query to be repeated with it appended
+            (challenge,) = struct.unpack_from(CHALLENGE_FORMAT, data, struct.calcsize(QUERY_HEADER_FORMAT))
+            self.transport.sendto(QUERY + challenge, addr)
+        elif response_type == S2A_INFO:
+            try:
+                future.set_result(unpack_steam_response(data))
+            except (struct.error, ValueError) as e:
+                log.warning(f'invalid steam response from {addr}: {e}')
+
+    def error_received(self, exc):
+        log.debug(f'steam query socket error: {exc}')
+
+    def connection_lost(self, exc):
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError('steam query socket closed'))
+        self.pending = dict()
+
+
+class QueryEngine:
+    # One socket is shared by the queries to every server, with replies matched to
+    # queries by the address they came from
+    def __init__(self):
+        self.transport = None
+        self.protocol = None
+        self.lock = asyncio.Lock()
+
+    async def open(self):
+        async with self.lock:
+            if self.transport is None or self.transport.is_closing():
+                self.transport, self.protocol = await asyncio.get_event_loop().create_datagram_endpoint(
+                    SteamQueryProtocol, local_addr=('0.0.0.0', 0))
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+    async def query(self, ip, port, timeout=DEFAULT_TIMEOUT):
+        await self.open()
+        infos = await asyncio.get_event_loop().getaddrinfo(ip, port, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        addr = infos[0][4]
+        future = self.protocol.pending.get(addr)
+        if future is None or future.done():
+            future = asyncio.get_event_loop().create_future()
+            self.protocol.pending[addr] = future
+            self.transport.sendto(QUERY, addr)
         try:
-            self.future.set_result(unpack_steam_response(data))
-        except:
-            self.future.cancel()
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
         finally:
-            self.transport.close()
+            if self.protocol.pending.get(addr) is future:
+                del self.protocol.pending[addr]
+
+    async def query_all(self, addresses, timeout=DEFAULT_TIMEOUT):
+        names = list(addresses)
+        results = await asyncio.gather(*(self.query(*addresses[name], timeout=timeout) for name in names),
+                                       return_exceptions=True)
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                log.warning(f'{name} steam query failed: {result!r}')
+        return {name: None if isinstance(result, Exception) else result for name, result in zip(names, results)}
 
 
 def unpack_steam_response(data):
+    # Fields are read at a running offset into the datagram rather than re-slicing the rest of it
     response = SteamData()
-    data = data[struct.calcsize(RESPONSE_HEADER_FORMAT):]
-    response.name, data = get_next_string(data)
-    response.map_name, data = get_next_string(data)
-    response.folder, data = get_next_string(data)
-    response.game, data = get_next_string(data)
+    leading_strings = LEADING_STRINGS.match(data, RESPONSE_HEADER.size)
+    if leading_strings is None:
+        raise ValueError('missing server name, map, folder or game')
+    response.name, response.map_name, response.folder, response.game = (
+        value.decode() for value in leading_strings.groups())
+    offset = leading_strings.end()
     (
         response.steam_id,
         response.players,
@@ -42,37 +123,41 @@ def unpack_steam_response(data):
         response.env,
         response.vis,
         response.vac
-    ), data = unpack_from_format(RESPONSE_DATA_FORMAT, data)
-    response.version, data = get_next_string(data)
-    (edf,), data = unpack_from_format('=B', data)
+    ) = RESPONSE_DATA.unpack_from(data, offset)
+    offset += RESPONSE_DATA.size
+    response.version, offset = get_next_string(data, offset)
+    (edf,) = UNSIGNED_BYTE.unpack_from(data, offset)
+    offset += UNSIGNED_BYTE.size
     if edf & 0x80:
-        (response.port,), data = unpack_from_format('=H', data)
+        (response.port,) = UNSIGNED_SHORT.unpack_from(data, offset)
+        offset += UNSIGNED_SHORT.size
     if edf & 0x10:
-        (response.extra_steam_id,), data = unpack_from_format('=Q', data)
+        (response.extra_steam_id,) = UNSIGNED_LONG_LONG.unpack_from(data, offset)
+        offset += UNSIGNED_LONG_LONG.size
     if edf & 0x40:
-        (response.source_tv_port,), data = unpack_from_format('=H', data)
-        response.source_tv_name, data = get_next_string(data)
+        (response.source_tv_port,) = UNSIGNED_SHORT.unpack_from(data, offset)
+        offset += UNSIGNED_SHORT.size
+        response.source_tv_name, offset = get_next_string(data, offset)
     if edf & 0x20:
-        temp_keywords, data = get_next_string(data)
-        response.keywords = temp_keywords.split(',')
+        temp_keywords, offset = get_next_string(data, offset)
+        response.set_keywords(temp_keywords.split(','))
     if edf & 0x01:
-        (response.game_id,), data = unpack_from_format('=Q', data)
+        (response.game_id,) = UNSIGNED_LONG_LONG.unpack_from(data, offset)
     return response
 
 
-def get_next_string(data):
-    result, _, data = data.partition(b'\x00')
-    result = result.decode()
-    return result, data
-
-
-def unpack_from_format(data_format, data):
-    result = struct.unpack_from(data_format, data)
-    data = data[struct.calcsize(data_format):]
-    return result, data
+def get_next_string(data, offset):
+    end = data.find(b'\x00', offset)
+    if end == -1:
+        end = len(data)
+    return data[offset:end].decode(), end + 1
 
 
 class SteamData:
+    __slots__ = ('name', 'map_name', 'folder', 'game', 'steam_id', 'players', 'max_players', 'bots', 'server_type',
+                 'env', 'vis', 'vac', 'version', 'port', 'extra_steam_id', 'source_tv_port', 'source_tv_name',
+                 'keywords', 'game_id', 'queue', 'time')
+
     def __init__(self):
         self.name = None
         self.map_name = None
@@ -89,25 +174,31 @@ class SteamData:
         self.version = None
         self.port = None
         self.extra_steam_id = None
+        self.source_tv_port = None
+        self.source_tv_name = None
         self.keywords = list()
         self.game_id = None
+        self.queue = None
+        self.time = None
+
+    def set_keywords(self, keywords):
+        # Keywords are only scanned once, when the response is parsed
+        self.keywords = keywords
+        for kw in keywords:
+            if self.queue is None and kw.startswith('lqs'):
+                self.queue = kw[3:]
+            elif self.time is None and TIME_PATTERN.match(kw):
+                self.time = kw
+            if self.queue is not None and self.time is not None:
+                break
 
     def get_queue(self):
-        for kw in self.keywords:
-            if kw.startswith('lqs'):
-                return kw[3:]
-        return None
+        return self.queue
 
     def get_time(self):
-        time_pattern = re.compile(r'[0-9]{2}:[0-9]{2}')
-        for kw in self.keywords:
-            if time_pattern.match(kw):
-                return kw
-        return None
-
-
-async def query(ip, port, future):
-    loop = asyncio.get_running_loop()
-    transport, protocol = await loop.create_datagram_endpoint(lambda: SteamProtocol(future), remote_addr=(ip, port))
-    await asyncio.sleep(2)
-    transport.close()
+        return self.time
+
+    def diff(self, previous):
+        if previous is None:
+            return set(self.__slots__)
+        return {field for field in self.__slots__ if getattr(self, field) != getattr(previous, field)}
@@ -11,26 +11,51 @@ class Query(managed_service.Message):
     pass
 
 
+class QueryAll(managed_service.Message):
+    def __init__(self, server_names):
+        super().__init__(None)
+        self.server_names = server_names
+
+
 class SteamService(managed_service.ManagedService):
-    def __init__(self, server_name):
+    def __init__(self):
         super().__init__()
-        self.server_name = server_name
+        self.engine = query.QueryEngine()
+
+    async def stop(self):
+        self.engine.close()
+        await super().stop()
 
     async def handle_message(self, message: managed_service.Message):
         if isinstance(message, Query):
-            await query.query(config.get_server(self.server_name).ip,
-                              config.get_server(self.server_name).steam_port,
-                              message.result)
-
-    async def service(self):
-        while True:
-            await asyncio.sleep(1)
-
-
-services = dict()
-
-
-def get_service_manager(server_name):
-    if server_name not in services:
-        services[server_name] = SteamService(server_name)
-    return services[server_name]
+            asyncio.create_task(self.handle_query(message))
+        elif isinstance(message, QueryAll):
+            asyncio.create_task(self.handle_query_all(message))
+
+    async def handle_query(self, message: Query):
+        server_config = config.get_server(message.server_name)
+        try:
+            result = await self.engine.query(server_config.ip, server_config.steam_port)
+        except (asyncio.TimeoutError, OSError) as e:
+            log.warning(f'{message.server_name} steam query failed: {e!r}')
+            message.result.cancel()
+            return
+        if not message.result.done():
+            message.result.set_result(result)
+
+    async def handle_query_all(self, message: QueryAll):
+        addresses = {name: (config.get_server(name).ip, config.get_server(name).steam_port)
+                     for name in message.server_names}
+        results = await self.engine.query_all(addresses)
+        if not message.result.done():
+            message.result.set_result(results)
+
+
+service = None
+
+
+def get_service_manager():
+    global service
+    if service is None:
+        service = SteamService()
+    return service
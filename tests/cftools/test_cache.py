@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+from carim_discord_bot.cftools import cache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class Loader:
+    def __init__(self, delay=0, value='value'):
+        self.delay = delay
+        self.value = value
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return self.value if self.value is None else f'{self.value}{self.calls}'
+
+
+@pytest.mark.asyncio
+async def test_fresh_entries_are_reused_until_they_expire():
+    clock = Clock()
+    ttl_cache = cache.TTLCache('test', ttl=10, clock=clock)
+    loader = Loader()
+    assert await ttl_cache.get('key', loader) == 'value1'
+    clock.now = 9
+    assert await ttl_cache.get('key', loader) == 'value1'
+    clock.now = 10
+    assert await ttl_cache.get('key', loader) == 'value2'
+    assert loader.calls == 2
+    assert ttl_cache.get_stats() == dict(hits=1, misses=2, expired=1, size=1, in_flight=0)
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_entry_is_evicted():
+    ttl_cache = cache.TTLCache('test', max_size=2)
+    loaders = {key: Loader() for key in 'abc'}
+    await ttl_cache.get('a', loaders['a'])
+    await ttl_cache.get('b', loaders['b'])
+    await ttl_cache.get('a', loaders['a'])
+    await ttl_cache.get('c', loaders['c'])
+    assert list(ttl_cache.entries) == ['a', 'c']
+    assert ttl_cache.stats['evictions'] == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_one_load():
+    ttl_cache = cache.TTLCache('test')
+    loader = Loader(delay=0.05)
+    results = await asyncio.gather(*(ttl_cache.get('key', loader) for _ in range(5)))
+    assert results == ['value1'] * 5
+    assert loader.calls == 1
+    assert ttl_cache.stats['coalesced'] == 4
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_the_shared_load():
+    ttl_cache = cache.TTLCache('test')
+    loader = Loader(delay=0.05)
+    first = asyncio.create_task(ttl_cache.get('key', loader))
+    second = asyncio.create_task(ttl_cache.get('key', loader))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == 'value1'
+    assert loader.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_stale_entry_is_served_while_it_refreshes():
+    clock = Clock()
+    ttl_cache = cache.TTLCache('test', ttl=10, stale=100, clock=clock)
+    loader = Loader(delay=0.05)
+    assert await ttl_cache.get('key', loader) == 'value1'
+    clock.now = 50
+    assert await ttl_cache.get('key', loader) == 'value1'
+    assert await ttl_cache.get('key', loader) == 'value1'
+    await asyncio.sleep(0.1)
+    assert await ttl_cache.get('key', loader) == 'value2'
+    assert loader.calls == 2
+    assert ttl_cache.stats['stale_hits'] == 2
+
+
+@pytest.mark.asyncio
+async def test_failures_are_not_cached():
+    ttl_cache = cache.TTLCache('test')
+    failing = Loader(value=None)
+    assert await ttl_cache.get('key', failing) is None
+    assert await ttl_cache.get('key', failing) is None
+    assert failing.calls == 2
+    rejected = Loader()
+    assert await ttl_cache.get('other', rejected, cacheable=lambda value: False) == 'value1'
+    assert await ttl_cache.get('other', rejected, cacheable=lambda value: False) == 'value2'
+    assert len(ttl_cache.entries) == 0
+
+
+def test_endpoint_overrides():
+    caches = cache.EndpointCaches(max_size=5, ttl=dict(player=5), stale=dict(leaderboard=0))
+    assert caches['player'].ttl == 5
+    assert caches['leaderboard'].ttl == cache.DEFAULT_TTL['leaderboard']
+    assert caches['leaderboard'].stale == 0
+    assert caches['lookup'].max_size == 5
+    assert set(caches.get_stats()) == set(cache.ENDPOINTS)
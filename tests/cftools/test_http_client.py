@@ -0,0 +1,234 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from carim_discord_bot import config
+from carim_discord_bot.cftools import http_client, omega_service
+
+SLOW_RESPONSE_SECONDS = 0.5
+
+
+async def start_stub_server(routes):
+    app = web.Application()
+    app.add_routes(routes)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    return runner, f'http://{host}:{port}'
+
+
+async def slow_handler(request):
+    await asyncio.sleep(SLOW_RESPONSE_SECONDS)
+    return web.json_response({'status': True, 'users': [], 'query': dict(request.query)})
+
+
+async def count_ticks(interval, counter):
+    while True:
+        await asyncio.sleep(interval)
+        counter[0] += 1
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_event_loop_keeps_running_during_slow_requests():
+    runner, url = await start_stub_server([web.get('/slow', slow_handler)])
+    client = http_client.HttpClient()
+    ticks = [0]
+    ticker = asyncio.create_task(count_ticks(0.01, ticks))
+    try:
+        start = asyncio.get_running_loop().time()
+        responses = await asyncio.gather(*(client.request('GET', f'{url}/slow', params=dict(stat='kills'))
+                                           for _ in range(5)))
+        elapsed = asyncio.get_running_loop().time() - start
+    finally:
+        ticker.cancel()
+        await client.close()
+        await runner.cleanup()
+
+    assert all(r.status_code == 200 for r in responses)
+    assert responses[0].json()['query'] == {'stat': 'kills'}
+    # the requests overlap instead of running back to back
+    assert elapsed < SLOW_RESPONSE_SECONDS * 3
+    # a blocking client would leave the ticker starved for the whole round trip
+    assert ticks[0] >= SLOW_RESPONSE_SECONDS / 0.01 / 2
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_request_timeout_returns_none():
+    runner, url = await start_stub_server([web.get('/slow', slow_handler)])
+    client = http_client.HttpClient(timeout=0.1)
+    try:
+        response = await client.request('GET', f'{url}/slow')
+    finally:
+        await client.close()
+        await runner.cleanup()
+    assert response is None
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_omega_leaderboard_through_stub(monkeypatch):
+    async def login_handler(request):
+        return web.json_response({'access_token': 'access', 'refresh_token': 'refresh'})
+
+    async def leaderboard_handler(request):
+        assert request.headers['Authorization'] == 'Bearer access'
+        return web.json_response({'status': True, 'users': [{'rank': 1, 'latest_name': 'Survivor', 'kills': 3}]})
+
+    runner, url = await start_stub_server([
+        web.post('/auth/login', login_handler),
+        web.get('/v2/omega/token/leaderboard', leaderboard_handler)
+    ])
+    monkeypatch.setattr(omega_service, 'API', url)
+    monkeypatch.setattr(config, '_global_config', config._build_from_dict({
+        'cftools_application_id': 'app',
+        'cftools_client_id': 'client',
+        'cftools_secret': 'secret',
+        'cftools_identity_index': None
+    }, config.GlobalConfig))
+    monkeypatch.setitem(config._server_configs, 'test', config._build_from_dict({
+        'cftools_service_id': 'service'
+    }, config.ServerConfig))
+
+    service = omega_service.OmegaService()
+    service.service_tokens['service'] = omega_service.ServiceToken(dict(service_id='service', token='token'))
+    try:
+        await service.login()
+        assert service.logged_in
+        result = await service.query_leaderboard('test', 'kills')
+    finally:
+        await service.http.close()
+        await runner.cleanup()
+    assert result == {'status': True, 'users': [{'rank': 1, 'latest_name': 'Survivor', 'kills': 3}]}
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_omega_stats_share_cached_lookups(monkeypatch, tmp_path):
+    requests = list()
+
+    async def login_handler(request):
+        return web.json_response({'access_token': 'access', 'refresh_token': 'refresh'})
+
+    async def lookup_handler(request):
+        requests.append(request.path)
+        await asyncio.sleep(0.05)
+        return web.json_response({'status': True, 'cftools_id': 'cftools'})
+
+    async def player_handler(request):
+        requests.append(request.path)
+        return web.json_response({'status': True, 'user': {'service': {'playtime': 60, 'stats': {'kills': 3}}}})
+
+    runner, url = await start_stub_server([
+        web.post('/auth/login', login_handler),
+        web.get('/v1/user/lookup', lookup_handler),
+        web.get('/v1/user/token/service', player_handler)
+    ])
+    monkeypatch.setattr(omega_service, 'API', url)
+    monkeypatch.setattr(config, '_global_config', config._build_from_dict({
+        'cftools_application_id': 'app',
+        'cftools_client_id': 'client',
+        'cftools_secret': 'secret',
+        'cftools_identity_index': str(tmp_path / 'identities.sqlite3')
+    }, config.GlobalConfig))
+    monkeypatch.setitem(config._server_configs, 'test', config._build_from_dict({
+        'cftools_service_id': 'service'
+    }, config.ServerConfig))
+
+    service = omega_service.OmegaService()
+    service.service_tokens['service'] = omega_service.ServiceToken(dict(service_id='service', token='token'))
+    await service.identities.open()
+    try:
+        await service.login()
+        results = await asyncio.gather(*(service.query_stats('test', '76561198000000000') for _ in range(3)))
+        results.append(await service.query_stats('test', '76561198000000000'))
+    finally:
+        await service.http.close()
+        await service.identities.close()
+        await runner.cleanup()
+    assert len(set(results)) == 1
+    assert '"kills": 3' in results[0]
+    assert requests == ['/v1/user/lookup', '/v1/user/token/service']
+    stats = service.get_cache_stats()
+    assert stats['lookup']['coalesced'] == 2
+    assert stats['player']['hits'] == 1
+
+    restarted = omega_service.OmegaService()
+    await restarted.identities.open()
+    assert restarted.identities.get(76561198000000000) == 'cftools'
+    await restarted.identities.close()
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_omega_failures_cancel_the_result(monkeypatch):
+    monkeypatch.setattr(config, '_global_config', config._build_from_dict({
+        'cftools_application_id': 'app',
+        'cftools_client_id': 'client',
+        'cftools_secret': 'secret',
+        'cftools_identity_index': None
+    }, config.GlobalConfig))
+    monkeypatch.setitem(config._server_configs, 'test', config._build_from_dict({
+        'cftools_service_id': 'service'
+    }, config.ServerConfig))
+
+    async def broken_stats(server_name, steam64):
+        raise RuntimeError('broken')
+
+    service = omega_service.OmegaService()
+    monkeypatch.setattr(service, 'query_stats', broken_stats)
+    try:
+        # the service tokens haven't loaded yet
+        leaderboard = omega_service.Leaderboard('test', 'kills')
+        await service.handle_message(leaderboard)
+        assert await leaderboard.result == 'Query failed'
+        stats = omega_service.Stats('test', '76561198000000000')
+        await service.handle_message(stats)
+        with pytest.raises(asyncio.CancelledError):
+            await stats.result
+    finally:
+        await service.http.close()
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_omega_error_responses_are_not_cached(monkeypatch):
+    responses = [web.json_response({'status': False, 'error': 'rate-limited'}, status=429),
+                 web.json_response({'status': False, 'error': 'unknown'}),
+                 web.json_response({'status': True, 'users': []})]
+
+    async def login_handler(request):
+        return web.json_response({'access_token': 'access', 'refresh_token': 'refresh'})
+
+    async def leaderboard_handler(request):
+        return responses.pop(0)
+
+    runner, url = await start_stub_server([
+        web.post('/auth/login', login_handler),
+        web.get('/v2/omega/token/leaderboard', leaderboard_handler)
+    ])
+    monkeypatch.setattr(omega_service, 'API', url)
+    monkeypatch.setattr(config, '_global_config', config._build_from_dict({
+        'cftools_application_id': 'app',
+        'cftools_client_id': 'client',
+        'cftools_secret': 'secret',
+        'cftools_identity_index': None
+    }, config.GlobalConfig))
+    monkeypatch.setitem(config._server_configs, 'test', config._build_from_dict({
+        'cftools_service_id': 'service'
+    }, config.ServerConfig))
+
+    service = omega_service.OmegaService()
+    service.service_tokens['service'] = omega_service.ServiceToken(dict(service_id='service', token='token'))
+    try:
+        await service.login()
+        results = [await service.query_leaderboard('test', 'kills') for _ in range(4)]
+    finally:
+        await service.http.close()
+        await runner.cleanup()
+    assert results == ['Query failed', 'Query failed', {'status': True, 'users': []}, {'status': True, 'users': []}]
+    assert responses == []
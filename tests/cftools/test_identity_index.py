@@ -0,0 +1,96 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+from carim_discord_bot.cftools import identity_index
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_identities_survive_reopening(tmp_path):
+    path = tmp_path / 'nested' / 'identities.sqlite3'
+    index = identity_index.IdentityIndex(str(path))
+    await index.open()
+    assert index.get(76561198000000000) is None
+    index.add([('76561198000000000', 'cftools-a'), ('76561198000000001', 'cftools-b')])
+    await index.close()
+
+    reopened = identity_index.IdentityIndex(str(path))
+    reopened.add([('76561198000000002', 'cftools-c')])
+    await reopened.open()
+    assert reopened.get(76561198000000000) == 'cftools-a'
+    assert reopened.get('76561198000000001') == 'cftools-b'
+    assert reopened.get('76561198000000002') == 'cftools-c'
+    await reopened.close()
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_index_without_path_stays_in_memory():
+    index = identity_index.IdentityIndex(None)
+    await index.open()
+    index.add([('76561198000000000', 'cftools-a')])
+    assert index.get('76561198000000000') == 'cftools-a'
+    assert index.connection is None
+    await index.close()
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_unusable_file_falls_back_to_memory(tmp_path):
+    path = tmp_path / 'identities.sqlite3'
+    path.write_text('not a database')
+    index = identity_index.IdentityIndex(str(path))
+    await index.open()
+    index.add([('76561198000000000', 'cftools-a')])
+    assert index.get('76561198000000000') == 'cftools-a'
+    assert index.connection is None
+    await index.close()
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_warm_from_nested_responses(tmp_path):
+    queue_priority = {'entries': [
+        {'user': {'cftools_id': 'cftools-a', 'steam64': '76561198000000000'}, 'comment': 'donator'},
+        {'cftools_id': 'cftools-b', 'identities': {'steam': {'steamid': 76561198000000001}}},
+        {'cftools_id': 'cftools-c', 'steam64': 'not-a-steam64'},
+        {'steam64': '76561198000000003'},
+    ]}
+    index = identity_index.IdentityIndex(str(tmp_path / 'identities.sqlite3'))
+    await index.open()
+    index.warm(queue_priority)
+    assert index.identities == {
+        '76561198000000000': 'cftools-a',
+        '76561198000000001': 'cftools-b',
+    }
+    await index.close()
+    connection = sqlite3.connect(index.path)
+    assert len(connection.execute('SELECT * FROM identities').fetchall()) == 2
+    connection.close()
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_writes_do_not_block_the_loop(tmp_path, monkeypatch):
+    index = identity_index.IdentityIndex(str(tmp_path / 'identities.sqlite3'))
+    await index.open()
+    original_save = index.save
+
+    def slow_save(new):
+        # stands in for the fsync of a commit on a slow disk
+        time.sleep(0.2)
+        original_save(new)
+
+    monkeypatch.setattr(index, 'save', slow_save)
+    start = asyncio.get_running_loop().time()
+    index.add([('76561198000000000', 'cftools-a')])
+    await asyncio.sleep(0)
+    assert asyncio.get_running_loop().time() - start < 0.1
+    await index.close()
+    reopened = identity_index.IdentityIndex(index.path)
+    await reopened.open()
+    assert reopened.get('76561198000000000') == 'cftools-a'
+    await reopened.close()
@@ -0,0 +1,19 @@
+# BattlEye messages as they arrive from a DayZ server, used by the event tests and benchmarks
+MESSAGES = [
+    'Player #0 Survivor (127.0.0.1:2304) connected',
+    'Player #0 Survivor - BE GUID: 0123456789abcdef0123456789abcdef',
+    'Verified GUID (0123456789abcdef0123456789abcdef) of player #0 Survivor',
+    '(Global) Survivor: hello everybody',
+    '(Side) Survivor: anyone near the airfield?',
+    '(Direct) Survivor: friendly',
+    'Player #1 Player With Spaces (10.0.0.2:2304) connected',
+    'Verified GUID (fedcba9876543210fedcba9876543210) of player #1 Player With Spaces',
+    'RCon admin #0 (127.0.0.1:49152) logged in',
+    'RCon admin #0: (Global) Restarting the server in 5 minutes',
+    'Player #1 Player With Spaces (fedcba9876543210fedcba9876543210) has been kicked by BattlEye: '
+    'Admin Kick (Server is restarting)',
+    'Player #1 Player With Spaces disconnected',
+    'Player #0 Survivor (0123456789abcdef0123456789abcdef) has been kicked by BattlEye: Admin Ban (cheating)',
+    'Player #0 Survivor disconnected',
+    '(Global) Survivor: кто на кумырне сейчас?',
+]
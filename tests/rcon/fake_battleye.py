@@ -0,0 +1,88 @@
+import asyncio
+import struct
+
+from carim_discord_bot import config
+from carim_discord_bot.rcon import protocol
+
+
+class RawPayload(protocol.Payload):
+    def __init__(self, packet_type, data):
+        self.packet_type = packet_type
+        self.data = data
+
+    def generate(self):
+        return struct.pack('=B', self.packet_type) + self.data
+
+    def __str__(self):
+        return f'RawPayload {self.packet_type}'
+
+
+class FakeBattlEyeServer(asyncio.DatagramProtocol):
+    def __init__(self, password='password', delay=0.0, fragment_size=None):
+        self.password = password
+        self.delay = delay
+        self.fragment_size = fragment_size
+        self.transport = None
+        self.client_addr = None
+        self.commands = list()
+        self.logins = 0
+        self.outstanding = 0
+        self.max_outstanding = 0
+        self.responses = dict()
+        self.ignored = set()
+        self.dropped = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    @property
+    def port(self):
+        return self.transport.get_extra_info('sockname')[1]
+
+    def datagram_received(self, data, addr):
+        if self.dropped:
+            return
+        packet = protocol.Packet.parse(data)
+        if packet is None:
+            return
+        if isinstance(packet.payload, protocol.Login):
+            self.client_addr = addr
+            self.logins += 1
+            success = protocol.SUCCESS if data.endswith(self.password.encode()) else 0x00
+            self.send(RawPayload(protocol.LOGIN, struct.pack('=B', success)), addr)
+        elif isinstance(packet.payload, protocol.Command):
+            self.commands.append(packet.payload.data)
+            if packet.payload.data.split(' ')[0] in self.ignored:
+                return
+            self.outstanding += 1
+            self.max_outstanding = max(self.max_outstanding, self.outstanding)
+            asyncio.get_running_loop().call_later(
+                self.delay, self.reply, packet.payload.sequence_number, packet.payload.data, addr)
+
+    def reply(self, sequence_number, command, addr):
+        self.outstanding -= 1
+        response = self.responses.get(command.split(' ')[0], f'reply to {command}')
+        if callable(response):
+            response = response(command)
+        raw = protocol.encode(response)
+        if self.fragment_size is None or len(raw) <= self.fragment_size:
+            self.send(protocol.Command(sequence_number, command=response), addr)
+            return
+        fragments = [raw[i:i + self.fragment_size] for i in range(0, len(raw), self.fragment_size)]
+        for index, fragment in enumerate(fragments):
+            self.send(protocol.SplitCommand(sequence_number, fragment, len(fragments), index), addr)
+
+    def send(self, payload, addr=None):
+        self.transport.sendto(protocol.Packet(payload).generate(), addr or self.client_addr)
+
+
+async def start_fake_server(**kwargs):
+    return await asyncio.get_running_loop().create_datagram_endpoint(
+        lambda: FakeBattlEyeServer(**kwargs), local_addr=('127.0.0.1', 0))
+
+
+def configure_server(monkeypatch, server_name, port, **settings):
+    monkeypatch.setattr(config, '_global_config', config._build_from_dict({}, config.GlobalConfig))
+    raw = dict(name=server_name, ip='127.0.0.1', rcon_port=port, rcon_password='password')
+    raw.update(settings)
+    monkeypatch.setattr(config, '_server_configs', {server_name: config._build_from_dict(raw, config.ServerConfig)})
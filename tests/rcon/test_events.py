@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from carim_discord_bot import config
+from carim_discord_bot.discord_client import discord_service
+from carim_discord_bot.rcon import events, connection
+from tests.rcon.corpus import MESSAGES
+
+
+def test_classify_corpus():
+    classified = [type(events.classify(m)) for m in MESSAGES]
+    assert classified == [
+        events.Other,
+        events.Other,
+        events.Connect,
+        events.Chat,
+        events.Chat,
+        events.Chat,
+        events.Other,
+        events.Connect,
+        events.Other,
+        events.Other,
+        events.Kick,
+        events.Disconnect,
+        events.Ban,
+        events.Disconnect,
+        events.Chat,
+    ]
+
+
+def test_event_fields():
+    connect = events.classify('Verified GUID (0123456789abcdef0123456789abcdef) of player #7 Player With Spaces')
+    assert (connect.number, connect.name, connect.guid) == (7, 'Player With Spaces', '0123456789abcdef0123456789abcdef')
+
+    disconnect = events.classify('Player #7 Player With Spaces disconnected')
+    assert (disconnect.number, disconnect.name) == (7, 'Player With Spaces')
+
+    chat = events.classify('(Side) Survivor: anyone: near the airfield?')
+    assert (chat.channel, chat.author, chat.text) == ('Side', 'Survivor', 'anyone: near the airfield?')
+    assert chat.content == 'Survivor: anyone: near the airfield?'
+
+    kick = events.classify('Player #2 Survivor (0123456789abcdef0123456789abcdef) has been kicked by BattlEye: '
+                           'Admin Kick (Server is restarting)')
+    assert (kick.number, kick.name, kick.reason) == (2, 'Survivor', 'Admin Kick (Server is restarting)')
+
+
+@pytest.mark.asyncio
+async def test_dispatch_batches_a_burst(monkeypatch):
+    monkeypatch.setattr(config, '_server_configs', {
+        'test': config._build_from_dict({'name': 'test'}, config.ServerConfig)
+    })
+    monkeypatch.setattr(config, '_global_config', config._build_from_dict({}, config.GlobalConfig))
+    service = discord_service.DiscordService()
+    monkeypatch.setattr(discord_service, 'service', service)
+    created_tasks = list()
+    create_task = asyncio.create_task
+    monkeypatch.setattr(asyncio, 'create_task', lambda coro: created_tasks.append(coro) or create_task(coro))
+
+    dispatcher = connection.EventDispatcher('test')
+    for message in MESSAGES:
+        dispatcher.dispatch(events.classify(message))
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+
+    assert len(created_tasks) == 1
+    sent = [service.message_queue.get_nowait() for _ in range(service.message_queue.qsize())]
+    assert [m.content for m in sent if isinstance(m, discord_service.Chat)] == [
+        'Survivor connected',
+        'Survivor: hello everybody',
+        'Survivor: anyone near the airfield?',
+        'Player With Spaces connected',
+        'Player With Spaces disconnected',
+        'Survivor disconnected',
+        'Survivor: кто на кумырне сейчас?',
+    ]
+    assert [m.text for m in sent if isinstance(m, discord_service.Log)] == MESSAGES
@@ -0,0 +1,72 @@
+from carim_discord_bot.rcon import events, player_sessions, players
+
+RESPONSE = '''\
+Players on server:
+[#] [IP Address]:[Port] [Ping] [GUID] [Name]
+--------------------------------------------------
+2   127.0.0.1:2304    0    1234abcd1234abcd1234abcd1234abcd(OK) Survivor2
+4   127.0.0.2:2304    32   5678abcd5678abcd5678abcd5678abcd(OK) Survivor4
+(2 players in total)'''
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000
+
+    def __call__(self):
+        return self.now
+
+
+def build_roster():
+    clock = Clock()
+    roster = player_sessions.PlayerRoster('test', clock=clock)
+    roster.begin_seed()
+    roster.seed(players.parse_players(RESPONSE))
+    return roster, clock
+
+
+def test_events_keep_the_roster_in_sync():
+    roster, clock = build_roster()
+    clock.now += 60
+    roster.handle(events.classify('Verified GUID (9999abcd9999abcd9999abcd9999abcd) of player #5 Player With Spaces'))
+    roster.handle(events.classify('Player #2 Survivor2 disconnected'))
+    assert [p.number for p in roster.get_players()] == [4, 5]
+    assert roster.get('player with spaces').joined == 1060
+    assert roster.get('5678abcd5678abcd5678abcd5678abcd').player.name == 'Survivor4'
+    assert roster.get('Survivor2') is None
+    clock.now += 30
+    assert [s.get_duration(clock.now) for s in roster.history] == [60]
+    assert roster.get_count() == 2
+
+
+def test_events_during_seeding_are_applied_again():
+    roster, clock = build_roster()
+    roster.begin_seed()
+    assert not roster.synced
+    roster.handle(events.classify('Player #4 Survivor4 disconnected'))
+    clock.now += 10
+    roster.handle(events.classify('Verified GUID (9999abcd9999abcd9999abcd9999abcd) of player #5 Survivor5'))
+    # the players answer was made before either event, and is missing a disconnect that never arrived
+    missing = '2   127.0.0.1:2304    0    1234abcd1234abcd1234abcd1234abcd(OK) Survivor2\n'
+    roster.seed(players.parse_players(RESPONSE.replace(missing, '')))
+    assert roster.synced
+    assert [p.name for p in roster.get_players()] == ['Survivor5']
+    assert roster.get('Survivor5').joined == 1010
+    assert [s.player.name for s in roster.history] == ['Survivor4', 'Survivor2']
+
+
+def test_reused_number_replaces_the_old_session():
+    roster, clock = build_roster()
+    roster.handle(events.classify('Verified GUID (9999abcd9999abcd9999abcd9999abcd) of player #2 Newcomer'))
+    assert roster.online[2].player.name == 'Newcomer'
+    assert roster.get('Survivor2') is None
+
+
+def test_format_players():
+    roster, clock = build_roster()
+    roster.handle(events.classify('Verified GUID (9999abcd9999abcd9999abcd9999abcd) of player #5 Survivor5'))
+    clock.now += 3661
+    lines = roster.format_players().split('\n')
+    assert lines[3] == '2   127.0.0.1:2304    0    1234abcd1234abcd1234abcd1234abcd(OK) Survivor2 1:01:01'
+    assert lines[5] == '5   -                 -    9999abcd9999abcd9999abcd9999abcd(OK) Survivor5 1:01:01'
+    assert lines[-1] == '(3 players in total)'
@@ -0,0 +1,37 @@
+from carim_discord_bot.rcon import players
+
+RAW_PLAYERS = '''\
+Players on server:
+[#] [IP Address]:[Port] [Ping] [GUID] [Name]
+--------------------------------------------------
+0   127.0.0.1:2304    47   0123456789abcdef0123456789abcdef(OK) Survivor
+3   10.0.0.2:2304     -1   -  Player With Spaces (Lobby)
+12  10.0.0.3:2305     120  fedcba9876543210fedcba9876543210(?) Unverified
+(3 players in total)'''
+
+
+def test_parse_players():
+    parsed = players.parse_players(RAW_PLAYERS)
+    assert [p.number for p in parsed] == [0, 3, 12]
+
+    assert parsed[0].ip == '127.0.0.1'
+    assert parsed[0].port == 2304
+    assert parsed[0].ping == 47
+    assert parsed[0].guid == '0123456789abcdef0123456789abcdef'
+    assert parsed[0].verified
+    assert parsed[0].name == 'Survivor'
+    assert not parsed[0].lobby
+
+    assert parsed[1].ping == -1
+    assert parsed[1].guid == '-'
+    assert not parsed[1].verified
+    assert parsed[1].name == 'Player With Spaces'
+    assert parsed[1].lobby
+
+    assert not parsed[2].verified
+    assert parsed[2].name == 'Unverified'
+
+
+def test_parse_empty_player_list():
+    raw = 'Players on server:\n[#] [IP Address]:[Port] [Ping] [GUID] [Name]\n---\n(0 players in total)'
+    assert players.parse_players(raw) == []
@@ -1,6 +1,7 @@
 import asyncio
 import logging
 import struct
+import zlib
 from typing import Union, Text, Tuple
 
 import pytest
@@ -118,3 +119,24 @@ async def test_split_rcon(event_loop: asyncio.BaseEventLoop):
     assert future.result().payload.data == expected_data
     await future2
     assert future2.result().payload.data == expected_data
+
+
+def test_checksum_matches_header_concatenation():
+    payload = protocol.Command(3, command='players').generate()
+    assert protocol.Packet.checksum(payload) == zlib.crc32(bytes([protocol.H_END]) + payload)
+    assert protocol.Packet.checksum(memoryview(payload)) == protocol.Packet.checksum(payload)
+
+
+def test_invalid_checksum_is_rejected():
+    data = bytearray(protocol.Packet(protocol.Command(3, command='players')).generate())
+    data[-1] ^= 0xff
+    assert protocol.Packet.parse(bytes(data)) is None
+
+
+def test_split_rcon_parsing_non_ascii():
+    data = 'GUID Bans: 0123456789abcdef0123456789abcdef perm кто'
+    packet = protocol.Packet(protocol.SplitCommand(200, data, 2, 0))
+    parsed = protocol.Packet.parse(packet.generate())
+    assert parsed.payload.sequence_number == 200
+    assert (parsed.payload.count, parsed.payload.index) == (2, 0)
+    assert parsed.payload.data == data
@@ -0,0 +1,318 @@
+import asyncio
+import types
+
+import pytest
+
+from carim_discord_bot import config, metrics
+from carim_discord_bot.rcon import rcon_service, connection_manager
+from tests.rcon.fake_battleye import start_fake_server, configure_server
+
+
+async def run_commands(service, commands):
+    messages = [rcon_service.Command(service.server_name, c) for c in commands]
+    for m in messages:
+        await service.send_message(m)
+    return await asyncio.gather(*(m.result for m in messages))
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_commands_are_pipelined(monkeypatch):
+    transport, server = await start_fake_server(delay=0.3)
+    configure_server(monkeypatch, 'test', server.port)
+    service = rcon_service.RconService('test')
+    await service.start()
+    try:
+        start = asyncio.get_running_loop().time()
+        results = await run_commands(service, [f'say -1 message {i}' for i in range(20)])
+        elapsed = asyncio.get_running_loop().time() - start
+    finally:
+        await service.stop()
+        transport.close()
+    assert results == [f'reply to say -1 message {i}' for i in range(20)]
+    # serial dispatch would need 20 round trips of 0.3 seconds
+    assert elapsed < 1.5
+    assert server.max_outstanding > 1
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_in_flight_limit(monkeypatch):
+    transport, server = await start_fake_server(delay=0.05)
+    configure_server(monkeypatch, 'test', server.port, rcon_max_in_flight=3)
+    service = rcon_service.RconService('test')
+    await service.start()
+    try:
+        results = await run_commands(service, [f'say -1 message {i}' for i in range(12)])
+    finally:
+        await service.stop()
+        transport.close()
+    assert len(results) == 12
+    assert server.max_outstanding == 3
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_slow_command_does_not_block_others(monkeypatch):
+    transport, server = await start_fake_server()
+    configure_server(monkeypatch, 'test', server.port, rcon_command_timeout=1)
+    # the server never answers bans, so it has to time out on its own
+    server.ignored.add('bans')
+    service = rcon_service.RconService('test')
+    await service.start()
+    try:
+        bans = rcon_service.Command('test', 'bans')
+        await service.send_message(bans)
+        results = await run_commands(service, ['say -1 hello'])
+        assert not bans.result.done()
+        assert results == ['reply to say -1 hello']
+    finally:
+        await service.stop()
+        transport.close()
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_streamed_split_response(monkeypatch):
+    transport, server = await start_fake_server(fragment_size=64)
+    bans = '\n'.join(f'{i} {i:032x} perm cheating' for i in range(100))
+    server.responses['bans'] = bans
+    configure_server(monkeypatch, 'test', server.port)
+    service = rcon_service.RconService('test')
+    await service.start()
+    try:
+        message = rcon_service.Command('test', 'bans', stream=True)
+        await service.send_message(message)
+        stream = await message.result
+        received = ''.join([chunk async for chunk in stream])
+
+        results = await run_commands(service, ['bans'])
+    finally:
+        await service.stop()
+        transport.close()
+    assert received == bans
+    assert results == [bans]
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_servers_share_one_socket_without_extra_tasks(monkeypatch):
+    fakes = [await start_fake_server() for _ in range(20)]
+    configure_server(monkeypatch, 'server0', fakes[0][1].port)
+    monkeypatch.setattr(config, '_server_configs', {
+        f'server{i}': config._build_from_dict(dict(name=f'server{i}', ip='127.0.0.1', rcon_port=server.port,
+                                                   rcon_password='password'), config.ServerConfig)
+        for i, (_, server) in enumerate(fakes)})
+    tasks = len(asyncio.all_tasks())
+    services = [rcon_service.RconService(f'server{i}') for i in range(len(fakes))]
+    try:
+        await asyncio.gather(*(service.start() for service in services))
+        # each login seeds the player roster with a short lived task of its own
+        while not all(service.roster.synced for service in services):
+            await asyncio.sleep(0.01)
+        assert len(asyncio.all_tasks()) == tasks
+        results = await asyncio.gather(*(run_commands(service, ['say -1 hello']) for service in services))
+        assert results == [['reply to say -1 hello']] * len(fakes)
+        client_addresses = {server.client_addr for _, server in fakes}
+        assert len(client_addresses) == 1
+    finally:
+        for service in services:
+            await service.stop()
+        for transport, _ in fakes:
+            transport.close()
+    assert connection_manager.get_connection_manager().transport is None
+
+
+@pytest.fixture
+def fast_reconnect(monkeypatch):
+    monkeypatch.setattr(connection_manager, 'KEEP_ALIVE_TIMEOUT', 0.1)
+    monkeypatch.setattr(connection_manager, 'LOGIN_TIMEOUT', 0.1)
+    monkeypatch.setattr(connection_manager, 'RECONNECT_BACKOFF_BASE', 0.05)
+    registry = metrics.Registry()
+    monkeypatch.setattr(metrics, '_registry', registry)
+    return registry
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_commands_sent_during_an_outage_go_out_after_reconnecting(monkeypatch, fast_reconnect):
+    transport, server = await start_fake_server()
+    configure_server(monkeypatch, 'test', server.port, rcon_command_timeout=3, rcon_keep_alive_idle=0.05)
+    service = rcon_service.RconService('test')
+    await service.start()
+    try:
+        server.dropped = True
+        while service.rcon_protocol.logged_in:
+            await asyncio.sleep(0.01)
+        message = rcon_service.Command('test', 'say -1 during outage')
+        await service.send_message(message)
+        await asyncio.sleep(0.3)
+        assert not message.result.done()
+        server.dropped = False
+        assert await message.result == 'reply to say -1 during outage'
+    finally:
+        await service.stop()
+        transport.close()
+    assert server.logins == 2
+    assert fast_reconnect.histograms['carim_rcon_recovery_seconds'][(('server', 'test'),)].count == 1
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_rejected_login_is_retried_with_backoff(monkeypatch, fast_reconnect):
+    transport, server = await start_fake_server(password='other')
+    configure_server(monkeypatch, 'test', server.port)
+    service = rcon_service.RconService('test')
+    start = asyncio.create_task(service.start())
+    try:
+        while server.logins < 3:
+            await asyncio.sleep(0.01)
+        assert not start.done()
+        server.password = 'password'
+        await asyncio.wait_for(start, 2)
+        assert service.rcon_protocol.failures == 0
+    finally:
+        await service.stop()
+        transport.close()
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_keep_alive_waits_for_the_session_to_go_quiet(monkeypatch, fast_reconnect):
+    transport, server = await start_fake_server()
+    configure_server(monkeypatch, 'test', server.port, rcon_keep_alive_idle=0.2)
+    service = rcon_service.RconService('test')
+    await service.start()
+    try:
+        for i in range(10):
+            await run_commands(service, [f'say -1 busy {i}'])
+            await asyncio.sleep(0.05)
+        assert '' not in server.commands
+        await asyncio.sleep(0.3)
+        assert server.commands.count('') == 1
+        labels = (('server', 'test'), ('kind', 'keep_alive'))
+        assert fast_reconnect.histograms['carim_rcon_round_trip_seconds'][labels].count == 1
+        gauges = {name: value for name, _, value in connection_manager.get_connection_manager().get_metrics()}
+        assert gauges['carim_rcon_keep_alive_seconds'] > 0
+    finally:
+        await service.stop()
+        transport.close()
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_unanswered_command_checks_the_session_straight_away(monkeypatch, fast_reconnect):
+    transport, server = await start_fake_server()
+    configure_server(monkeypatch, 'test', server.port, rcon_command_timeout=0.3)
+    server.ignored.add('bans')
+    service = rcon_service.RconService('test')
+    await service.start()
+    try:
+        bans = rcon_service.Command('test', 'bans')
+        await service.send_message(bans)
+        with pytest.raises(asyncio.CancelledError):
+            await bans.result
+        while '' not in server.commands:
+            await asyncio.sleep(0.01)
+        assert service.rcon_protocol.logged_in
+    finally:
+        await service.stop()
+        transport.close()
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_players_are_answered_from_the_roster_after_login(monkeypatch):
+    transport, server = await start_fake_server()
+    server.responses['players'] = (
+        'Players on server:\n[#] [IP Address]:[Port] [Ping] [GUID] [Name]\n' + '-' * 50 + '\n'
+        '0   127.0.0.1:2304    0    1234abcd1234abcd1234abcd1234abcd(OK) Survivor\n(1 players in total)')
+    configure_server(monkeypatch, 'test', server.port)
+    service = rcon_service.RconService('test')
+    await service.start()
+    try:
+        while not service.roster.synced:
+            await asyncio.sleep(0.01)
+        results = await run_commands(service, ['players', 'players'])
+    finally:
+        await service.stop()
+        transport.close()
+    assert server.commands.count('players') == 1
+    assert all('Survivor' in result and '(1 players in total)' in result for result in results)
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_players_are_queried_again_while_the_session_is_down(monkeypatch, fast_reconnect):
+    transport, server = await start_fake_server()
+    configure_server(monkeypatch, 'test', server.port, rcon_keep_alive_idle=0.1)
+    service = rcon_service.RconService('test')
+    await service.start()
+    try:
+        while not service.roster.synced:
+            await asyncio.sleep(0.01)
+        server.dropped = True
+        while service.rcon_protocol.logged_in:
+            await asyncio.sleep(0.01)
+        assert not service.roster.synced
+        players = rcon_service.Command('test', 'players')
+        await service.send_message(players)
+        server.dropped = False
+        assert await players.result == 'reply to players'
+        while not service.roster.synced:
+            await asyncio.sleep(0.01)
+    finally:
+        await service.stop()
+        transport.close()
+
+
+def test_backoff_doubles_up_to_the_limit_with_jitter():
+    manager = connection_manager.ConnectionManager()
+    session = types.SimpleNamespace(failures=0)
+    for failures in range(10):
+        delay = min(connection_manager.RECONNECT_BACKOFF_MAX, connection_manager.RECONNECT_BACKOFF_BASE * 2 ** failures)
+        assert delay / 2 <= manager.get_backoff(session) <= delay
+    assert session.failures == 10
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_failed_command_cancels_its_result(monkeypatch):
+    transport, server = await start_fake_server()
+    configure_server(monkeypatch, 'test', server.port)
+    service = rcon_service.RconService('test')
+    await service.start()
+
+    async def broken_command(command_message):
+        raise RuntimeError('broken')
+
+    try:
+        assert await run_commands(service, ['', '   ']) == ['invalid command', 'invalid command']
+        monkeypatch.setattr(service, 'handle_command', broken_command)
+        message = rcon_service.Command('test', 'players')
+        await service.send_message(message)
+        with pytest.raises(asyncio.CancelledError):
+            await message.result
+        assert not service.dispatched
+    finally:
+        await service.stop()
+        transport.close()
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_start_does_not_wait_forever_for_a_server_that_is_down(monkeypatch, fast_reconnect):
+    monkeypatch.setattr(rcon_service, 'START_LOGIN_WAIT', 0.2)
+    transport, server = await start_fake_server(password='other')
+    configure_server(monkeypatch, 'test', server.port, rcon_command_timeout=2)
+    service = rcon_service.RconService('test')
+    try:
+        await asyncio.wait_for(service.start(), 1)
+        assert not service.rcon_protocol.logged_in
+        command = rcon_service.Command('test', 'say -1 hello')
+        await service.send_message(command)
+        server.password = 'password'
+        assert await command.result == 'reply to say -1 hello'
+    finally:
+        await service.stop()
+        transport.close()
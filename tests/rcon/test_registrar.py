@@ -0,0 +1,172 @@
+import asyncio
+
+import pytest
+
+from carim_discord_bot.rcon import protocol, registrar
+
+
+def split_packets(seq, text, fragment_size):
+    raw = text.encode('utf-8')
+    fragments = [raw[i:i + fragment_size] for i in range(0, len(raw), fragment_size)]
+    return [protocol.Packet.parse(protocol.Packet(protocol.SplitCommand(seq, f, len(fragments), i)).generate())
+            for i, f in enumerate(fragments)]
+
+
+@pytest.mark.asyncio
+async def test_out_of_order_and_duplicate_fragments():
+    rcon_registrar = registrar.Registrar('test')
+    future = asyncio.get_running_loop().create_future()
+    await rcon_registrar.register(1, future)
+    text = 'GUID Bans:\n' + '\n'.join(f'{i} кто {i:032x}' for i in range(50))
+    packets = split_packets(1, text, 100)
+    for packet in reversed(packets):
+        await rcon_registrar.incoming(1, packet)
+        await rcon_registrar.incoming(1, packet)
+    assert future.result().payload.data == text
+    assert rcon_registrar.splits == {}
+
+
+@pytest.mark.asyncio
+async def test_reply_for_unknown_key_is_ignored():
+    rcon_registrar = registrar.Registrar('test')
+    await rcon_registrar.incoming(9, protocol.Packet(protocol.Command(9, data='late reply')))
+    for packet in split_packets(9, 'late split reply', 4):
+        await rcon_registrar.incoming(9, packet)
+    assert rcon_registrar.splits == {}
+
+
+@pytest.mark.asyncio
+async def test_incomplete_split_expires(monkeypatch):
+    rcon_registrar = registrar.Registrar('test')
+    for key in (1, 2):
+        await rcon_registrar.register(key, asyncio.get_running_loop().create_future())
+    await rcon_registrar.incoming(1, split_packets(1, 'first fragment only', 5)[0])
+    assert 1 in rcon_registrar.splits
+
+    monkeypatch.setattr(registrar, 'REASSEMBLY_TIMEOUT', 0)
+    await asyncio.sleep(0.01)
+    await rcon_registrar.incoming(2, split_packets(2, 'another', 5)[0])
+    assert 1 not in rcon_registrar.splits
+    assert 2 in rcon_registrar.splits
+
+
+@pytest.mark.asyncio
+async def test_stream_yields_fragments_in_order():
+    rcon_registrar = registrar.Registrar('test')
+    future = asyncio.get_running_loop().create_future()
+    stream = registrar.FragmentStream()
+    await rcon_registrar.register(3, future, stream=stream)
+    text = '\n'.join(f'{i} кто на кумырне' for i in range(20))
+    packets = split_packets(3, text, 7)
+
+    # the second fragment can't be streamed until the first one arrives
+    await rcon_registrar.incoming(3, packets[1])
+    assert stream.queue.empty()
+    await rcon_registrar.incoming(3, packets[0])
+    assert stream.queue.qsize() == 2
+    for packet in packets[2:]:
+        await rcon_registrar.incoming(3, packet)
+
+    received = list()
+    async for lines in stream.lines():
+        received += lines
+    assert received == text.split('\n')
+    assert future.done()
+
+
+@pytest.mark.asyncio
+async def test_timeout_only_cancels_its_own_command():
+    rcon_registrar = registrar.Registrar('test')
+    slow = asyncio.get_running_loop().create_future()
+    other = asyncio.get_running_loop().create_future()
+    slow_key = await rcon_registrar.get_next_sequence_number()
+    other_key = await rcon_registrar.get_next_sequence_number()
+    await rcon_registrar.register(slow_key, slow, timeout=0.05)
+    await rcon_registrar.register(other_key, other, timeout=5)
+    tasks_before = len(asyncio.all_tasks())
+
+    await asyncio.sleep(0.1)
+    assert slow.cancelled()
+    assert not other.done()
+    assert len(asyncio.all_tasks()) == tasks_before
+
+    # the sequence counter keeps going and skips the number that just timed out
+    assert await rcon_registrar.get_next_sequence_number() == 2
+    await rcon_registrar.incoming(other_key, protocol.Packet(protocol.Command(other_key, data='reply')))
+    assert other.result().payload.data == 'reply'
+
+
+@pytest.mark.asyncio
+async def test_late_reply_is_not_delivered_to_a_newer_command():
+    rcon_registrar = registrar.Registrar('test')
+    first = asyncio.get_running_loop().create_future()
+    await rcon_registrar.register(0, first, timeout=0.01)
+    await asyncio.sleep(0.05)
+    assert first.cancelled()
+
+    keys = [await rcon_registrar.get_next_sequence_number() for _ in range(255)]
+    assert 0 not in keys
+    await rcon_registrar.incoming(0, protocol.Packet(protocol.Command(0, data='late reply')))
+
+
+@pytest.mark.asyncio
+async def test_retransmit_on_timeout():
+    rcon_registrar = registrar.Registrar('test')
+    sent = list()
+    rcon_registrar.send_datagram = sent.append
+    future = asyncio.get_running_loop().create_future()
+    data = protocol.Packet(protocol.Command(4, command='players')).generate()
+    await rcon_registrar.register(4, future, timeout=0.3, data=data, retries=2)
+
+    await asyncio.sleep(0.15)
+    assert sent == [data]
+    await rcon_registrar.incoming(4, protocol.Packet(protocol.Command(4, data='players reply')))
+    assert future.result().payload.data == 'players reply'
+    # the first copy may still be answered, so the number is held back for a while
+    assert 4 in rcon_registrar.stale
+
+
+@pytest.mark.asyncio
+async def test_retransmits_run_out():
+    rcon_registrar = registrar.Registrar('test')
+    sent = list()
+    rcon_registrar.send_datagram = sent.append
+    future = asyncio.get_running_loop().create_future()
+    await rcon_registrar.register(4, future, timeout=0.09, data=b'command', retries=2)
+    await asyncio.sleep(0.15)
+    assert sent == [b'command', b'command']
+    assert future.cancelled()
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_waits_for_a_free_sequence_number():
+    rcon_registrar = registrar.Registrar('test')
+    futures = dict()
+    for _ in range(0x100):
+        key = await rcon_registrar.get_next_sequence_number()
+        futures[key] = asyncio.get_running_loop().create_future()
+        await rcon_registrar.register(key, futures[key])
+    waiting = asyncio.create_task(rcon_registrar.get_next_sequence_number())
+    await asyncio.sleep(0.05)
+    assert not waiting.done()
+    await rcon_registrar.incoming(7, protocol.Packet(protocol.Command(7, data='reply')))
+    assert await waiting == 7
+    assert not any(f.done() for key, f in futures.items() if key != 7)
+    await rcon_registrar.reset()
+
+
+@pytest.mark.asyncio
+async def test_abandoned_and_unretried_commands_are_not_sent_again():
+    rcon_registrar = registrar.Registrar('test')
+    sent = list()
+    rcon_registrar.send_datagram = sent.append
+    abandoned = asyncio.get_running_loop().create_future()
+    await rcon_registrar.register(4, abandoned, timeout=0.09, data=b'players', retries=2)
+    abandoned.cancel()
+    say = asyncio.get_running_loop().create_future()
+    await rcon_registrar.register(5, say, timeout=0.03, data=b'say -1 hello')
+    await asyncio.sleep(0.1)
+    assert sent == []
+    assert say.cancelled()
+    assert not rcon_registrar.requests
@@ -0,0 +1,52 @@
+import asyncio
+import struct
+
+from carim_discord_bot.steam import query
+
+
+def build_info_response(name='test server', players=10, max_players=60, keywords='battleye,lqs0,etm4.0,12:34',
+                        port=2302, game_id=221100):
+    return b''.join([
+        struct.pack(query.RESPONSE_HEADER_FORMAT, query.SIMPLE_RESPONSE_HEADER, query.S2A_INFO, 17),
+        name.encode() + b'\x00',
+        b'chernarusplus\x00',
+        b'dayz\x00',
+        b'DayZ\x00',
+        struct.pack(query.RESPONSE_DATA_FORMAT, 0, players, max_players, 0, ord('d'), ord('w'), 0, 1),
+        b'1.10.153598\x00',
+        struct.pack('=B', 0x80 | 0x20 | 0x01),
+        struct.pack('=H', port),
+        keywords.encode() + b'\x00',
+        struct.pack('=Q', game_id),
+    ])
+
+
+class FakeA2SServer(asyncio.DatagramProtocol):
+    def __init__(self, response, challenge=None, delay=0, silent=False):
+        self.response = response
+        self.silent = silent
+        self.challenge = challenge
+        self.delay = delay
+        self.queries = list()
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.queries.append(data)
+        if self.silent or not data.startswith(query.QUERY):
+            return
+        if self.challenge is not None and data[len(query.QUERY):] != self.challenge:
+            reply = struct.pack(query.QUERY_HEADER_FORMAT, query.SIMPLE_RESPONSE_HEADER,
+                                query.S2C_CHALLENGE) + self.challenge
+        else:
+            reply = self.response
+        asyncio.get_event_loop().call_later(self.delay, self.transport.sendto, reply, addr)
+
+
+async def start_fake_server(response=None, **kwargs):
+    if response is None:
+        response = build_info_response()
+    return await asyncio.get_event_loop().create_datagram_endpoint(
+        lambda: FakeA2SServer(response, **kwargs), local_addr=('127.0.0.1', 0))
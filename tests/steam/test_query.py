@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from carim_discord_bot.steam import query
+from tests.steam.fake_a2s import start_fake_server, build_info_response
+
+
+def get_port(transport):
+    return transport.get_extra_info('sockname')[1]
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_query():
+    transport, server = await start_fake_server()
+    engine = query.QueryEngine()
+    result = await engine.query('127.0.0.1', get_port(transport))
+    assert 10 == result.players
+    assert 60 == result.max_players
+    assert '0' == result.get_queue()
+    assert '12:34' == result.get_time()
+    assert 1 == len(server.queries)
+    engine.close()
+    transport.close()
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_query_challenge():
+    transport, server = await start_fake_server(challenge=b'\x01\x02\x03\x04')
+    engine = query.QueryEngine()
+    result = await engine.query('127.0.0.1', get_port(transport))
+    assert 10 == result.players
+    assert [query.QUERY, query.QUERY + b'\x01\x02\x03\x04'] == server.queries
+    engine.close()
+    transport.close()
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_query_all_concurrent_on_one_socket():
+    servers = [await start_fake_server(build_info_response(players=i), delay=0.2) for i in range(5)]
+    unreachable, _ = await start_fake_server(silent=True)
+    addresses = {f'server {i}': ('127.0.0.1', get_port(t)) for i, (t, _) in enumerate(servers)}
+    addresses['unreachable'] = ('127.0.0.1', get_port(unreachable))
+    engine = query.QueryEngine()
+    start = asyncio.get_event_loop().time()
+    results = await engine.query_all(addresses, timeout=0.5)
+    elapsed = asyncio.get_event_loop().time() - start
+    assert [i for i in range(5)] == [results[f'server {i}'].players for i in range(5)]
+    assert results['unreachable'] is None
+    assert elapsed < 0.8
+    assert not engine.protocol.pending
+    engine.close()
+    for t, _ in servers:
+        t.close()
+    unreachable.close()
+
+
+def test_unpack_keywords():
+    result = query.unpack_steam_response(build_info_response(keywords='battleye,no3rd,lqs12,etm4.0,entm12.0,07:45'))
+    assert 'test server' == result.name
+    assert 2302 == result.port
+    assert 221100 == result.game_id
+    assert '12' == result.queue
+    assert '07:45' == result.time
+    assert 6 == len(result.keywords)
+
+
+def test_diff():
+    first = query.unpack_steam_response(build_info_response(players=10))
+    same = query.unpack_steam_response(build_info_response(players=10))
+    later = query.unpack_steam_response(build_info_response(players=11, keywords='battleye,lqs0,etm4.0,12:35'))
+    assert set(query.SteamData.__slots__) == first.diff(None)
+    assert set() == same.diff(first)
+    assert {'players', 'time', 'keywords'} == later.diff(first)
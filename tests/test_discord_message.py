@@ -14,3 +14,25 @@ def test_build_fields(fields, expected_messages, expected_fields):
     print(json.dumps(messages, indent=2))
     assert expected_messages == len(messages)
     assert expected_fields == sum(len(m) for m in messages)
+
+
+@pytest.mark.parametrize('formatted', [False, True])
+@pytest.mark.parametrize('lines', [
+    ['short line'] * 5000,
+    [f'line {i} ' * (i % 300) for i in range(2000)],
+])
+def test_build_fields_limits(formatted, lines):
+    messages = discord_service.build_fields('test', lines, formatted=formatted)
+    for fields in messages:
+        assert len(fields) <= discord_service.EMBED_FIELD_LIMIT
+        assert sum(discord_service.get_field_length(f) for f in fields) <= discord_service.EMBED_TOTAL_LIMIT
+        for field in fields:
+            assert len(field['value']) <= discord_service.EMBED_VALUE_LIMIT
+    values = [f['value'] for fields in messages for f in fields]
+    if formatted:
+        values = [v[len('```\n'):-len('```')] for v in values]
+    assert ''.join(values).split() == ' '.join(lines).split()
+
+
+def test_build_fields_empty():
+    assert [] == discord_service.build_fields('test', [''])
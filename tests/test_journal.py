@@ -0,0 +1,169 @@
+import asyncio
+import os
+
+import pytest
+
+from carim_discord_bot import config
+from carim_discord_bot.rcon import events
+from carim_discord_bot.services import journal
+from tests.rcon.corpus import MESSAGES
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000
+
+    def __call__(self):
+        return self.now
+
+
+def build_records(clock, server_name, messages):
+    records = list()
+    for message in messages:
+        clock.now += 1
+        records.append(journal.build_record(clock.now, server_name, events.classify(message)))
+    return records
+
+
+@pytest.fixture
+def store(tmp_path):
+    clock = Clock()
+    store = journal.JournalStore(str(tmp_path), segment_size=1000, clock=clock)
+    store.open()
+    yield store
+    store.close()
+
+
+def test_closed_segments_are_compressed(store):
+    for _ in range(5):
+        store.write(build_records(store.clock, 'alpha', MESSAGES))
+    files = os.listdir(store.path)
+    assert sum(f.endswith(journal.COMPRESSED_SUFFIX) for f in files) == 4
+    assert [f for f in files if f.endswith(journal.SEGMENT_SUFFIX)] == [store.segment + journal.SEGMENT_SUFFIX]
+    records = store.query(limit=1000)
+    assert [r['m'] for r in records] == MESSAGES * 5
+    assert records[3] == dict(t=1004, s='alpha', e='chat', m='(Global) Survivor: hello everybody', n='Survivor')
+
+
+def test_queries_only_read_segments_that_can_match(store, monkeypatch):
+    store.write(build_records(store.clock, 'alpha', ['Verified GUID (0123) of player #0 Survivor']))
+    store.rotate()
+    store.write(build_records(store.clock, 'beta', ['Verified GUID (4567) of player #0 Survivor']))
+    store.rotate()
+    store.write(build_records(store.clock, 'alpha', ['Verified GUID (89ab) of player #1 Somebody Else']))
+    read = list()
+    original_read = store.read
+
+    def tracking_read(segment):
+        read.append(segment)
+        return original_read(segment)
+
+    monkeypatch.setattr(store, 'read', tracking_read)
+    assert [r['t'] for r in store.query('alpha', name='survivor')] == [1001]
+    assert len(read) == 1
+    read.clear()
+    assert [r['s'] for r in store.query(start=1002, end=1002)] == ['beta']
+    assert len(read) == 1
+    read.clear()
+    assert store.query('beta', name='Somebody Else') == []
+    assert read == []
+
+
+def test_query_returns_the_latest_matches(store):
+    store.write(build_records(store.clock, 'alpha', MESSAGES))
+    records = store.query('alpha', name='Player With Spaces', limit=2)
+    assert [r['e'] for r in records] == ['kick', 'disconnect']
+
+
+def test_reopening_closes_the_segment_left_open(tmp_path):
+    clock = Clock()
+    store = journal.JournalStore(str(tmp_path), clock=clock)
+    store.open()
+    store.write(build_records(clock, 'alpha', MESSAGES))
+    store.close()
+
+    store = journal.JournalStore(str(tmp_path), clock=clock)
+    store.open()
+    try:
+        assert not any(f.endswith(journal.SEGMENT_SUFFIX) for f in os.listdir(tmp_path))
+        assert len(store.query('alpha', name='Survivor')) == 7
+    finally:
+        store.close()
+
+
+def test_segments_past_the_retention_are_deleted(tmp_path):
+    clock = Clock()
+    store = journal.JournalStore(str(tmp_path), retention=100, clock=clock)
+    store.open()
+    try:
+        store.write(build_records(clock, 'alpha', ['Verified GUID (0123) of player #0 Survivor']))
+        expired = store.segment
+        clock.now += 200
+        store.rotate()
+        store.write(build_records(clock, 'alpha', ['Verified GUID (4567) of player #1 Somebody Else']))
+        assert not os.path.exists(store.get_file_name(expired, journal.COMPRESSED_SUFFIX))
+        assert store.query('alpha', name='Survivor') == []
+        assert [r['n'] for r in store.query('alpha')] == ['Somebody Else']
+    finally:
+        store.close()
+
+
+def test_parse_window():
+    assert journal.parse_window('90s') == 90
+    assert journal.parse_window('2h') == 7200
+    assert journal.parse_window('1d') == 86400
+    assert journal.parse_window('Survivor') is None
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_events_are_batched_and_queryable(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, '_global_config', config._build_from_dict({'journal_path': str(tmp_path)},
+                                                                          config.GlobalConfig))
+    monkeypatch.setattr(journal, 'FLUSH_INTERVAL', 0.05)
+    service = journal.Journal()
+    service.record('alpha', [events.classify(m) for m in MESSAGES])
+    assert service.pending == []
+
+    await service.start()
+    try:
+        # only the message processor runs, the flush is timed from the first record
+        assert len(service.tasks) == 1
+        service.record('alpha', [events.classify(m) for m in MESSAGES])
+        assert len(service.pending) == len(MESSAGES)
+        await asyncio.sleep(0.2)
+        assert service.pending == []
+        assert service.flush_handle is None
+        service.record('alpha', [events.classify(m) for m in MESSAGES])
+        service.record('beta', [events.classify(m) for m in MESSAGES])
+        assert len(service.pending) == 2 * len(MESSAGES)
+        query = journal.Query('beta', name='Survivor')
+        await service.send_message(query)
+        records = await query.result
+        assert service.pending == []
+        assert len(records) == 7
+        assert {r['s'] for r in records} == {'beta'}
+    finally:
+        await service.stop()
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_unusable_journal_is_disabled(tmp_path, monkeypatch):
+    path = tmp_path / 'journal'
+    path.write_text('not a directory')
+    monkeypatch.setattr(config, '_global_config', config._build_from_dict({'journal_path': str(path)},
+                                                                          config.GlobalConfig))
+    service = journal.Journal()
+    await service.start()
+    try:
+        service.record('alpha', [events.classify(m) for m in MESSAGES])
+        assert service.pending == []
+        query = journal.Query('alpha')
+        await service.send_message(query)
+        with pytest.raises(asyncio.CancelledError):
+            await query.result
+    finally:
+        await service.stop()
+        await asyncio.sleep(0.01)
@@ -0,0 +1,103 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+from carim_discord_bot import config, managed_service, metrics
+from carim_discord_bot.services import metrics_server
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = metrics.Registry()
+    monkeypatch.setattr(metrics, '_registry', registry)
+    return registry
+
+
+class Ping(managed_service.Message):
+    pass
+
+
+class EchoService(managed_service.ManagedService):
+    def __init__(self):
+        super().__init__()
+        self.server_name = 'alpha'
+
+    async def handle_message(self, message):
+        await asyncio.sleep(0.01)
+        message.result.set_result('pong')
+
+
+def test_histogram_quantiles():
+    histogram = metrics.Histogram(buckets=(0.01, 0.1, 1))
+    for value in [0.005] * 90 + [0.05] * 9 + [5]:
+        histogram.observe(value)
+    assert histogram.count == 100
+    assert histogram.quantile(0.5) == 0.01
+    assert histogram.quantile(0.99) == 0.1
+    assert histogram.quantile(1) == float('inf')
+
+
+def test_prometheus_format(registry):
+    registry.inc('carim_rcon_timeouts_total', (('server', 'a "quoted" name'), ('kind', 'command')))
+    registry.observe('carim_discord_send_seconds', 0.2)
+    registry.observe('carim_discord_send_seconds', 3)
+    text = registry.format_prometheus()
+    assert '# TYPE carim_rcon_timeouts_total counter\n' in text
+    assert 'carim_rcon_timeouts_total{server="a \\"quoted\\" name",kind="command"} 1\n' in text
+    assert '# TYPE carim_discord_send_seconds histogram\n' in text
+    assert 'carim_discord_send_seconds_bucket{le="0.1"} 0\n' in text
+    assert 'carim_discord_send_seconds_bucket{le="0.25"} 1\n' in text
+    assert 'carim_discord_send_seconds_bucket{le="+Inf"} 2\n' in text
+    assert 'carim_discord_send_seconds_sum 3.2\n' in text
+    assert 'carim_discord_send_seconds_count 2\n' in text
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_services_record_handling_queue_and_restarts(registry):
+    service = EchoService()
+    messages = [Ping('alpha') for _ in range(3)]
+    for message in messages:
+        await service.send_message(message)
+    labels = (('service', 'EchoService'), ('server', 'alpha'))
+    samples = registry.collect_samples()
+    assert samples['carim_service_queue_depth'][labels] == 3
+
+    await service.start()
+    await asyncio.gather(*(message.result for message in messages))
+    histogram = registry.histograms['carim_message_handling_seconds'][labels + (('message', 'Ping'),)]
+    assert histogram.count == 3
+    assert histogram.sum >= 0.03
+    assert registry.collect_samples()['carim_service_tasks'][labels] == 1
+
+    await service.restart()
+    assert registry.counters['carim_service_restarts_total'][labels] == 1
+    summary = registry.format_summary()
+    assert 'service_restarts_total{service="EchoService",server="alpha"} 1' in summary
+    assert 'message_handling_seconds{service="EchoService",server="alpha",message="Ping"} n=3' in summary
+    await service.stop()
+    await asyncio.sleep(0.01)
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_metrics_endpoint(registry, monkeypatch):
+    monkeypatch.setattr(config, '_global_config', config._build_from_dict({'metrics_port': 0}, config.GlobalConfig))
+    registry.inc('carim_service_restarts_total', (('service', 'RconService'), ('server', 'alpha')))
+    server = metrics_server.MetricsServer()
+    await server.start()
+    try:
+        while server.runner is None or not server.runner.addresses:
+            await asyncio.sleep(0.01)
+        host, port = server.runner.addresses[0][:2]
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f'http://{host}:{port}/metrics') as response:
+                assert response.status == 200
+                assert response.headers['Content-Type'] == metrics_server.CONTENT_TYPE
+                text = await response.text()
+    finally:
+        await server.stop()
+        await asyncio.sleep(0.01)
+    assert 'carim_service_restarts_total{service="RconService",server="alpha"} 1' in text
+    assert 'carim_service_tasks{service="MetricsServer",server=""} 2' in text
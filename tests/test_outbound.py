@@ -0,0 +1,136 @@
+import asyncio
+
+import pytest
+
+from carim_discord_bot import managed_service
+from carim_discord_bot.discord_client import discord_service, outbound
+
+
+class FakeChannels:
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.sent = list()
+
+    async def send(self, channel_id, **kwargs):
+        await asyncio.sleep(self.delay)
+        self.sent.append((channel_id, kwargs, asyncio.get_event_loop().time()))
+
+
+def render_logs(pending_logs):
+    return [{'lines': [line for lines in pending_logs.values() for line in lines]}]
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_logs_coalesced_until_deadline():
+    channels = FakeChannels()
+    scheduler = outbound.OutboundScheduler(channels.send, render_logs, flush_delay=0.1)
+    for i in range(50):
+        await scheduler.add_log(1, 'test', [f'line {i}'])
+    await asyncio.sleep(0.05)
+    assert not channels.sent
+    await asyncio.sleep(0.1)
+    assert 1 == len(channels.sent)
+    assert 50 == len(channels.sent[0][1]['lines'])
+    scheduler.close()
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_logs_flushed_on_size():
+    channels = FakeChannels()
+    scheduler = outbound.OutboundScheduler(channels.send, render_logs, flush_delay=10)
+    await scheduler.add_log(1, 'test', ['a' * outbound.FLUSH_SIZE])
+    await asyncio.sleep(0.05)
+    assert 1 == len(channels.sent)
+    scheduler.close()
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_channel_rate_limited():
+    channels = FakeChannels()
+    scheduler = outbound.OutboundScheduler(channels.send, render_logs, flush_delay=0.1, rate=10, burst=2)
+    start = asyncio.get_event_loop().time()
+    for i in range(4):
+        await scheduler.send_message(1, content=i)
+    await asyncio.sleep(0.3)
+    times = [t - start for _, _, t in channels.sent]
+    assert [0, 1, 2, 3] == [kwargs['content'] for _, kwargs, _ in channels.sent]
+    assert times[1] < 0.05
+    assert times[3] >= 0.19
+    scheduler.close()
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_channels_sent_concurrently():
+    channels = FakeChannels(delay=0.2)
+    scheduler = outbound.OutboundScheduler(channels.send, render_logs, flush_delay=0.1)
+    start = asyncio.get_event_loop().time()
+    for channel_id in range(5):
+        await scheduler.send_message(channel_id, content='test')
+    await asyncio.sleep(0.3)
+    assert 5 == len(channels.sent)
+    assert all(t - start < 0.3 for _, _, t in channels.sent)
+    scheduler.close()
+
+
+def test_pack_embeds():
+    server_fields = [('a', {'name': 'a', 'value': 'x' * 999})] * 7 + [('b', {'name': 'b', 'value': 'x'})] * 30
+    embeds = discord_service.pack_embeds(server_fields)
+    assert 37 == sum(len(e['fields']) for e in embeds)
+    for embed in embeds:
+        assert len(embed['fields']) <= discord_service.EMBED_FIELD_LIMIT
+        assert sum(discord_service.get_field_length(f) for f in embed['fields']) <= discord_service.EMBED_TOTAL_LIMIT
+    assert discord_service.get_server_color('a') == embeds[0]['color']
+    assert 3 == len(embeds)
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+@pytest.mark.parametrize('policy,expected', [
+    (managed_service.OVERFLOW_DROP_OLDEST, ['line 7', 'line 8', 'line 9']),
+    (managed_service.OVERFLOW_SUMMARIZE, ['7 lines suppressed', 'line 7', 'line 8', 'line 9']),
+])
+async def test_log_buffer_bounded(policy, expected):
+    channels = FakeChannels()
+    scheduler = outbound.OutboundScheduler(channels.send, render_logs, flush_delay=0.05, buffer_lines=3,
+                                           overflow_policy=policy)
+    for i in range(10):
+        await scheduler.add_log(1, 'test', [f'line {i}'])
+    await asyncio.sleep(0.1)
+    assert expected == channels.sent[0][1]['lines']
+    assert 7 == scheduler.dropped_lines['test']
+    scheduler.close()
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_log_buffer_backpressure():
+    channels = FakeChannels()
+    scheduler = outbound.OutboundScheduler(channels.send, render_logs, flush_delay=10, buffer_lines=3,
+                                           overflow_policy=managed_service.OVERFLOW_BACKPRESSURE)
+    for i in range(10):
+        await scheduler.add_log(1, 'test', [f'line {i}'])
+    scheduler.get_outbox(1).flush()
+    await asyncio.sleep(0.05)
+    assert [f'line {i}' for i in range(10)] == [line for _, kwargs, _ in channels.sent for line in kwargs['lines']]
+    assert 0 == sum(scheduler.dropped_lines.values())
+    scheduler.close()
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_channel_queue_bounded():
+    channels = FakeChannels()
+    scheduler = outbound.OutboundScheduler(channels.send, render_logs, flush_delay=0.1, rate=0.001, burst=1,
+                                           queue_size=2, overflow_policy=managed_service.OVERFLOW_DROP_OLDEST)
+    for i in range(5):
+        await scheduler.send_message(1, content=i)
+    await asyncio.sleep(0.05)
+    assert [3] == [kwargs['content'] for _, kwargs, _ in channels.sent]
+    assert [4] == [job['content'] for job in scheduler.get_outbox(1).jobs]
+    assert 3 == scheduler.dropped_messages[1]
+    scheduler.close()
+    await asyncio.sleep(0)
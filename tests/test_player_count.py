@@ -0,0 +1,142 @@
+import asyncio
+import collections
+
+import pytest
+
+from carim_discord_bot import config
+from carim_discord_bot.discord_client import discord_service
+from carim_discord_bot.rcon import player_sessions, players
+from carim_discord_bot.services import player_count
+from carim_discord_bot.steam import query, steam_service
+from tests.steam.fake_a2s import build_info_response
+
+
+class FakeSteamService:
+    def __init__(self):
+        self.responses = list()
+
+    async def send_message(self, message):
+        response = self.responses.pop(0)
+        if response == 'cancel':
+            message.result.cancel()
+        elif response is not None:
+            message.result.set_result({name: query.unpack_steam_response(response) for name in message.server_names})
+
+
+class FakeDiscordService:
+    def __init__(self):
+        self.messages = list()
+        self.player_count_renames = collections.Counter()
+        self.rename_delay = 0
+
+    def get_player_count_rename_delay(self, server_name):
+        return self.rename_delay
+
+    async def send_message(self, message):
+        self.messages.append(message)
+
+
+@pytest.fixture
+def services(monkeypatch):
+    monkeypatch.setattr(config, '_server_configs', {
+        'test': config._build_from_dict({'name': 'test', 'player_count_channel_id': 1}, config.ServerConfig)
+    })
+    steam = FakeSteamService()
+    discord = FakeDiscordService()
+    monkeypatch.setattr(steam_service, 'get_service_manager', lambda: steam)
+    monkeypatch.setattr(discord_service, 'get_service_manager', lambda: discord)
+    monkeypatch.setattr(player_sessions, 'rosters', dict())
+    return steam, discord
+
+
+def test_watched_fields(services):
+    assert {'players', 'max_players'} == player_count.get_watched_fields('test')
+    config.get_server('test').player_count_queue_format = ' ({queue} in queue)'
+    assert {'players', 'max_players', 'queue'} == player_count.get_watched_fields('test')
+
+
+@pytest.mark.asyncio
+async def test_unchanged_counts_not_sent(services):
+    steam, discord = services
+    steam.responses = [
+        build_info_response(players=10),
+        build_info_response(players=10, keywords='battleye,lqs0,etm4.0,12:35'),
+        build_info_response(players=11, keywords='battleye,lqs0,etm4.0,12:36'),
+    ]
+    service = player_count.PlayerCountService()
+    for _ in range(3):
+        await service.update_player_counts(['test'])
+    assert [10, 11] == [m.players for m in discord.messages]
+
+
+def test_poll_schedule():
+    schedule = player_count.PollSchedule(30)
+    schedule.record(reachable=True, changed=True)
+    assert 30 == schedule.next_delay(0)
+    assert 300 - player_count.RENAME_LEAD == schedule.next_delay(300)
+    for _ in range(8):
+        schedule.record(reachable=True)
+    assert 120 == schedule.next_delay(0)
+    schedule.record(reachable=True, changed=True)
+    assert 30 == schedule.next_delay(0)
+    for _ in range(10):
+        schedule.record(reachable=False)
+    assert 30 * player_count.UNREACHABLE_BACKOFF_MAX == schedule.next_delay(0)
+    assert (20, 10, 2) == (schedule.queries, schedule.failures, schedule.changes)
+
+
+@pytest.mark.asyncio
+async def test_stats(services):
+    steam, discord = services
+    steam.responses = [build_info_response(players=10)]
+    discord.rename_delay = 200
+    service = player_count.PlayerCountService()
+    await service.update_player_counts(['test'])
+    stats = service.get_stats()['test']
+    assert 1 == stats['queries']
+    assert 200 - player_count.RENAME_LEAD == stats['interval']
+
+
+@pytest.mark.asyncio
+async def test_synced_roster_counts_without_steam(services):
+    steam, discord = services
+    steam.responses = [build_info_response(players=2)]
+    roster = player_sessions.get_roster('test')
+    roster.begin_seed()
+    roster.seed([players.Player(n, '127.0.0.1', 2304, 0, f'{n:032x}', True, f'Survivor{n}', False) for n in range(2)])
+    service = player_count.PlayerCountService()
+    # the slots only come from steam, so it is asked once
+    await service.update_player_counts(['test'])
+    roster.leave(0)
+    await service.update_player_counts(['test'])
+    await service.update_player_counts(['test'])
+    assert [(2, 60), (1, 60)] == [(m.players, m.slots) for m in discord.messages]
+    stats = service.get_stats()['test']
+    assert (1, 2) == (stats['queries'], stats['local'])
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_lost_steam_queries_skip_the_cycle(services, monkeypatch):
+    monkeypatch.setattr(player_count, 'STEAM_QUERY_TIMEOUT', 0.05)
+    steam, discord = services
+    # a query that is never answered, one that is dropped, and then an answer
+    steam.responses = [None, 'cancel', build_info_response(players=10)]
+    service = player_count.PlayerCountService()
+    for _ in range(3):
+        await service.update_player_counts(['test'])
+    assert [10] == [m.players for m in discord.messages]
+    assert 2 == service.get_stats()['test']['failures']
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_stopping_during_a_steam_query_still_cancels(services):
+    steam, discord = services
+    steam.responses = [None]
+    service = player_count.PlayerCountService()
+    update = asyncio.create_task(service.update_player_counts(['test']))
+    await asyncio.sleep(0.01)
+    update.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await update
@@ -0,0 +1,55 @@
+import pytest
+
+from carim_discord_bot import config, message_builder, routing
+
+
+def build_servers(*servers):
+    return [config._build_from_dict(server, config.ServerConfig) for server in servers]
+
+
+def build_custom_commands(*commands):
+    return [message_builder.Response(dict(response={}, **command)) for command in commands]
+
+
+def test_routes():
+    servers = build_servers(
+        {'name': 'a', 'rcon_password': 'x', 'chat_channel_id': 1, 'admin_channel_id': 2},
+        {'name': 'b', 'rcon_password': 'x', 'chat_channel_id': 3, 'admin_channel_id': 2},
+        {'name': 'c', 'chat_channel_id': 4, 'admin_channel_id': 5},
+    )
+    custom_commands = build_custom_commands(
+        {'command': '--rules', 'channels': [6]},
+        {'command': '--disabled', 'enabled': False},
+    )
+    table = routing.RoutingTable(servers, [6], custom_commands)
+    assert ['a'] == table.get(1).chat_servers
+    assert ['a', 'b'] == table.get(2).admin_servers
+    assert table.get(4) is None
+    assert table.get(5) is None
+    assert table.get(6).user
+    assert [custom_commands[0]] == table.get(6).custom_commands.match('--rules')
+    assert table.get(2).custom_commands is None
+    assert table.get(999) is None
+
+
+@pytest.mark.parametrize('count', [1, routing.MERGE_THRESHOLD, 20])
+def test_custom_commands_everywhere(count):
+    custom_commands = build_custom_commands(*[{'command': f'--command{i}$'} for i in range(count)])
+    custom_commands += build_custom_commands({'command': '--command'}, {'command': '(--)?grouped'})
+    table = routing.RoutingTable([], [], custom_commands)
+    assert table.get(999).custom_commands.match('hello') == []
+    assert [custom_commands[0], custom_commands[-2]] == table.get(999).custom_commands.match('--command0')
+    assert [custom_commands[-1]] == table.get(999).custom_commands.match('grouped')
+
+
+def test_merged_pattern():
+    custom_commands = build_custom_commands(*[{'command': f'--command{i}'} for i in range(10)])
+    matcher = routing.CustomCommandMatcher(custom_commands)
+    assert matcher.merged is not None
+    assert [custom_commands[1]] == matcher.match('--command1')
+    assert [] == matcher.match('--other')
+    grouped_commands = custom_commands + build_custom_commands({'command': '(a)\\1'})
+    grouped = routing.CustomCommandMatcher(grouped_commands)
+    assert grouped.merged is None
+    assert [grouped_commands[-1]] == grouped.match('aa')
+    assert [custom_commands[9]] == grouped.match('--command9')
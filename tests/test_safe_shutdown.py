@@ -2,37 +2,65 @@ import asyncio
 
 import pytest
 
-# from carim_discord_bot import main
+from carim_discord_bot import config
+from carim_discord_bot.rcon import rcon_service, player_sessions, players
+
+RESPONSE = '''\
+Players on server:
+[#] [IP Address]:[Port] [Ping] [GUID] [Name]
+--------------------------------------------------
+2   127.0.0.1:2304    0    1234abcd1234abcd1234abcd1234abcd(OK) Survivor2
+4   127.0.0.2:2304    32   5678abcd5678abcd5678abcd5678abcd(OK) Survivor4
+(2 players in total)'''
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(config, '_server_configs', {
+        'test': config._build_from_dict({'name': 'test'}, config.ServerConfig)
+    })
+    monkeypatch.setattr(player_sessions, 'rosters', dict())
+    service = rcon_service.RconService('test')
+    service.sent_commands = list()
+    service.players_response = RESPONSE
+
+    async def mock_handle_command(command_message):
+        service.sent_commands.append(command_message.command)
+        if command_message.command == 'players':
+            command_message.result.set_result(service.players_response)
+        else:
+            command_message.result.set_result('')
+
+    monkeypatch.setattr(service, 'handle_command', mock_handle_command)
+    return service
+
+
+@pytest.mark.asyncio
+async def test_kick_everybody(service):
+    await service.kick_everybody('')
+    assert len(service.sent_commands) == 3
+    assert 'kick 2' in service.sent_commands[1]
+    assert 'kick 4' in service.sent_commands[2]
+
+
+@pytest.mark.asyncio
+async def test_kick_sweep_only_kicks_new_players(service):
+    await service.kick_everybody('')
+    service.sent_commands.clear()
+
+    await service.kick_everybody('', only_new=True)
+    assert service.sent_commands == ['players']
+
+    service.sent_commands.clear()
+    service.players_response = RESPONSE.replace(
+        '(2 players', '5   127.0.0.3:2304    0    9999abcd9999abcd9999abcd9999abcd(OK) Survivor5\n(3 players')
+    await service.kick_everybody('', only_new=True)
+    assert service.sent_commands == ['players', 'kick 5 ']
 
 
 @pytest.mark.asyncio
-async def test_kick_everybody(monkeypatch):
-    pass
-#     response = '''\
-# Players on server:
-# [#] [IP Address]:[Port] [Ping] [GUID] [Name]
-# --------------------------------------------------
-# 2 127.0.0.1:2304 0 1234(OK) Survivor2
-# 4 127.0.0.2:2304 32 5678(OK) Survivor4
-# (2 players in total)'''
-#
-#     async def mock_update():
-#         pass
-#
-#     monkeypatch.setattr(main, 'update_player_count', mock_update)
-#
-#     sent_commands = list()
-#
-#     async def mock_send(command):
-#         sent_commands.append(command)
-#         if command == 'players':
-#             future = asyncio.get_running_loop().create_future()
-#             future.set_result(response)
-#             return future
-#
-#     monkeypatch.setattr(main, 'send_command', mock_send)
-#
-#     await main.kick_everybody('')
-#     assert len(sent_commands) == 3
-#     assert 'kick 2' in sent_commands[1]
-#     assert 'kick 4' in sent_commands[2]
+async def test_kick_sweep_uses_the_roster_when_in_sync(service):
+    service.roster.begin_seed()
+    service.roster.seed(players.parse_players(RESPONSE))
+    await service.kick_everybody('', only_new=True)
+    assert service.sent_commands == ['kick 2 ', 'kick 4 ']
@@ -1,53 +1,101 @@
 import asyncio
 import datetime
+import time
 
 import pytest
 
-# from carim_discord_bot import main
+from carim_discord_bot import config
+from carim_discord_bot.services import cron, scheduled_command
 
 
+@pytest.mark.parametrize('expression,after,expected', [
+    ('*/15 * * * *', datetime.datetime(2020, 5, 1, 10, 7, 30), datetime.datetime(2020, 5, 1, 10, 15)),
+    ('0 6,18 * * *', datetime.datetime(2020, 5, 1, 18, 0), datetime.datetime(2020, 5, 2, 6, 0)),
+    ('30 4 1 * *', datetime.datetime(2020, 12, 31, 23, 59), datetime.datetime(2021, 1, 1, 4, 30)),
+    # 2020-05-01 is a Friday, so the next Sunday is the 3rd
+    ('0 12 * * 0', datetime.datetime(2020, 5, 1, 0, 0), datetime.datetime(2020, 5, 3, 12, 0)),
+    ('0 12 * * 7', datetime.datetime(2020, 5, 1, 0, 0), datetime.datetime(2020, 5, 3, 12, 0)),
+    ('0 0 29 2 *', datetime.datetime(2021, 1, 1), datetime.datetime(2024, 2, 29)),
+])
+def test_cron_next(expression, after, expected):
+    assert expected == cron.CronExpression(expression).get_next(after)
+
+
+@pytest.mark.parametrize('expression', ['* * * *', '60 * * * *', '*/0 * * * *', 'a * * * *'])
+def test_cron_invalid(expression):
+    with pytest.raises(ValueError):
+        cron.CronExpression(expression)
+
+
+def test_cron_that_never_matches_is_rejected(monkeypatch):
+    monkeypatch.setattr(config, '_global_config', config._build_from_dict({}, config.GlobalConfig))
+    monkeypatch.setattr(config, '_server_configs', {
+        'test': config._build_from_dict({'name': 'test', 'scheduled_commands': [
+            {'command': 'say -1 never', 'cron': '0 0 31 2 *'}]}, config.ServerConfig)
+    })
+    with pytest.raises(ValueError, match='never matches'):
+        config._validate_config()
+
+
+@pytest.fixture
+def commands(monkeypatch):
+    def configure(*scheduled_commands):
+        monkeypatch.setattr(config, '_server_configs', {
+            'test': config._build_from_dict({'name': 'test', 'scheduled_commands': list(scheduled_commands)},
+                                            config.ServerConfig)
+        })
+    return configure
+
+
+def test_with_clock_alignment(commands):
+    commands({'command': 'test', 'interval': 3600, 'with_clock': True, 'offset': 600})
+    job = scheduled_command.ScheduledCommand('test', 0)
+    now = datetime.datetime(2020, 5, 1, 10, 5).timestamp()
+    assert datetime.datetime(2020, 5, 1, 10, 10).timestamp() == job.get_first_deadline(now)
+    deadline = datetime.datetime(2020, 5, 1, 10, 10).timestamp()
+    assert datetime.datetime(2020, 5, 1, 11, 10).timestamp() == job.get_next_deadline(deadline + 0.5)
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_scheduler_runs_due_jobs_in_order(commands, monkeypatch):
+    commands({'command': 'slow', 'interval': 0.3},
+              {'command': 'fast', 'interval': 0.1, 'offset': 0.05})
+    runs = list()
+
+    async def run(job):
+        runs.append((job.command['command'], time.time()))
+
+    monkeypatch.setattr(scheduled_command.ScheduledCommand, 'run', run)
+    scheduler = scheduled_command.Scheduler()
+    start = time.time()
+    scheduler.add_server('test')
+    await scheduler.start()
+    await asyncio.sleep(0.5)
+    assert 0.05 < scheduler.get_job('test', 0).get_next() <= 0.1
+    await scheduler.stop()
+    await asyncio.sleep(0.01)
+    assert ['fast', 'fast', 'slow', 'fast', 'fast'] == [command for command, _ in runs]
+    assert all(abs(t - start - expected) < 0.05 for (_, t), expected in zip(runs, [0.15, 0.25, 0.3, 0.35, 0.45]))
+
+
+@pytest.mark.timeout(5)
 @pytest.mark.asyncio
-async def test_with_clock_should_send_one_command_per_interval(event_loop: asyncio.BaseEventLoop):
-    pass
-    # sent_commands = []
-    # main.scheduled_commands.append(dict(task=None, command='', next=-1))
-    #
-    # async def mock_send_command(c):
-    #     sent_commands.append(c)
-    #
-    # main.send_command = mock_send_command
-    #
-    # now = datetime.datetime.now()
-    # midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    # day_elapsed = (now - midnight).total_seconds()
-    #
-    # index = 0
-    # command = {
-    #     'command': 'test command',
-    #     'interval': day_elapsed + .1,
-    #     'with_clock': True
-    # }
-    #
-    # task = event_loop.create_task(main.schedule_command_manager(index, command))
-    # await asyncio.sleep(.1)
-    # task.cancel()
-    # try:
-    #     await task
-    # except asyncio.CancelledError:
-    #     pass
-    # assert len(sent_commands) == 1
-
-
-def test_with_clock_offset(monkeypatch):
-    pass
-    # now = datetime.datetime.now()
-    # monkeypatch.setattr(main, 'get_datetime_now', lambda: now)
-    # midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    # day_elapsed = (now - midnight).total_seconds()
-    # assert not main.is_time_aligned(day_elapsed - 5, 0)
-    # assert not main.is_time_aligned(day_elapsed - 4, 0)
-    # assert main.is_time_aligned(day_elapsed + 4, 0)
-    # assert not main.is_time_aligned(day_elapsed + 5, 0)
-    # assert main.get_time_to_next_command(day_elapsed, 0) == day_elapsed
-    # assert not main.is_time_aligned(day_elapsed, 100)
-    # assert main.get_time_to_next_command(day_elapsed, 100) == 100
+async def test_skip(commands, monkeypatch):
+    commands({'command': 'test', 'interval': 0.1})
+    sent = list()
+
+    class FakeService:
+        async def send_message(self, message):
+            sent.append(message)
+
+    monkeypatch.setattr(scheduled_command.discord_service, 'get_service_manager', lambda: FakeService())
+    monkeypatch.setattr(scheduled_command.rcon_service, 'get_service_manager', lambda server_name: FakeService())
+    scheduler = scheduled_command.Scheduler()
+    scheduler.add_server('test')
+    await scheduler.start()
+    await scheduler.send_message(scheduled_command.Skip('test', 0))
+    await asyncio.sleep(0.25)
+    await scheduler.stop()
+    await asyncio.sleep(0.01)
+    assert [scheduled_command.discord_service.Log, scheduled_command.rcon_service.Command] == [type(m) for m in sent]
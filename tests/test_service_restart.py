@@ -3,6 +3,8 @@ import logging
 
 import pytest
 
+from carim_discord_bot import config, managed_service
+from carim_discord_bot.discord_client import client, discord_service
 from carim_discord_bot.rcon import connection, registrar
 
 protocol_counter = 0
@@ -72,3 +74,165 @@ async def test_process_futures_dies(event_loop: asyncio.BaseEventLoop, monkeypat
     #
     # await future2
     # assert future2.result() == service.VALID_COMMANDS
+
+
+class IdleService(managed_service.ManagedService):
+    async def handle_message(self, message: managed_service.Message):
+        pass
+
+
+class CrashingService(managed_service.ManagedService):
+    def __init__(self):
+        super().__init__()
+        self.starts = list()
+
+    async def handle_message(self, message: managed_service.Message):
+        pass
+
+    async def service(self):
+        self.starts.append(asyncio.get_running_loop().time())
+        raise RuntimeError('crash')
+
+
+class TimerCounter:
+    def __init__(self, loop, monkeypatch):
+        self.count = 0
+        self.call_at = loop.call_at
+        monkeypatch.setattr(loop, 'call_at', self)
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+        return self.call_at(*args, **kwargs)
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_idle_services_do_not_wake_up(monkeypatch):
+    services = [IdleService() for _ in range(10)]
+    for s in services:
+        await s.start()
+    timers = TimerCounter(asyncio.get_running_loop(), monkeypatch)
+    await asyncio.sleep(1.1)
+    for s in services:
+        await s.stop()
+    # the only timer is the sleep above; polling status checkers used to add one per service per second
+    assert timers.count == 1
+    assert all(len(s.tasks) == 0 for s in services)
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_crashed_service_restarts_with_backoff(monkeypatch):
+    monkeypatch.setattr(managed_service, 'RESTART_BACKOFF_BASE', 0.05)
+    service = CrashingService()
+    await service.start()
+    while len(service.starts) < 4:
+        await asyncio.sleep(0.01)
+    await service.stop()
+    delays = [b - a for a, b in zip(service.starts, service.starts[1:])]
+    assert delays[0] >= 0.05
+    assert delays[1] >= 0.1
+    assert delays[2] >= 0.2
+
+
+class ReturningService(managed_service.ManagedService):
+    def __init__(self):
+        super().__init__()
+        self.starts = list()
+        self.helpers = 0
+
+    async def handle_message(self, message: managed_service.Message):
+        pass
+
+    async def helper(self):
+        self.helpers += 1
+
+    async def service(self):
+        self.starts.append(asyncio.get_running_loop().time())
+        self.create_task(self.helper())
+        if len(self.starts) > 1:
+            await asyncio.get_running_loop().create_future()
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_finished_tasks_only_restart_the_service_loop(monkeypatch, caplog):
+    monkeypatch.setattr(managed_service, 'RESTART_BACKOFF_BASE', 0.05)
+    service = ReturningService()
+    await service.start()
+    while len(service.starts) < 2:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.2)
+    try:
+        # the service loop returning is a restart, the helper it started finishing is not
+        assert len(service.starts) == 2
+        assert service.helpers == 2
+        assert len(service.tasks) == 2
+        assert 'ReturningService stopped unexpectedly' in caplog.text
+        assert 'crashed' not in caplog.text
+    finally:
+        await service.stop()
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_bounded_queue_drops_oldest():
+    service = IdleService(max_queue_size=3, overflow_policy=managed_service.OVERFLOW_DROP_OLDEST)
+    messages = [managed_service.Message(str(i)) for i in range(5)]
+    for message in messages:
+        await service.send_message(message)
+    assert 3 == service.message_queue.qsize()
+    assert 2 == service.dropped_messages
+    assert messages[0].result.cancelled()
+    assert '2' == service.message_queue.get_nowait().server_name
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_bounded_queue_backpressure():
+    service = IdleService(max_queue_size=1)
+    await service.send_message(managed_service.Message('first'))
+    blocked = asyncio.create_task(service.send_message(managed_service.Message('second')))
+    await asyncio.sleep(0.05)
+    assert not blocked.done()
+    service.message_queue.get_nowait()
+    await asyncio.wait_for(blocked, 1)
+    assert 0 == service.dropped_messages
+
+
+class FakeClient:
+    def __init__(self):
+        self.presences = list()
+        self.closed = asyncio.Event()
+
+    async def login(self, token):
+        pass
+
+    async def connect(self):
+        await self.closed.wait()
+
+    async def wait_until_ready(self):
+        pass
+
+    async def change_presence(self, activity=None):
+        self.presences.append(activity)
+
+    async def close(self):
+        self.closed.set()
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.asyncio
+async def test_setting_the_presence_does_not_restart_discord(monkeypatch):
+    monkeypatch.setattr(config, '_global_config', config._build_from_dict({'presence': 'DayZ'}, config.GlobalConfig))
+    monkeypatch.setattr(managed_service, 'RESTART_BACKOFF_BASE', 0.05)
+    monkeypatch.setattr(client, 'CarimClient', FakeClient)
+    restarts = list()
+    service = discord_service.DiscordService()
+    monkeypatch.setattr(service, 'restart', lambda: restarts.append(1))
+    await service.start()
+    await asyncio.sleep(0.2)
+    assert [a.name for a in service.client.presences] == ['DayZ']
+    assert restarts == []
+    assert managed_service.get_supervisor().pending_restarts.get(service) is None
+    await managed_service.ManagedService.stop(service)
@@ -1,27 +1,88 @@
 import shlex
-from contextlib import nullcontext
 
 import pytest
 
-from carim_discord_bot.discord_client import arguments
+from carim_discord_bot.discord_client import arguments, command_grammar
 
 
-@pytest.mark.parametrize('raw_arg,expected_key,expected_value,expectation', [
-    ('--leaderboard kills', 'leaderboard', ['kills', 0], nullcontext()),
-    ('--leaderboard kills 0', 'leaderboard', ['kills', 0], nullcontext()),
-    ('--stats 12345', 'stats', [12345, 0], nullcontext()),
-    ('--stats 12345 0', 'stats', [12345, 0], nullcontext()),
-    ('--stats 12345 0 1', 'stats', [], pytest.raises(ValueError)),
-    ('--leaderboard kills nonnumber', 'leaderboard', [], pytest.raises(ValueError))
+@pytest.mark.parametrize('raw_arg,expected_key,expected_value,valid', [
+    ('--leaderboard kills', '--leaderboard', ('kills',), True),
+    ('--leaderboard kills 0', '--leaderboard', ('kills', 0), True),
+    ('--stats 12345', '--stats', (12345,), True),
+    ('--stats 12345 0', '--stats', (12345, 0), True),
+    ('--stats 12345 0 1', '--stats', None, False),
+    ('--leaderboard kills nonnumber', '--leaderboard', None, False),
+    ('--lead kills', '--leaderboard', ('kills',), True),
+    ('--stats=12345', '--stats', (12345,), True),
+    ('--stats', '--stats', None, False),
 ])
-def test_arg_parsing(raw_arg, expected_key, expected_value, expectation):
-    with expectation:
-        args = shlex.split(raw_arg)
-        parsed_args, _ = arguments.user_message_parser.parse_known_args(args)
-        assert expected_key in parsed_args
-        assert getattr(parsed_args, expected_key) == expected_value
+def test_arg_parsing(raw_arg, expected_key, expected_value, valid):
+    parsed_args = arguments.user_message_grammar.parse(raw_arg)
+    assert bool(parsed_args) == valid
+    if valid:
+        assert parsed_args.commands[expected_key] == expected_value
+    else:
+        assert parsed_args.error is not None
+
+
+@pytest.mark.parametrize('raw_arg,expected', [
+    ('--status', {'--status': ()}),
+    ('--help --version', {'--help': (), '--version': ()}),
+    ('--command', {'--command': ()}),
+    ('--command "say -1 hello there"', {'--command': ('say -1 hello there',)}),
+    ('--command players # trailing comment', {'--command': ('players',)}),
+    ('--create_priority 123 "a comment" -1', {'--create_priority': ('123', 'a comment', '-1')}),
+    ('--shutdown 30 --skip 1', {'--shutdown': (30,), '--skip': (1,)}),
+    ('--unknown value --kill', {'--kill': ()}),
+    ('--unknown value', {}),
+])
+def test_admin_parsing(raw_arg, expected):
+    parsed_args = arguments.message_grammar.parse(raw_arg)
+    assert parsed_args.error is None
+    assert parsed_args.commands == expected
+
+
+@pytest.mark.parametrize('raw_arg', [
+    '--s',
+    '--shutdown soon',
+    '--skip',
+    '--status=1',
+    '--command "unbalanced',
+    '--create_priority 123 comment',
+])
+def test_admin_parsing_errors(raw_arg):
+    parsed_args = arguments.message_grammar.parse(raw_arg)
+    assert not parsed_args
+    assert parsed_args.error is not None
+
+
+def test_unquoted_split_matches_shlex():
+    content = '--command  say\t-1 hi\r\nthere --skip 2'
+    assert command_grammar.split(content) == shlex.split(content, comments=True)
+
+
+@pytest.mark.asyncio
+async def test_dispatch_in_registration_order():
+    grammar = command_grammar.Grammar()
+    calls = list()
+
+    @grammar.command('--first')
+    async def first(context):
+        calls.append((context, 'first'))
+
+    @grammar.command('--second', metavar=('value', 'extra'), types=(int, str), required=1)
+    async def second(context, value, extra='default'):
+        calls.append((context, value, extra))
+
+    await grammar.dispatch(grammar.parse('--second 3 --first'), 'context')
+    assert calls == [('context', 'first'), ('context', 3, 'default')]
 
 
-@pytest.mark.skip
 def test_help():
-    assert '' == arguments.format_help()
+    help_text = arguments.format_help()
+    assert help_text.startswith('A helpful bot that can do a few things\n\ncommands:\n')
+    assert '  --shutdown [seconds]  shutdown the server in a safe manner with an optional delay\n' in help_text
+    assert '  --revoke_priority cftools_id\n                        revoke a queue priority entry\n' in help_text
+    assert '--secret' not in help_text
+    assert '--leaderboard' not in help_text
+    assert arguments.format_help() is help_text